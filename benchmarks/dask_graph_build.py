@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Time building the dask graph for a large grid of storage units.
+
+Builds a synthetic grid of in-memory storage units (tiles x tiles x timesteps) and times the two passes
+that place them in the output array: `_get_dimension_properties` and `get_dask_array`.
+
+    python benchmarks/dask_graph_build.py --tiles 100 --timesteps 2
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import click
+import numpy
+
+from datacube.api._api import _get_dimension_properties
+from datacube.api._dask import get_dask_array
+from datacube.api._storage import MemoryStorageUnit
+from datacube.model import Coordinate, Variable
+
+DIMENSIONS = ('time', 'y', 'x')
+
+
+def make_storage_units(tiles, timesteps, tile_size):
+    variables = {'band': Variable(numpy.dtype('int16'), -999, DIMENSIONS, '1')}
+    crs = dict((dim, None) for dim in DIMENSIONS)
+    storage_units = []
+    for t in range(timesteps):
+        for y in range(tiles):
+            for x in range(tiles):
+                coordinates = {
+                    'time': Coordinate(numpy.dtype('float64'), t * 100.0, t * 100.0 + 50, 2, 'seconds'),
+                    # Latitude style: decreasing
+                    'y': Coordinate(numpy.dtype('float64'), -y * tile_size, -(y + 1) * tile_size + 1, tile_size, 'm'),
+                    'x': Coordinate(numpy.dtype('float64'), x * tile_size, (x + 1) * tile_size - 1, tile_size, 'm'),
+                }
+                storage_units.append(MemoryStorageUnit(coordinates, variables, crs=crs))
+    return storage_units
+
+
+@click.command(help=__doc__)
+@click.option('--tiles', default=100, help='Number of tiles along each spatial dimension')
+@click.option('--timesteps', default=1, help='Number of storage units along time')
+@click.option('--tile-size', default=4000, help='Pixels along each side of a tile')
+def main(tiles, timesteps, tile_size):
+    storage_units = make_storage_units(tiles, timesteps, tile_size)
+    print('%d storage units' % len(storage_units))
+
+    start = time.time()
+    dim_props = _get_dimension_properties(storage_units, DIMENSIONS, {})
+    properties_time = time.time() - start
+
+    start = time.time()
+    array = get_dask_array(storage_units, 'band', DIMENSIONS, dim_props)
+    graph_time = time.time() - start
+
+    print('dimension properties: %.3f s' % properties_time)
+    print('dask graph:           %.3f s (%d tasks, shape %s)' % (graph_time, len(array.dask), array.shape))
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
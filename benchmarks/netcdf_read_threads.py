@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Measure threaded read throughput of NetCDF storage units under each locking mode.
+
+Writes a set of compressed, chunked NetCDF files to a temporary directory, then reads every chunk of every
+file from a pool of threads, as the threaded dask scheduler does for `get_dask_array`.
+
+    python benchmarks/netcdf_read_threads.py --files 8 --threads 1 --threads 2 --threads 4 --threads 8
+
+Modes other than 'global' are only safe with a thread-safe build of HDF5.
+"""
+from __future__ import absolute_import, division, print_function
+
+import itertools
+import shutil
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+
+import click
+import netCDF4
+import numpy
+
+from datacube.storage.access.backends import netcdf
+
+
+def _write_file(path, shape, chunks):
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as ncds:
+        for name, size in zip(('time', 'y', 'x'), shape):
+            ncds.createDimension(name, size)
+            ncds.createVariable(name, 'f8', (name,))[:] = numpy.arange(size)
+        var = ncds.createVariable('band', 'i2', ('time', 'y', 'x'), zlib=True, chunksizes=chunks)
+        var[:] = numpy.random.randint(0, 10000, size=shape).astype('int16')
+
+
+def _chunk_slices(shape, chunks):
+    ranges = [range(0, size, chunk) for size, chunk in zip(shape, chunks)]
+    for starts in itertools.product(*ranges):
+        yield tuple(slice(start, start + chunk) for start, chunk in zip(starts, chunks))
+
+
+@click.command(help=__doc__)
+@click.option('--files', default=8, help='Number of storage units')
+@click.option('--size', default=1000, help='Size of the spatial dimensions')
+@click.option('--timesteps', default=4, help='Size of the time dimension')
+@click.option('--chunk', default=250, help='Spatial chunk size')
+@click.option('--threads', '-t', multiple=True, type=int, help='Thread counts to measure (repeatable)')
+@click.option('--mode', '-m', multiple=True, type=click.Choice(netcdf.LOCKING_MODES),
+              help='Locking modes to measure (repeatable)')
+def main(files, size, timesteps, chunk, threads, mode):
+    threads = threads or (1, 2, 4, 8)
+    modes = mode or netcdf.LOCKING_MODES
+    shape = (timesteps, size, size)
+    chunks = (1, chunk, chunk)
+
+    tmpdir = tempfile.mkdtemp(prefix='datacube-bench-')
+    try:
+        paths = ['%s/su_%d.nc' % (tmpdir, i) for i in range(files)]
+        for path in paths:
+            _write_file(path, shape, chunks)
+        units = [netcdf.NetCDF4StorageUnit.from_file(path) for path in paths]
+        tasks = [(unit, index) for unit in units for index in _chunk_slices(shape, chunks)]
+        total_mb = len(units) * numpy.prod(shape) * 2 / 2.0 ** 20
+
+        # Warm the handle pool and the OS page cache, so only decompression and locking are measured
+        for unit, index in tasks:
+            unit.get_chunk('band', index)
+
+        print('%d storage units, %d chunks, %.1f MB' % (len(units), len(tasks), total_mb))
+        print('%-8s %8s %10s %8s' % ('mode', 'threads', 'MB/s', 'speedup'))
+        for locking_mode in modes:
+            netcdf.set_locking(locking_mode)
+            baseline = None
+            for thread_count in threads:
+                pool = ThreadPool(thread_count)
+                start = time.time()
+                pool.map(lambda task: task[0].get_chunk('band', task[1]), tasks)
+                elapsed = time.time() - start
+                pool.close()
+                throughput = total_mb / elapsed
+                baseline = baseline or throughput
+                print('%-8s %8d %10.1f %8.2f' % (locking_mode, thread_count, throughput, throughput / baseline))
+    finally:
+        netcdf.HANDLE_POOL.clear()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Time the splitting of storage units into runs along an irregular (time) dimension.
+
+Builds synthetic in-memory storage units, each holding a random subset of the time steps, and times
+`_stratify_irregular_dimension` over them.
+
+    python benchmarks/stratify_irregular.py --timesteps 10000 --units 1000
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import click
+import numpy
+
+from datacube.api._storage import MemoryStorageUnit
+from datacube.api._stratify import _stratify_irregular_dimension
+from datacube.model import Coordinate, Variable
+
+
+def make_storage_units(timesteps, units, coverage, seed=0):
+    random = numpy.random.RandomState(seed)
+    all_times = numpy.cumsum(random.randint(1, 16 * 86400, size=timesteps)).astype('float64')
+    variables = {'band': Variable(numpy.dtype('int16'), -999, ('time',), '1')}
+
+    storage_units = []
+    for _ in range(units):
+        times = all_times[random.random_sample(timesteps) < coverage]
+        if times.size == 0:
+            times = all_times[:1]
+        coordinates = {'time': Coordinate(times.dtype, times[0], times[-1], times.size, 'seconds')}
+        storage_units.append(MemoryStorageUnit(coordinates, variables, coodinate_values={'time': times}))
+    return storage_units
+
+
+@click.command(help=__doc__)
+@click.option('--timesteps', default=10000, help='Number of distinct time steps')
+@click.option('--units', default=1000, help='Number of storage units')
+@click.option('--coverage', default=0.05, help='Fraction of the time steps in each storage unit')
+@click.option('--repeat', default=3, help='Number of timed runs')
+def main(timesteps, units, coverage, repeat):
+    storage_units = make_storage_units(timesteps, units, coverage)
+    total = sum(su.coordinates['time'].length for su in storage_units)
+    print('%d storage units, %d time steps, %d coordinates' % (units, timesteps, total))
+
+    for _ in range(repeat):
+        start = time.time()
+        stratified = _stratify_irregular_dimension(storage_units, 'time')
+        print('%d slices in %.3f s' % (len(stratified), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Measure how long it takes to work out the tiles covered by many dataset footprints.
+
+Generates synthetic Landsat-sized scenes in geographic coordinates across Australia, and tiles them onto a
+100km Albers grid. Compares the vectorised footprint rasterisation with the previous approach, which built
+OGR geometries and a coordinate transformation for every candidate tile:
+
+    python benchmarks/tile_footprints.py --count 100000 --legacy-count 2000
+
+The legacy approach is timed on a sample (`--legacy-count`), and its time extrapolated to the full count.
+The tiles found are compared on that sample.
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+from collections import namedtuple, defaultdict
+
+import click
+import numpy
+from rasterio.coords import BoundingBox
+from rasterio.warp import transform_bounds
+
+from datacube.storage.tiling import _grid_datasets
+
+Dataset = namedtuple('Dataset', ['crs', 'bounds'])
+
+GRID_CRS = 'EPSG:3577'
+GRID_SIZE = (100000, 100000)
+
+
+def _synthetic_datasets(count, seed=0):
+    rng = numpy.random.RandomState(seed)
+    lons = rng.uniform(113, 152, count)
+    lats = rng.uniform(-43, -11, count)
+    return [Dataset('EPSG:4326', BoundingBox(lon, lat, lon + 1.8, lat + 1.6)) for lon, lat in zip(lons, lats)]
+
+
+def _legacy_grid_datasets(datasets, bounds_override, grid_proj, grid_size):
+    tiles = defaultdict(list)
+    for dataset in datasets:
+        dataset_proj = dataset.crs
+        dataset_bounds = dataset.bounds
+        bounds = bounds_override or BoundingBox(*transform_bounds(dataset_proj, grid_proj, *dataset_bounds))
+
+        for y in range(int(bounds.bottom // grid_size[1]), int(bounds.top // grid_size[1]) + 1):
+            for x in range(int(bounds.left // grid_size[0]), int(bounds.right // grid_size[0]) + 1):
+                tile_index = (x, y)
+                if _legacy_check_intersect(tile_index, grid_size, grid_proj, dataset_bounds, dataset_proj):
+                    tiles[tile_index].append(dataset)
+
+    return tiles
+
+
+def _legacy_check_intersect(tile_index, tile_size, tile_crs, dataset_bounds, dataset_crs):
+    from osgeo import osr
+
+    tile_sr = osr.SpatialReference()
+    tile_sr.SetFromUserInput(tile_crs)
+    dataset_sr = osr.SpatialReference()
+    dataset_sr.SetFromUserInput(dataset_crs)
+    transform = osr.CoordinateTransformation(tile_sr, dataset_sr)
+
+    tile_poly = _legacy_poly_from_bounds(tile_index[0] * tile_size[0],
+                                         tile_index[1] * tile_size[1],
+                                         (tile_index[0] + 1) * tile_size[0],
+                                         (tile_index[1] + 1) * tile_size[1],
+                                         32)
+    tile_poly.Transform(transform)
+
+    return tile_poly.Intersects(_legacy_poly_from_bounds(*dataset_bounds))
+
+
+def _legacy_poly_from_bounds(left, bottom, right, top, segments=None):
+    from osgeo import ogr
+
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    ring.AddPoint(left, bottom)
+    ring.AddPoint(left, top)
+    ring.AddPoint(right, top)
+    ring.AddPoint(right, bottom)
+    ring.AddPoint(left, bottom)
+    if segments:
+        ring.Segmentize(2 * (right + top - left - bottom) / segments)
+    poly = ogr.Geometry(ogr.wkbPolygon)
+    poly.AddGeometry(ring)
+    return poly
+
+
+def _dataset_tiles(tiles):
+    by_dataset = defaultdict(set)
+    for tile_index, datasets in tiles.items():
+        for dataset in datasets:
+            by_dataset[dataset].add(tile_index)
+    return by_dataset
+
+
+def _time(grid_datasets, datasets):
+    start = time.time()
+    tiles = grid_datasets(datasets, None, GRID_CRS, GRID_SIZE)
+    return time.time() - start, tiles
+
+
+@click.command(help=__doc__)
+@click.option('--count', default=100000, help='Number of dataset footprints')
+@click.option('--legacy-count', default=2000, help='Number of footprints to time the legacy approach on')
+def main(count, legacy_count):
+    datasets = _synthetic_datasets(count)
+
+    elapsed, tiles = _time(_grid_datasets, datasets)
+    click.echo('vectorised: %d footprints, %d tiles in %.2fs (%.0f footprints/s)' %
+               (count, len(tiles), elapsed, count / elapsed))
+
+    if not legacy_count:
+        return
+
+    sample = datasets[:legacy_count]
+    legacy_elapsed, legacy_tiles = _time(_legacy_grid_datasets, sample)
+    click.echo('legacy: %d footprints in %.2fs (%.0f footprints/s), ~%.0fs for %d' %
+               (legacy_count, legacy_elapsed, legacy_count / legacy_elapsed,
+                legacy_elapsed * count / legacy_count, count))
+
+    new_tiles = _dataset_tiles(_grid_datasets(sample, None, GRID_CRS, GRID_SIZE))
+    legacy_tiles = _dataset_tiles(legacy_tiles)
+    differing = sum(1 for dataset in sample if new_tiles[dataset] != legacy_tiles[dataset])
+    click.echo('%d of %d footprints tiled differently' % (differing, legacy_count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Measure how often warp plans are recomputed when writing a storage unit tile, by order of writing.
+
+Fetches the plan of every row of chunks of every band of a tile (reprojected from a geographic source), either a
+row at a time across all bands (as storage units are written) or a band at a time, and reports the plans built
+and time taken with each cache size.
+
+    python benchmarks/warp_plan_cache.py --tile 4000 --chunk 500 --bands 6 --cache-mb 64 --cache-mb 256
+"""
+from __future__ import absolute_import, division, print_function
+
+import time
+
+import click
+import rasterio.warp
+from affine import Affine
+from rasterio.warp import RESAMPLING
+
+from datacube.storage import warp
+
+SRC_CRS = 'EPSG:4326'
+DST_CRS = 'EPSG:3577'
+
+
+def _row_plan_args(tile, chunk, row, resampling):
+    src_transform = Affine(0.00025, 0, 148.0, 0, -0.00025, -35.0)
+    (x,), (y,) = rasterio.warp.transform(SRC_CRS, DST_CRS, [148.0 + tile * 0.000125], [-35.0 - tile * 0.000125])
+    dst_transform = Affine(25, 0, x - tile * 12.5, 0, -25, y + tile * 12.5) * Affine.translation(0, row * chunk)
+    return (src_transform, SRC_CRS, (tile, tile), dst_transform, DST_CRS, (min(chunk, tile - row * chunk), tile),
+            resampling)
+
+
+@click.command(help=__doc__)
+@click.option('--tile', default=4000, help='Size of the tile, in pixels')
+@click.option('--chunk', default=500, help='Rows per chunk')
+@click.option('--bands', default=6, help='Bands per tile')
+@click.option('--resampling', type=click.Choice(['nearest', 'bilinear']), default='bilinear')
+@click.option('--cache-mb', multiple=True, type=int, help='Plan cache sizes to measure (repeatable)')
+def main(tile, chunk, bands, resampling, cache_mb):
+    resampling = getattr(RESAMPLING, resampling)
+    rows = range((tile + chunk - 1) // chunk)
+    orders = {
+        'row': [(row, band) for row in rows for band in range(bands)],
+        'band': [(row, band) for band in range(bands) for row in rows],
+    }
+
+    built = []
+    make_warp_plan = warp.make_warp_plan
+
+    def counting_make_warp_plan(*args):
+        built.append(args)
+        return make_warp_plan(*args)
+    warp.make_warp_plan = counting_make_warp_plan
+
+    print('%-6s %9s %7s %8s' % ('order', 'cache MB', 'plans', 'seconds'))
+    for cache_size in cache_mb or (warp.MAX_CACHED_PLAN_BYTES // 2 ** 20,):
+        for order, fetches in sorted(orders.items()):
+            warp.set_plan_cache_size(cache_size * 2 ** 20)
+            del built[:]
+            start = time.time()
+            for row, _ in fetches:
+                warp.get_warp_plan(*_row_plan_args(tile, chunk, row, resampling))
+            print('%-6s %9d %7d %8.2f' % (order, cache_size, len(built), time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
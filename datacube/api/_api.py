@@ -18,6 +18,7 @@ Storage Query and Access API module
 
 from __future__ import absolute_import, division, print_function
 
+import copy
 import logging
 import datetime
 import itertools
@@ -29,17 +30,26 @@ from dateutil import tz
 
 from datacube.index import index_connect
 from datacube.compat import string_types
+from datacube.model import _uri_to_local_path
+from datacube.storage.access.core import StorageUnitSliceProxy
+from datacube.storage.access.indexing import range_to_index
 
 from ._conversion import convert_descriptor_query_to_search_query, convert_descriptor_dims_to_selector_dims
 from ._conversion import convert_request_args_to_descriptor_query
 from ._conversion import dimension_ranges_to_selector, dimension_ranges_to_iselector, to_datetime
+from ._catalogue import StorageUnitCatalogue, selection_ranges, IRREGULAR_DIMENSIONS
 from ._dask import get_dask_array
-from ._storage import StorageUnitCollection
-from ._storage import make_storage_unit, make_storage_unit_collection_from_descriptor
+from ._storage import StorageUnitCollection, get_storage_type_variables
+from ._storage import make_storage_units, make_storage_unit_collection_from_descriptor
 from ._stratify import _stratify_irregular_dimension
 
 _LOG = logging.getLogger(__name__)
 
+#: Storage unit properties needed to read data. (Fetching their dataset ids is costly, and they are not used)
+_STORAGE_UNIT_COLUMNS = ['id', 'path', 'descriptor', 'storage_type_ref']
+
+_SPATIAL_DIMENSIONS = ('latitude', 'longitude', 'lat', 'lon', 'x', 'y')
+
 
 class API(object):
     def __init__(self, index=None):
@@ -150,33 +160,35 @@ class API(object):
             }
         """
         descriptor_request = descriptor_request or {}
-        storage_units_by_type = _get_storage_units(descriptor_request, self.index, is_diskless=True)
+        catalogue = _search_catalogue(descriptor_request, self.index)
         variables = descriptor_request.get('variables', None)
         descriptor = {}
-        for stype, storage_units in storage_units_by_type.items():
-            # Group by dimension
+        for storage_type, units in _group_by_storage_type(catalogue, self.index):
+            if not storage_type.measurements:
+                continue
+            dimensions = tuple(storage_type.dimensions)
             dimension_ranges = convert_descriptor_dims_to_selector_dims(descriptor_request.get('dimensions', {}),
-                                                                        storage_units.get_spatial_crs())
-            storage_units_by_dimensions = storage_units.group_by_dimensions()
-            for dimensions, grouped_storage_units in storage_units_by_dimensions.items():
-                result = descriptor.setdefault(stype, {
-                    'dimensions': list(dimensions),
-                    'variables': {},
-                    'result_min': None,
-                    'result_max': None,
-                    'result_shape': None,
-                    'irregular_indices': None,
-                })
-                for var_name, var in grouped_storage_units.get_variables().items():
+                                                                        _get_spatial_crs(storage_type))
+            result = descriptor.setdefault(storage_type.name, {
+                'dimensions': list(dimensions),
+                'variables': {},
+                'result_min': None,
+                'result_max': None,
+                'result_shape': None,
+                'irregular_indices': None,
+            })
+            if len(dimensions) == 3:
+                for var_name, var in get_storage_type_variables(storage_type).items():
                     if variables is None or var_name in variables:
                         result['variables'][var_name] = {
                             'datatype_name': var.dtype,
                             'nodata_value': var.nodata,
                         }
-                if include_storage_units:
-                    result['storage_units'] = grouped_storage_units.get_storage_unit_stats(dimensions)
-                result.update(_get_result_stats(grouped_storage_units.get_storage_units(),
-                                                dimensions, dimension_ranges))
+            if include_storage_units:
+                result['storage_units'] = _get_storage_unit_stats(units, storage_type, dimensions)
+            storage_units = make_storage_units(_prune_catalogue(units, dimensions, dimension_ranges), storage_type,
+                                               is_diskless=True)
+            result.update(_get_result_stats(storage_units, dimensions, dimension_ranges))
         return descriptor
 
     def get_data(self, descriptor=None, storage_units=None):
@@ -280,22 +292,16 @@ class API(object):
         descriptor_dimensions = descriptor_request.get('dimensions', {})
         variables = [variables] if isinstance(variables, string_types) else variables
 
-        query = convert_descriptor_query_to_search_query(descriptor_request)
-        storage_units_by_type = defaultdict(StorageUnitCollection)
-        su_id = set()
-        for su in self.index.storage.search_eager(**query):
-            if su.id not in su_id:
-                su_id.add(su.id)
-                storage_units_by_type[su.storage_type.name].append(make_storage_unit(su))
-
-        for stype, storage_units in storage_units_by_type.items():
+        catalogue = _search_catalogue(descriptor_request, self.index)
+        for storage_type, units in _group_by_storage_type(catalogue, self.index):
             dimension_ranges = convert_descriptor_dims_to_selector_dims(descriptor_dimensions,
-                                                                        storage_units.get_spatial_crs())
-            data_dicts = _get_data_from_storage_units(storage_units.iteritems(), variables, dimension_ranges,
-                                                      set_nan=set_nan)
+                                                                        _get_spatial_crs(storage_type))
+            storage_units = make_storage_units(_prune_catalogue(units, storage_type.dimensions, dimension_ranges),
+                                               storage_type)
+            data_dicts = _get_data_from_storage_units(storage_units, variables, dimension_ranges, set_nan=set_nan)
             if len(data_dicts) and len(data_dicts[0]):
                 data_dict = data_dicts[0][0]
-                return _stack_vars(data_dict, var_dim_name, stack_name=stype)
+                return _stack_vars(data_dict, var_dim_name, stack_name=storage_type.name)
             # for i, (data_dict, _) in enumerate(data_dicts):
             #     #stype_label = '{}.{}'.format(stype, i) if len(data_dicts) > 1 else stype
             #     return _stack_vars(data_dict, var_dim_name, stack_name=stype)
@@ -314,24 +320,20 @@ class API(object):
         descriptor_dimensions = descriptor_request.get('dimensions', {})
         variables = [variables] if isinstance(variables, string_types) else variables
 
-        query = convert_descriptor_query_to_search_query(descriptor_request)
-        storage_units_by_type = defaultdict(StorageUnitCollection)
-        storage_unit_types = {}
-        for su in self.index.storage.search(**query):
-            storage_units_by_type[su.storage_type.name].append(make_storage_unit(su))
-            storage_unit_types[su.storage_type.name] = su.storage_type
+        catalogue = _search_catalogue(descriptor_request, self.index)
 
         #TODO: return multiple storage types if compatible
         # or warp / reproject / resample if required?
         # including realigning timestamps
         # and dealing with each storage unit having an extra_metadata field...
-        for stype, storage_units in storage_units_by_type.items():
-            storage_unit_type = storage_unit_types[stype]
+        for storage_type, units in _group_by_storage_type(catalogue, self.index):
             dimension_ranges = convert_descriptor_dims_to_selector_dims(descriptor_dimensions,
-                                                                        storage_units.get_spatial_crs())
-            data_dicts = _get_data_from_storage_units(storage_units.iteritems(), variables,
+                                                                        _get_spatial_crs(storage_type))
+            storage_units = make_storage_units(_prune_catalogue(units, storage_type.dimensions, dimension_ranges),
+                                               storage_type)
+            data_dicts = _get_data_from_storage_units(storage_units, variables,
                                                       dimension_ranges, set_nan=set_nan)
-            return _make_xarray_dataset(data_dicts, storage_unit_type)
+            return _make_xarray_dataset(data_dicts, storage_type)
         return xarray.Dataset()
 
     def list_storage_units(self, **kwargs):
@@ -343,7 +345,7 @@ class API(object):
         """
         descriptor_request = kwargs
         query = convert_descriptor_query_to_search_query(descriptor_request)
-        sus = self.index.storage.search(**query)
+        sus = self.index.storage.search(columns=_STORAGE_UNIT_COLUMNS, **query)
         output_set = set()
         for su in sus:
             output_set.add(str(su.local_path))
@@ -398,38 +400,94 @@ def _get_dimension_properties(storage_units, dimensions, dimension_ranges):
         'sus_size': {},
         'coord_labels': {},
         'dim_vals': {},
+        'ordinals': {},
         'coordinate_reference_systems': {},
         'dimension_ranges': dimension_ranges,
     }
-    sample = list(storage_units)[0]
+    storage_units = list(storage_units)
+    catalogue = StorageUnitCatalogue.from_storage_units(storage_units, dimensions)
+    sample = storage_units[0]
     # Get the start value of the storage unit so we can sort them
     # Some dims are stored upside down (eg Latitude), so sort the tiles consistent with the bounding box order
-    dim_props['reverse'] = dict((dim, sample.coordinates[dim].begin > sample.coordinates[dim].end)
+    dim_props['reverse'] = dict((dim, bool(sample.coordinates[dim].begin > sample.coordinates[dim].end))
                                 for dim in dimensions if dim in sample.coordinates)
+    sample_crs = sample.get_crs()
     for dim in dimensions:
-        dim_props['dim_vals'][dim] = sorted(set(su.coordinates[dim].begin
-                                                for su in storage_units
-                                                if dim in su.coordinates),
-                                            reverse=dim_props['reverse'][dim])
-        dim_props['coordinate_reference_systems'][dim] = sample.get_crs()[dim]
-
-    coord_lists = {}
-    for su in storage_units:
-        for dim in dimensions:
-            dim_val_len = len(dim_props['dim_vals'][dim])
-            ordinal = dim_props['dim_vals'][dim].index(su.coordinates[dim].begin)
-            dim_props['sus_size'].setdefault(dim, [None] * dim_val_len)[ordinal] = su.coordinates[dim].length
-            coord_list = coord_lists.setdefault(dim, [None] * dim_val_len)
-            # We only need the coords once, so don't open up every file if we don't need to - su.get_coord()
-            # TODO: if we tried against the diagonal first, we might get all coords in max(shape) rather than sum(shape)
-            if coord_list[ordinal] is None:
-                coord_list[ordinal], _ = su.get_coord(dim)
-    for dim in dimensions:
-        dim_props['coord_labels'][dim] = list(itertools.chain(*coord_lists[dim]))
+        dim_vals, ordinals = catalogue.ordinals(dim, reverse=dim_props['reverse'][dim])
+        dim_props['dim_vals'][dim] = dim_vals
+        # Position of each storage unit in the grid, looked up by the start of its coordinate
+        dim_props['ordinals'][dim] = dict((value, ordinal) for ordinal, value in enumerate(dim_vals))
+        dim_props['coordinate_reference_systems'][dim] = sample_crs[dim]
+        dim_props['sus_size'][dim] = catalogue.lengths_by_ordinal(dim, ordinals, dim_vals.size)
+
+        # We only need the coords once, so don't open up every file if we don't need to - su.get_coord()
+        # TODO: if we tried against the diagonal first, we might get all coords in max(shape) rather than sum(shape)
+        present = numpy.flatnonzero(ordinals >= 0)
+        _, first = numpy.unique(ordinals[present], return_index=True)
+        dim_props['coord_labels'][dim] = list(itertools.chain(*[storage_units[position].get_coord(dim)[0]
+                                                                 for position in present[first]]))
     _fix_custom_dimensions(dimensions, dim_props)
     return dim_props
 
 
+def _search_catalogue(descriptor_request, index):
+    """
+    Search for the storage units covered by a descriptor query
+
+    :rtype: StorageUnitCatalogue
+    """
+    query = convert_descriptor_query_to_search_query(descriptor_request, index)
+    _LOG.debug("Database storage search %s", query)
+    rows = index.storage.search_rows(columns=_STORAGE_UNIT_COLUMNS, **query)
+    return StorageUnitCatalogue.from_rows(rows).unique()
+
+
+def _group_by_storage_type(catalogue, index):
+    """
+    :rtype: list[(datacube.model.StorageType, StorageUnitCatalogue)]
+    """
+    return [(index.storage.types.get(storage_type_id), units)
+            for storage_type_id, units in catalogue.group_by_storage_type()]
+
+
+def _get_spatial_crs(storage_type):
+    if any(dim in _SPATIAL_DIMENSIONS for dim in storage_type.dimensions):
+        return storage_type.crs
+    return None
+
+
+def _prune_catalogue(catalogue, dimensions, dimension_ranges):
+    """
+    Drop the storage units entirely outside the requested dimension ranges, before making access objects for
+    them. As in `_window_storage_units`, if none intersect they are all kept, for the selectors to produce the
+    empty result.
+    """
+    ranges = selection_ranges(dimensions, dimension_ranges)
+    if not ranges:
+        return catalogue
+    intersecting = catalogue.intersects(ranges)
+    if not intersecting.any():
+        return catalogue
+    return catalogue.select(intersecting)
+
+
+def _get_storage_unit_stats(catalogue, storage_type, dimensions):
+    """
+    Storage unit stats (as `StorageUnitCollection.get_storage_unit_stats`) from the index, only making access
+    objects for storage units whose irregular coordinates weren't recorded there.
+    """
+    paths = [_uri_to_local_path(storage_type.resolve_location(path)) for path in catalogue.paths]
+
+    def irregular_coord(position, dim):
+        coordinate = catalogue.descriptors[position]['coordinates'][dim]
+        if 'values' in coordinate:
+            return coordinate['values']
+        storage_unit, = make_storage_units(catalogue.select([position]), storage_type, is_diskless=True)
+        return storage_unit.get_coord(dim)[0]
+
+    return catalogue.stats(dimensions, paths, irregular_coord)
+
+
 def _get_storage_units(descriptor_request=None, index=None, is_diskless=False):
     '''
     Given a descriptor query, get the storage units covered
@@ -439,14 +497,9 @@ def _get_storage_units(descriptor_request=None, index=None, is_diskless=False):
     :return: StorageUnitCollection
     '''
     index = index or index_connect()
-    query = convert_descriptor_query_to_search_query(descriptor_request, index)
-    _LOG.debug("Database storage search %s", query)
-    sus = index.storage.search(**query)
-    storage_units_by_type = defaultdict(StorageUnitCollection)
-    for su in sus:
-        unit = make_storage_unit(su, is_diskless=is_diskless)
-        storage_units_by_type[su.storage_type.name].append(unit)
-    return storage_units_by_type
+    catalogue = _search_catalogue(descriptor_request, index)
+    return dict((storage_type.name, StorageUnitCollection(make_storage_units(units, storage_type, is_diskless)))
+                for storage_type, units in _group_by_storage_type(catalogue, index))
 
 
 def _create_data_response(xarrays, dimensions):
@@ -509,7 +562,61 @@ def _fix_custom_dimensions(dimensions, dim_props):
     return dimension_ranges, coord_labels
 
 
+def _window_storage_units(storage_units_by_variable, dimensions, dimension_ranges):
+    """
+    Restrict each storage unit to the hyperslab inside the requested dimension ranges.
+
+    Storage units entirely outside the ranges are dropped. Single value (nearest) selections are left to xarray.
+    :param storage_units_by_variable: dict of variable name -> list of storage units
+    :param dimension_ranges: dict of dimension name -> {'range': (begin, end)}, in storage CRS
+    :return: dict of variable name -> list of storage units
+    """
+    ranges = selection_ranges(dimensions, dimension_ranges)
+    if not ranges:
+        return storage_units_by_variable
+
+    # Storage units in the same row or column of the grid share regular coordinates, so only look them up once
+    index_cache = {}
+    windows = {}
+    for storage_unit in set(itertools.chain(*storage_units_by_variable.values())):
+        windows[storage_unit] = _window_storage_unit(storage_unit, ranges, index_cache)
+
+    windowed = dict((var_name, [windows[su] for su in storage_units if windows[su] is not None])
+                    for var_name, storage_units in storage_units_by_variable.items())
+    windowed = dict((var_name, storage_units) for var_name, storage_units in windowed.items() if storage_units)
+    if not windowed:
+        # Nothing intersects: let the selectors produce the empty result
+        return storage_units_by_variable
+    return windowed
+
+
+def _window_storage_unit(storage_unit, ranges, index_cache):
+    slices = {}
+    for dim, range_ in ranges.items():
+        if dim not in storage_unit.coordinates:
+            continue
+        coord = storage_unit.coordinates[dim]
+        if dim in IRREGULAR_DIMENSIONS:
+            # Irregular coordinates with the same extent can still have different labels
+            index = range_to_index(storage_unit.get_coord(dim)[0], range_)
+        else:
+            cache_key = (dim, coord.begin, coord.end, coord.length)
+            if cache_key not in index_cache:
+                index_cache[cache_key] = range_to_index(storage_unit.get_coord(dim)[0], range_)
+            index = index_cache[cache_key]
+        if index.stop <= index.start:
+            return None
+        if index.stop - index.start < coord.length:
+            slices[dim] = index
+    if not slices:
+        return storage_unit
+    return StorageUnitSliceProxy(storage_unit, **slices)
+
+
 def _get_data_array_dict(storage_units_by_variable, dimensions, dimension_ranges, fake_array=False, set_nan=False):
+    # Converting the time range to datetimes below must not leak into other dimension groups
+    dimension_ranges = copy.deepcopy(dimension_ranges)
+    storage_units_by_variable = _window_storage_units(storage_units_by_variable, dimensions, dimension_ranges)
     sus_with_dims = set(itertools.chain(*storage_units_by_variable.values()))
     dim_props = _get_dimension_properties(sus_with_dims, dimensions, dimension_ranges)
     selectors = dimension_ranges_to_selector(dim_props['dimension_ranges'], dim_props['reverse'])
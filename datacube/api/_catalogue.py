@@ -0,0 +1,253 @@
+# coding=utf-8
+"""
+A columnar catalogue of storage units, for planning queries over many of them at once.
+"""
+from __future__ import absolute_import, division, print_function
+
+from collections import namedtuple
+from operator import getitem
+
+import numpy
+
+from datacube.model import Range
+
+#: Dimensions whose coordinate labels are listed in storage unit stats
+IRREGULAR_DIMENSIONS = ('time', 't')  # TODO: Use irregular flag from database instead
+
+#: The coordinates of every storage unit along one dimension. `present` is False for units without the
+#: dimension: their other values are placeholders.
+DimensionColumns = namedtuple('DimensionColumns', ('begin', 'end', 'length', 'present'))
+
+
+class StorageUnitCatalogue(object):
+    """
+    Storage units as columns of NumPy arrays, one element per storage unit, so they can be grouped, sorted and
+    filtered without visiting each.
+
+    >>> catalogue = StorageUnitCatalogue.from_rows([
+    ...     {'id': 1, 'storage_type_ref': 5, 'path': 'a.nc',
+    ...      'descriptor': {'tile_index': [1, 2], 'coordinates': {'x': {'begin': 0, 'end': 90, 'length': 10}}}},
+    ...     {'id': 2, 'storage_type_ref': 5, 'path': 'b.nc',
+    ...      'descriptor': {'tile_index': [2, 2], 'coordinates': {'x': {'begin': 100, 'end': 190, 'length': 10}}}},
+    ... ])
+    >>> values, ordinals = catalogue.ordinals('x', reverse=True)
+    >>> values.tolist(), ordinals.tolist()
+    ([100, 0], [1, 0])
+    >>> catalogue.intersects({'x': Range(95, 150)}).tolist()
+    [False, True]
+    """
+
+    def __init__(self, ids, storage_type_ids, paths, tile_indexes, dimensions, descriptors=None):
+        """
+        :param ids: database id of each storage unit
+        :param storage_type_ids: database id of the storage type of each storage unit
+        :param paths: path of each storage unit
+        :param tile_indexes: (x, y) tile index of each storage unit. NaN for units indexed without one
+        :type dimensions: dict[str, DimensionColumns]
+        :param descriptors: the descriptor of each storage unit, if built from the index
+        """
+        self.ids = numpy.asarray(ids, dtype=numpy.int64)
+        self.storage_type_ids = numpy.asarray(storage_type_ids, dtype=numpy.int64)
+        self.paths = _object_array(paths)
+        self.tile_indexes = numpy.asarray(tile_indexes, dtype=numpy.float64).reshape(-1, 2)
+        self.dimensions = dimensions
+        self.descriptors = _object_array(descriptors) if descriptors is not None else None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build a catalogue from storage unit search results, with at least the columns 'id', 'storage_type_ref',
+        'path' and 'descriptor'.
+
+        :type rows: collections.Iterable[dict]
+        :rtype: StorageUnitCatalogue
+        """
+        ids, storage_type_ids, paths, tile_indexes, descriptors = [], [], [], [], []
+        for row in rows:
+            descriptor = row['descriptor']
+            ids.append(row['id'])
+            storage_type_ids.append(row['storage_type_ref'])
+            paths.append(row['path'])
+            tile_indexes.append(descriptor.get('tile_index') or (numpy.nan, numpy.nan))
+            descriptors.append(descriptor)
+        coordinates = [descriptor['coordinates'] for descriptor in descriptors]
+        return cls(ids, storage_type_ids, paths, tile_indexes,
+                   _dimension_columns(coordinates, getitem), descriptors)
+
+    @classmethod
+    def from_storage_units(cls, storage_units, dimensions=None):
+        """
+        Build a catalogue of the coordinates of storage unit access objects. Ids, storage types and tile indexes
+        are not known: they are left as -1 and NaN.
+
+        :type storage_units: list[datacube.storage.access.core.StorageUnitBase]
+        :param dimensions: only these dimensions. All if None.
+        :rtype: StorageUnitCatalogue
+        """
+        coordinates = [unit.coordinates for unit in storage_units]
+        if dimensions is not None:
+            coordinates = [dict((dim, coords[dim]) for dim in dimensions if dim in coords) for coords in coordinates]
+        count = len(coordinates)
+        return cls(numpy.full(count, -1), numpy.full(count, -1),
+                   [getattr(unit, 'file_path', None) for unit in storage_units],
+                   numpy.full((count, 2), numpy.nan),
+                   _dimension_columns(coordinates, getattr))
+
+    def __len__(self):
+        return self.ids.size
+
+    def select(self, index):
+        """
+        A catalogue of some of the storage units.
+
+        :param index: boolean mask, or positions, of the storage units to keep
+        :rtype: StorageUnitCatalogue
+        """
+        return StorageUnitCatalogue(self.ids[index], self.storage_type_ids[index], self.paths[index],
+                                    self.tile_indexes[index],
+                                    dict((dim, DimensionColumns(*(column[index] for column in columns)))
+                                         for dim, columns in self.dimensions.items()),
+                                    self.descriptors[index] if self.descriptors is not None else None)
+
+    def unique(self):
+        """
+        Drop repeated storage units (by id), keeping the first of each.
+
+        :rtype: StorageUnitCatalogue
+        """
+        _, first = numpy.unique(self.ids, return_index=True)
+        if first.size == len(self):
+            return self
+        return self.select(numpy.sort(first))
+
+    def group_by_storage_type(self):
+        """
+        Split the catalogue by storage type, in order of each type's first storage unit.
+
+        :rtype: list[(int, StorageUnitCatalogue)]
+        """
+        type_ids, first, inverse = numpy.unique(self.storage_type_ids, return_index=True, return_inverse=True)
+        return [(int(type_ids[group]), self.select(numpy.flatnonzero(inverse.ravel() == group)))
+                for group in numpy.argsort(first)]
+
+    def ordinals(self, dim, reverse=False):
+        """
+        The distinct starting coordinates of the storage units along a dimension, in order, and the position
+        (ordinal) of each storage unit amongst them. Units without the dimension have ordinal -1.
+
+        :param reverse: in descending order (eg. for latitudes stored north to south)
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        columns = self.dimensions[dim]
+        values, inverse = numpy.unique(columns.begin[columns.present], return_inverse=True)
+        inverse = inverse.ravel()
+        if reverse:
+            values, inverse = values[::-1], values.size - 1 - inverse
+        ordinals = numpy.full(len(self), -1, dtype=numpy.int64)
+        ordinals[columns.present] = inverse
+        return values, ordinals
+
+    def lengths_by_ordinal(self, dim, ordinals, count):
+        """
+        The length of the storage units at each ordinal along a dimension.
+
+        :param ordinals: ordinals of the storage units, as from `ordinals()`
+        :param count: number of ordinals
+        :rtype: list[int]
+        """
+        columns = self.dimensions[dim]
+        lengths = numpy.zeros(count, dtype=numpy.int64)
+        lengths[ordinals[columns.present]] = columns.length[columns.present]
+        return lengths.tolist()
+
+    def intersects(self, ranges):
+        """
+        Which storage units overlap all the ranges. Units without one of the dimensions aren't limited by it.
+
+        :type ranges: dict[str, datacube.model.Range]
+        :rtype: numpy.ndarray
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        for dim, range_ in ranges.items():
+            if dim not in self.dimensions:
+                continue
+            columns = self.dimensions[dim]
+            low = numpy.minimum(columns.begin, columns.end)
+            high = numpy.maximum(columns.begin, columns.end)
+            mask &= ~columns.present | ((high >= range_.begin) & (low <= range_.end))
+        return mask
+
+    def stats(self, dimensions, paths, irregular_coord):
+        """
+        Extent, shape and path of each storage unit, keyed by its starting coordinates.
+
+        :param paths: path to report for each storage unit
+        :param irregular_coord: function(position, dim) returning the coordinate labels of the storage unit at
+                                `position`, along the irregular dimension `dim`
+        :rtype: dict[tuple, dict]
+        """
+        begins = [self.dimensions[dim].begin.tolist() for dim in dimensions]
+        ends = [self.dimensions[dim].end.tolist() for dim in dimensions]
+        lengths = [self.dimensions[dim].length.tolist() for dim in dimensions]
+        irregular = [dim for dim in dimensions if dim in IRREGULAR_DIMENSIONS]
+        stats = {}
+        for position, (begin, end, shape, path) in enumerate(zip(zip(*begins), zip(*ends), zip(*lengths), paths)):
+            stats[begin] = {
+                'storage_min': tuple(min(b, e) for b, e in zip(begin, end)),
+                'storage_max': tuple(max(b, e) for b, e in zip(begin, end)),
+                'storage_shape': shape,
+                'storage_path': str(path),
+                'irregular_indicies': dict((dim, numpy.asarray(irregular_coord(position, dim)).tolist())
+                                           for dim in irregular)
+            }
+        return stats
+
+
+def selection_ranges(dimensions, dimension_ranges):
+    """
+    The (begin, end) ranges requested for the given dimensions.
+
+    :param dimension_ranges: dict of dimension name -> {'range': (begin, end)}, in storage CRS
+    :rtype: dict[str, datacube.model.Range]
+    """
+    return dict((dim, Range(min(dim_range['range']), max(dim_range['range'])))
+                for dim, dim_range in dimension_ranges.items()
+                if dim in dimensions and isinstance(dim_range.get('range'), tuple))
+
+
+def _object_array(values):
+    # numpy.array() would make a multi-dimensional array of sequences
+    values = list(values)
+    array = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+def _dimension_columns(coordinates, get_field):
+    """
+    :param coordinates: the coordinates of each storage unit, by dimension name
+    :param get_field: function(coordinate, name) returning the 'begin', 'end' or 'length' of a coordinate
+    :rtype: dict[str, DimensionColumns]
+    """
+    names = set()
+    for coords in coordinates:
+        names.update(coords)
+
+    dimensions = {}
+    for dim in names:
+        present = numpy.fromiter((dim in coords for coords in coordinates), dtype=bool, count=len(coordinates))
+        units = [coords[dim] for coords in coordinates if dim in coords]
+        begin, end, length = (_fill_absent(numpy.asarray([get_field(unit, name) for unit in units]), present)
+                              for name in ('begin', 'end', 'length'))
+        dimensions[dim] = DimensionColumns(begin, end, length.astype(numpy.int64), present)
+    return dimensions
+
+
+def _fill_absent(values, present):
+    if values.size == present.size:
+        return values
+    # Placeholders of the right type, for units without the dimension
+    column = numpy.full(present.size, values[0], dtype=values.dtype)
+    column[present] = values
+    return column
@@ -6,10 +6,7 @@ from __future__ import absolute_import
 
 import itertools
 import operator
-import collections
-import functools
 
-import dask
 import dask.array as da
 import numpy
 
@@ -17,42 +14,94 @@ import numpy
 def get_dask_array(storage_units, var_name, dimensions, dim_props, is_fake_array=False):
     """
     Create an xarray.DataArray
+
+    Each storage unit is split into blocks aligned with the chunking it was written with, so selecting a
+    small region of the array only reads the chunks it touches.
     :return xarray.DataArray
     """
     dsk_id = var_name  # unique name for the requested dask
+    block_sizes = _get_block_sizes(storage_units, var_name, dimensions, dim_props['sus_size'])
     dsk = {}
     if not is_fake_array:
-        dsk = _get_dask_for_storage_units(storage_units, var_name, dimensions, dim_props['dim_vals'], dsk_id)
-        _fill_in_dask_blanks(dsk, storage_units, var_name, dimensions, dim_props, dsk_id)
+        dsk = _get_dask_for_storage_units(storage_units, var_name, dimensions, dim_props['ordinals'], block_sizes,
+                                          dsk_id)
+        _fill_in_dask_blanks(dsk, storage_units, var_name, dimensions, block_sizes, dsk_id)
 
     dtype = storage_units[0].variables[var_name].dtype
-    chunks = tuple(tuple(dim_props['sus_size'][dim]) for dim in dimensions)
+    chunks = tuple(tuple(itertools.chain(*block_sizes[dim])) for dim in dimensions)
     dask_array = da.Array(dsk, dsk_id, chunks, dtype=dtype)
     return dask_array
 
 
-def _get_dask_for_storage_units(storage_units, var_name, dimensions, dim_vals, dsk_id):
+def _get_storage_chunking(storage_units, var_name, dimensions):
+    """
+    Chunk size of each dimension on disk, as defined by the storage type of the storage units.
+
+    Dimensions without a known chunk size are not split.
+    :rtype: dict[str, int]
+    """
+    for storage_unit in storage_units:
+        storage_type = getattr(storage_unit, 'attributes', {}).get('storage_type')
+        if storage_type is None:
+            continue
+        chunksizes = storage_type.variable_params.get(var_name, {}).get('chunksizes')
+        if chunksizes:
+            return dict((dim, size) for dim, size in zip(storage_type.dimensions, chunksizes) if dim in dimensions)
+    return {}
+
+
+def _split_length(length, chunk_size):
+    if not chunk_size or chunk_size >= length:
+        return [length]
+    blocks = [chunk_size] * (length // chunk_size)
+    if length % chunk_size:
+        blocks.append(length % chunk_size)
+    return blocks
+
+
+def _get_block_sizes(storage_units, var_name, dimensions, sus_size):
+    """
+    Sizes of the dask blocks along each dimension, grouped by storage unit ordinal
+
+    :return: dict of dimension name -> list (per ordinal) of lists of block sizes
+    """
+    chunking = _get_storage_chunking(storage_units, var_name, dimensions)
+    return dict((dim, [_split_length(length, chunking.get(dim)) for length in sus_size[dim]])
+                for dim in dimensions)
+
+
+def _get_dask_for_storage_units(storage_units, var_name, dimensions, ordinals, block_sizes, dsk_id):
+    # Index of the first block of each storage unit ordinal
+    block_offsets = dict((dim, numpy.cumsum([0] + [len(blocks) for blocks in block_sizes[dim]]))
+                         for dim in dimensions)
+    block_slices = dict((dim, [_block_slices(blocks) for blocks in block_sizes[dim]]) for dim in dimensions)
     dsk = {}
     for storage_unit in storage_units:
-        dsk_index = (dsk_id,)   # Dask is indexed by a tuple of ("Name", x-index pos, y-index pos, z-index pos, ...)
-        for dim in dimensions:
-            ordinal = dim_vals[dim].index(storage_unit.coordinates[dim].begin)
-            dsk_index += (ordinal,)
-        # TODO: Wrap in a chunked dask for sub-file dask chunks
-        dsk[dsk_index] = (storage_unit.get_chunk, var_name, Ellipsis)
-        #dsk[dsk_index] = (_get_chunked_data_func, storage_unit, var_name)
+        unit_ordinals = [ordinals[dim][storage_unit.coordinates[dim].begin] for dim in dimensions]
+        unit_blocks = [block_slices[dim][ordinal] for dim, ordinal in zip(dimensions, unit_ordinals)]
+        first_blocks = [block_offsets[dim][ordinal] for dim, ordinal in zip(dimensions, unit_ordinals)]
+        for block_index in itertools.product(*[range(len(blocks)) for blocks in unit_blocks]):
+            # Dask is indexed by a tuple of ("Name", x-index pos, y-index pos, z-index pos, ...)
+            dsk_index = (dsk_id,) + tuple(int(first + i) for first, i in zip(first_blocks, block_index))
+            index = tuple(blocks[i] for blocks, i in zip(unit_blocks, block_index))
+            dsk[dsk_index] = (storage_unit.get_chunk, var_name, index)
     return dsk
 
 
-def _fill_in_dask_blanks(dsk, storage_units, var_name, dimensions, dim_props, dsk_id):
-    all_dsk_keys = set(itertools.product((dsk_id,), *[[i for i, _ in enumerate(dim_props['dim_vals'][dim])]
-                                                      for dim in dimensions]))
+def _block_slices(sizes):
+    stops = numpy.cumsum(sizes)
+    return [slice(int(stop - size), int(stop)) for size, stop in zip(sizes, stops)]
+
+
+def _fill_in_dask_blanks(dsk, storage_units, var_name, dimensions, block_sizes, dsk_id):
+    flat_sizes = dict((dim, list(itertools.chain(*block_sizes[dim]))) for dim in dimensions)
+    all_dsk_keys = set(itertools.product((dsk_id,), *[range(len(flat_sizes[dim])) for dim in dimensions]))
     missing_dsk_keys = all_dsk_keys - set(dsk.keys())
 
     if missing_dsk_keys:
         dtype, nodata = _nodata_properties(storage_units, var_name)
         for key in missing_dsk_keys:
-            shape = _get_chunk_shape(key, dimensions, dim_props['sus_size'])
+            shape = _get_chunk_shape(key, dimensions, flat_sizes)
             dsk[key] = (_no_data_block, shape, dtype, nodata)
         return dsk
 
@@ -76,59 +125,3 @@ def _no_data_block(shape, dtype, fill):
         fill = numpy.NaN
     arr.fill(fill)
     return arr
-
-
-# def _get_chunked_data_func(storage_unit, var_name):
-#     storage_array = NDArrayProxy(storage_unit, var_name)
-#     # TODO: Chunk along chunk direction
-#     chunks = (1000,) * storage_array.ndim
-#     return da.from_array(storage_array, chunks=chunks)
-#
-#
-# # TODO: Move into storage.access.StorageUnitBase
-# class NDArrayProxy(object):
-#     def __init__(self, storage_unit, var_name):
-#         self._storage_unit = storage_unit
-#         self._var_name = var_name
-#
-#     @property
-#     def ndim(self):
-#         return len(self._storage_unit.variables[self._var_name].dimensions)
-#
-#     @property
-#     def size(self):
-#         return functools.reduce(operator.mul, self.shape)
-#
-#     @property
-#     def dtype(self):
-#         return self._storage_unit.variables[self._var_name].dtype
-#
-#     @property
-#     def shape(self):
-#         dims = self._storage_unit.variables[self._var_name].dimensions
-#         return tuple(self._storage_unit.coordinates[dim].length for dim in dims)
-#
-#     def __len__(self):
-#         return self.shape[0]
-#
-#     def __array__(self, dtype=None):
-#         x = self[...]
-#         if dtype and x.dtype != dtype:
-#             x = x.astype(dtype)
-#         if not isinstance(x, numpy.ndarray):
-#             x = numpy.array(x)
-#         return x
-#
-#     def __getitem__(self, key):
-#         # if not isinstance(key, collections.Iterable):
-#         #     # dealing with a single value
-#         #     if not isinstance(key, slice):
-#         #         key = slice(key, key + 1)
-#         #     key = [key]
-#         # if len(key) < self.ndim:
-#         #     key = [key[i] if i < len(key) else slice(0,self.shape[i]) for i in range(self.ndim)]
-#
-#         return self._storage_unit.get_chunk(self._var_name, key)
-#
-#     def __repr__(self):
-#         return '%s(array=%r)' % (type(self).__name__, self.shape)
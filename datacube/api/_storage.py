@@ -10,32 +10,49 @@ from functools import reduce as reduce_
 
 import numpy
 
-from datacube.model import Variable, time_coordinate_value
+from datacube.model import StorageUnit, Variable, time_coordinate_value
 from datacube.storage.access.core import StorageUnitDimensionProxy, StorageUnitBase
 from datacube.storage.access.backends import NetCDF4StorageUnit, GeoTifStorageUnit
 
+from ._catalogue import StorageUnitCatalogue
+
 
 def make_in_memory_storage_unit(su, coordinates, variables, attributes, crs):
+    coordinate_values = _get_coordinate_values(su, coordinates)
     faux = MemoryStorageUnit(file_path=su.local_path,
                              coordinates=coordinates,
                              variables=variables,
                              attributes=attributes,
+                             coodinate_values=coordinate_values,
                              crs=crs)
 
-    # TODO: Retrive irregular coords from database instead of opening file
-    irregular_dim_names = ['time', 't']  # TODO: Use irregular flag from database instead
-    irregular_dims = [name for name, coord in coordinates.items()
-                      if name in irregular_dim_names and coord.length > 2]
-
-    if irregular_dims and su.storage_type.driver == 'NetCDF CF':
+    # Storage units indexed before their irregular coordinates were recorded in the database
+    missing_dims = [name for name in coordinates if name not in coordinate_values]
+    if missing_dims and su.storage_type.driver == 'NetCDF CF':
         real_su = NetCDF4StorageUnit(su.local_path,
                                      coordinates=coordinates, variables=variables, attributes=attributes)
-        for coord in irregular_dims:
+        for coord in missing_dims:
             coord_values, _ = real_su.get_coord(coord)
             faux.coordinate_values[coord] = coord_values
     return faux
 
 
+def _get_coordinate_values(su, coordinates):
+    """
+    Coordinate labels that are known without opening the file: values recorded in the index for irregular
+    dimensions, and evenly spaced values for the others.
+
+    :type su: datacube.model.StorageUnit
+    :rtype: dict[str, numpy.ndarray]
+    """
+    coordinate_values = dict(su.coordinate_values)
+    irregular_dim_names = ['time', 't']  # TODO: Use irregular flag from database instead
+    for name, coord in coordinates.items():
+        if name not in coordinate_values and (name not in irregular_dim_names or coord.length <= 2):
+            coordinate_values[name] = numpy.linspace(coord.begin, coord.end, coord.length).astype(coord.dtype)
+    return coordinate_values
+
+
 def make_storage_unit_collection_from_descriptor(descriptor_su):
     return StorageUnitCollection([NetCDF4StorageUnit.from_file(su['storage_path']) for su in descriptor_su.values()])
 
@@ -50,14 +67,7 @@ def make_storage_unit(su, is_diskless=False):
         if dim in su.storage_type.spatial_dimensions:
             crs[dim] = su.storage_type.crs
     coordinates = su.coordinates
-    variables = {
-        varname: Variable(
-            dtype=numpy.dtype(attributes['dtype']),
-            nodata=attributes.get('nodata', None),
-            dimensions=su.storage_type.dimensions,
-            units=attributes.get('units', None))
-        for varname, attributes in su.storage_type.measurements.items()
-    }
+    variables = get_storage_type_variables(su.storage_type)
     attributes = {
         'storage_type': su.storage_type
     }
@@ -71,7 +81,8 @@ def make_storage_unit(su, is_diskless=False):
 
     if su.storage_type.driver == 'NetCDF CF':
         return NetCDF4StorageUnit(su.local_path, coordinates=coordinates, variables=variables,
-                                  attributes=attributes, crs=crs)
+                                  attributes=attributes, crs=crs,
+                                  coordinate_values=_get_coordinate_values(su, coordinates))
 
     if su.storage_type.driver == 'GeoTiff':
         result = GeoTifStorageUnit(su.local_path, coordinates=coordinates, variables=variables, attributes=attributes)
@@ -81,6 +92,33 @@ def make_storage_unit(su, is_diskless=False):
     raise RuntimeError('unsupported storage unit access driver %s' % su.storage_type.driver)
 
 
+def get_storage_type_variables(storage_type):
+    """
+    :type storage_type: datacube.model.StorageType
+    :rtype: dict[str, datacube.model.Variable]
+    """
+    return {
+        varname: Variable(
+            dtype=numpy.dtype(attributes['dtype']),
+            nodata=attributes.get('nodata', None),
+            dimensions=storage_type.dimensions,
+            units=attributes.get('units', None))
+        for varname, attributes in storage_type.measurements.items()
+    }
+
+
+def make_storage_units(catalogue, storage_type, is_diskless=False):
+    """
+    Access objects for the storage units of a catalogue, all of `storage_type`.
+
+    :type catalogue: datacube.api._catalogue.StorageUnitCatalogue
+    :type storage_type: datacube.model.StorageType
+    :rtype: list[datacube.storage.access.core.StorageUnitBase]
+    """
+    return [make_storage_unit(StorageUnit(None, storage_type, descriptor, path, id_=int(id_)), is_diskless)
+            for id_, path, descriptor in zip(catalogue.ids, catalogue.paths, catalogue.descriptors)]
+
+
 class StorageUnitCollection(object):
     """Holds a list of storage units for some convenience functions"""
 
@@ -99,21 +137,9 @@ class StorageUnitCollection(object):
         return self._storage_units
 
     def get_storage_unit_stats(self, dimensions):
-        stats = {}
-        irregular_dim_names = ['time', 't']  # TODO: Use irregular flag from database instead
-        for storage_unit in self._storage_units:
-            index = tuple(storage_unit.coordinates[dim].begin for dim in dimensions)
-            stats[index] = {
-                'storage_min': tuple(min(storage_unit.coordinates[dim].begin, storage_unit.coordinates[dim].end)
-                                     for dim in dimensions),
-                'storage_max': tuple(max(storage_unit.coordinates[dim].begin, storage_unit.coordinates[dim].end)
-                                     for dim in dimensions),
-                'storage_shape': tuple(storage_unit.coordinates[dim].length for dim in dimensions),
-                'storage_path': str(storage_unit.file_path),
-                'irregular_indicies': dict((dim, storage_unit.get_coord(dim)[0].tolist())
-                                           for dim in dimensions if dim in irregular_dim_names)
-            }
-        return stats
+        catalogue = StorageUnitCatalogue.from_storage_units(self._storage_units, dimensions)
+        return catalogue.stats(dimensions, catalogue.paths,
+                               lambda position, dim: self._storage_units[position].get_coord(dim)[0])
 
     def get_variables(self):
         variables = {}
@@ -13,13 +13,13 @@ from datacube.model import Coordinate
 from datacube.storage.storage import StorageUnitBase
 
 
-def _stratify_storage_unit(storage_unit, dimension, runs):
+def _stratify_storage_unit(storage_unit, dimension, run_ids):
     """
     Creates a new series of storage units for every index along an irregular dimension that must be merged together
 
     :param storage_unit: A storage unit
     :param dimension: The name of the irregular dimension to stratify
-    :param runs: A list of ordered coordinates that make up a contiguous run across all storage units
+    :param run_ids: The contiguous run (across all storage units) each coordinate of this storage unit belongs to
     :return: storage_units: list of storage_unit-like objects that point to an underlying storage unit at a particular
      value, one for each value of the irregular dimension
     """
@@ -28,33 +28,42 @@ def _stratify_storage_unit(storage_unit, dimension, runs):
     irregular_coord = storage_unit.coordinates[dimension]
     if irregular_coord.length <= 1:
         return [storage_unit]
-    coord, index = storage_unit.get_coord(dimension)
-    sus = list()
-    start_i = 0
-    current_run = []
-    for i, c in enumerate(coord):
-        if c not in current_run:
-            if current_run:
-                # If the run is not the current_run, finish it off and start a new one
-                contiguous_slice = slice(start_i, i, 1)
-                sus.append(IrregularStorageUnitSlice(storage_unit, dimension, i,
-                                                     irregular_slice=contiguous_slice,
-                                                     coord=coord[contiguous_slice]))
-            start_i = i
-            found_run = [run for run in runs if c in run]
-            assert len(found_run) == 1
-            current_run = found_run[0]
-
-    if current_run:
-        # Make sure to finish off the last one
-        contiguous_slice = slice(start_i, len(coord), 1)
-        sus.append(IrregularStorageUnitSlice(storage_unit, dimension,
-                                             irregular_slice=contiguous_slice,
-                                             coord=coord[contiguous_slice]))
-    return sus
-    #
-    # return [IrregularStorageUnitSlice(storage_unit, dimension, i, coord=coord[i:i+1])
-    #         for i, c in enumerate(coord)]
+    coord, _ = storage_unit.get_coord(dimension)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(run_ids)) + 1))
+    stops = numpy.append(starts[1:], coord.size)
+    return [IrregularStorageUnitSlice(storage_unit, dimension,
+                                      irregular_slice=slice(int(start), int(stop), 1),
+                                      coord=coord[start:stop])
+            for start, stop in zip(starts, stops)]
+
+
+def _find_runs(coords):
+    """
+    Label every coordinate with the contiguous run it belongs to
+
+    A run is a series of consecutive coordinate values found in exactly the same set of storage units.
+    :param coords: list of coordinate arrays, one per storage unit
+    :return: list of arrays of run ids, one per storage unit
+    """
+    lengths = [coord.size for coord in coords]
+    all_coords, positions = numpy.unique(numpy.concatenate(coords), return_inverse=True)
+    positions = positions.ravel()
+    owners = numpy.repeat(numpy.arange(len(coords)), lengths)
+
+    # Each storage unit covers some spans of consecutive values. A run ends wherever any of those spans starts or
+    # ends, so mark the span edges instead of building a (values x storage units) membership table.
+    order = numpy.lexsort((positions, owners))
+    owners, sorted_positions = owners[order], positions[order]
+    new_span = numpy.ones(sorted_positions.size, dtype=bool)
+    new_span[1:] = (owners[1:] != owners[:-1]) | (sorted_positions[1:] - sorted_positions[:-1] > 1)
+    span_ends = numpy.append(new_span[1:], True)
+
+    changes = numpy.zeros(all_coords.size + 1, dtype=bool)
+    changes[sorted_positions[new_span]] = True
+    changes[sorted_positions[span_ends] + 1] = True
+    changes[0] = False
+    run_ids = numpy.cumsum(changes[:-1])
+    return numpy.split(run_ids[positions], numpy.cumsum(lengths)[:-1])
 
 
 def _stratify_irregular_dimension(storage_units, dimension):
@@ -66,32 +75,14 @@ def _stratify_irregular_dimension(storage_units, dimension):
      value, one for each value of the irregular dimension
     """
     storage_units = list(storage_units)
+    irregular_units = [su for su in storage_units if dimension in su.coordinates]
+    if not irregular_units:
+        return storage_units
 
-    runs = []
-    current_run = []
-    sus_in_current_run = {}
-
-    # get all coordinates along dimension, sorted
-    concat_coords = numpy.concatenate(list(su.get_coord(dimension)[0] for su in storage_units))
-    all_coords = numpy.unique(concat_coords)
-    all_coords.sort()
-    # for each coordinate:
-    for coord in all_coords:
-        # sus_with_coord = get all sus that have the coordinate
-        sus_with_coord = {su for su in storage_units if coord in su.get_coord(dimension)[0]}
-        # if sus_with_coord !=  sus_in_current_run:
-        if sus_with_coord != sus_in_current_run:
-            if current_run:
-                runs.append(current_run)
-            current_run = [coord]
-            sus_in_current_run = sus_with_coord
-        else:
-            current_run.append(coord)
-
-    if current_run:
-        runs.append(current_run)
+    run_ids = dict(zip(irregular_units, _find_runs([su.get_coord(dimension)[0] for su in irregular_units])))
 
-    stratified_units = [_stratify_storage_unit(storage_unit, dimension, runs) for storage_unit in storage_units]
+    stratified_units = [_stratify_storage_unit(storage_unit, dimension, run_ids.get(storage_unit))
+                        for storage_unit in storage_units]
     return list(itertools.chain(*stratified_units))
 
 
@@ -115,6 +106,7 @@ class IrregularStorageUnitSlice(StorageUnitBase):
                               units=real_dim.units)
         self.coordinates[dimension] = fake_dim
         self.variables = parent.variables
+        self.attributes = getattr(parent, 'attributes', {})
         self.file_path = parent.file_path
 
     def get_crs(self):
@@ -129,6 +121,6 @@ class IrregularStorageUnitSlice(StorageUnitBase):
         var = self.variables[name]
         dim_i = var.dimensions.index(self._sliced_coordinate)
         offset = self._slice.start
-        parent_index = tuple(slice(subset.start + offset, subset.stop + offset) if dim_i == 0 else subset
+        parent_index = tuple(slice(subset.start + offset, subset.stop + offset) if i == dim_i else subset
                              for i, subset in enumerate(index))
         self._parent._fill_data(name, parent_index, dest)  # pylint: disable=protected-access
@@ -102,3 +102,35 @@ class LocalConfig(object):
     @property
     def db_port(self):
         return self._prop('db_port') or '5432'
+
+    @property
+    def db_pool_size(self):
+        """
+        Number of database connections to keep open, for use by concurrent threads.
+        :rtype: int
+        """
+        return int(self._prop('db_pool_size') or 5)
+
+    @property
+    def db_max_overflow(self):
+        """
+        Number of connections that may be opened temporarily beyond the pool size.
+        :rtype: int
+        """
+        return int(self._prop('db_max_overflow') or 10)
+
+    @property
+    def db_yield_per(self):
+        """
+        Number of rows to fetch from the database at a time when iterating over search results.
+        :rtype: int
+        """
+        return int(self._prop('db_yield_per') or 1000)
+
+    @property
+    def index_batch_size(self):
+        """
+        Number of datasets to add to the index per transaction, when adding many at once.
+        :rtype: int
+        """
+        return int(self._prop('index_batch_size') or 500)
@@ -21,6 +21,10 @@ class SerialExecutor(object):
     def submit(self, func, *args, **kwargs):
         return func(*args, **kwargs)
 
+    @staticmethod
+    def as_completed(futures):
+        return iter(futures)
+
     @staticmethod
     def result(value):
         return value
@@ -31,14 +35,19 @@ class MultiprocessingExecutor(object):
         self._pool = pool
 
     def submit(self, func, *args, **kwargs):
-        return self._pool.submit(func, *args, **kwargs).result()
+        return self._pool.submit(func, *args, **kwargs)
 
     def map(self, func, iterable):
-        return list(self._pool.map(func, iterable))
+        return [self._pool.submit(func, item) for item in iterable]
+
+    @staticmethod
+    def as_completed(futures):
+        from concurrent.futures import as_completed
+        return as_completed(futures)
 
     @staticmethod
     def result(value):
-        return value
+        return value.result()
 
 
 class DistributedExecutor(object):
@@ -55,6 +64,11 @@ class DistributedExecutor(object):
     def map(self, func, iterable):
         return self._executor.map(func, iterable)
 
+    @staticmethod
+    def as_completed(futures):
+        from distributed import as_completed
+        return as_completed(futures)
+
     @staticmethod
     def result(value):
         return value.result()
@@ -6,6 +6,7 @@ from __future__ import absolute_import
 
 import copy
 import logging
+import uuid
 
 import cachetools
 
@@ -72,6 +73,65 @@ def _prepare_single(collection_resource, dataset_doc, db):
     return was_inserted, dataset, source_datasets
 
 
+def _ensure_datasets(db, match_collection, dataset_docs):
+    """
+    Ensure many datasets are in the index, with a few multi-row inserts rather than several statements each.
+
+    Like `_ensure_dataset`, the sources of a dataset are only added (a level of lineage at a time) if the
+    dataset itself was newly inserted.
+
+    :type db: datacube.index.postgres._api.PostgresDb
+    :param match_collection: function returning the collection for a dataset document
+    :type dataset_docs: list[dict]
+    :returns: (dataset_id, collection, indexed document, was_inserted) for each of the dataset_docs
+    :rtype: list[(str, datacube.model.Collection, dict, bool)]
+    """
+    prepared = [_prepare_single_doc(match_collection, dataset_doc) for dataset_doc in dataset_docs]
+
+    inserted_ids = db.insert_datasets_bulk([
+        {
+            'id': dataset_id,
+            'collection_ref': collection.id,
+            'metadata_type_ref': collection.metadata_type.id,
+            'metadata': indexable_doc
+        }
+        for collection, indexable_doc, dataset_id, _ in prepared
+    ])
+
+    source_links = []
+    source_docs = []
+    for collection, indexable_doc, dataset_id, source_datasets in prepared:
+        if dataset_id in inserted_ids and source_datasets:
+            for classifier, source_dataset in source_datasets.items():
+                source_links.append((classifier, dataset_id))
+                source_docs.append(source_dataset)
+
+    if source_docs:
+        source_results = _ensure_datasets(db, match_collection, source_docs)
+        db.insert_dataset_sources_bulk([(classifier, dataset_id, source_result[0])
+                                        for (classifier, dataset_id), source_result
+                                        in zip(source_links, source_results)])
+
+    return [(dataset_id, collection, indexable_doc, dataset_id in inserted_ids)
+            for collection, indexable_doc, dataset_id, _ in prepared]
+
+
+def _prepare_single_doc(match_collection, dataset_doc):
+    collection = match_collection(dataset_doc)
+    if not collection:
+        _LOG.debug('Failed match on dataset doc %r', dataset_doc)
+        raise ValueError('No collection matched for dataset.')
+
+    indexable_doc = copy.deepcopy(dataset_doc)
+    dataset = collection.metadata_type.dataset_reader(indexable_doc)
+
+    source_datasets = dataset.sources
+    # Clear source datasets: We store them separately.
+    dataset.sources = None
+
+    return collection, indexable_doc, str(uuid.UUID(str(dataset.uuid_field))), source_datasets
+
+
 class MetadataTypeResource(object):
     def __init__(self, db):
         """
@@ -146,6 +206,8 @@ class CollectionResource(object):
         """
         self._db = db
         self.metadata_type_resource = metadata_type_resource
+        # Matcher of all collections, reloaded when collections are added (or periodically, for other processes)
+        self._matcher_cache = cachetools.TTLCache(1, 60)
 
     def add(self, definition):
         """
@@ -186,6 +248,7 @@ class CollectionResource(object):
                 metadata_type_id=metadata_type.id,
                 definition=definition
             )
+            self._matcher_cache.clear()
         return self.get_by_name(name)
 
     def add_many(self, definitions):
@@ -206,16 +269,37 @@ class CollectionResource(object):
             return None
         return self._make(collection)
 
+    def get_all(self):
+        """
+        All collections, in the order they are matched against datasets.
+
+        :rtype: list[datacube.model.Collection]
+        """
+        records = sorted(self._db.get_all_collections(), key=lambda record: record['match_priority'])
+        return list(self._make_many(records))
+
     def get_for_dataset_doc(self, metadata_doc):
         """
+        The highest priority collection whose match document is contained in the dataset's.
+
+        Matched in-process against all collections, which are only loaded from the database
+        once per minute, or after one is added.
+
         :type metadata_doc: dict
         :rtype: datacube.model.Collection or None
         """
-        collection_res = self._db.get_collection_for_doc(metadata_doc)
-        if collection_res is None:
-            return None
+        return self._get_matcher().match_first(metadata_doc)
 
-        return self._make(collection_res)
+    def _get_matcher(self):
+        """
+        :rtype: datacube.index.fields.DocumentMatcher
+        """
+        matcher = self._matcher_cache.get('matcher')
+        if matcher is None:
+            matcher = fields.DocumentMatcher((collection.match.metadata, collection)
+                                             for collection in self.get_all())
+            self._matcher_cache['matcher'] = matcher
+        return matcher
 
     def _make_many(self, query_rows):
         return (self._make(c) for c in query_rows)
@@ -282,6 +366,46 @@ class DatasetResource(object):
 
         return self.get(dataset_id)
 
+    def add_many(self, documents, batch_size=None):
+        """
+        Ensure many datasets are in the index, adding those not present.
+
+        Each batch of documents is added in a single transaction using multi-row inserts.
+
+        :param documents: (metadata_doc, uri) pairs. The uri may be None.
+        :type documents: collections.Iterable[(dict, str)]
+        :param batch_size: number of documents per transaction. Defaults to the configured `index_batch_size`.
+        :return: the dataset for each document, and whether it was newly added
+        :rtype: list[(datacube.model.Dataset, bool)]
+        """
+        batch_size = batch_size or self._config.index_batch_size
+        results = []
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                results.extend(self._add_batch(batch))
+                batch = []
+        if batch:
+            results.extend(self._add_batch(batch))
+        return results
+
+    def _add_batch(self, documents):
+        with self._db.begin() as transaction:
+            added = _ensure_datasets(self._db, self._collection_resource.get_for_dataset_doc,
+                                     [metadata_doc for metadata_doc, _ in documents])
+            self._db.insert_dataset_locations_bulk([(dataset_id, uri)
+                                                    for (dataset_id, _, _, _), (_, uri) in zip(added, documents)
+                                                    if uri])
+            # Datasets that were already indexed keep their stored document, which may differ from the one given
+            existing = dict((str(record.id), self._make(record)) for record in self._db.get_datasets(
+                [dataset_id for dataset_id, _, _, was_inserted in added if not was_inserted]))
+
+        _LOG.info('Indexed %s of %s datasets', sum(was_inserted for _, _, _, was_inserted in added), len(added))
+        return [(Dataset(collection, indexable_doc, uri if uri and uri.startswith('file:') else None), True)
+                if was_inserted else (existing[dataset_id], False)
+                for (dataset_id, collection, indexable_doc, was_inserted), (_, uri) in zip(added, documents)]
+
     def get_field(self, name, collection_name=None):
         """
         :type name: str
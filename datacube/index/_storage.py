@@ -52,6 +52,15 @@ class StorageUnitResource(object):
     def get(self, id_):
         raise RuntimeError('TODO: implement')
 
+    def has(self, storage_unit):
+        """
+        Have we already indexed this storage unit?
+
+        :type storage_unit: datacube.model.StorageUnit
+        :rtype: bool
+        """
+        return self._db.contains_storage_unit(storage_unit.path)
+
     def add_many(self, storage_units):
         """
         :type storage_units: list[datacube.model.StorageUnit]
@@ -63,7 +72,8 @@ class StorageUnitResource(object):
                     unit.dataset_ids,
                     unit.descriptor,
                     unit.storage_type.id,
-                    unit.size_bytes
+                    unit.size_bytes,
+                    spatial_dimensions=unit.storage_type.spatial_dimensions
                 )
                 _LOG.debug('Indexed unit %s @ %s', unit_id, unit.path)
 
@@ -84,7 +94,8 @@ class StorageUnitResource(object):
                     unit.dataset_ids,
                     unit.descriptor,
                     unit.storage_type.id,
-                    unit.size_bytes
+                    unit.size_bytes,
+                    spatial_dimensions=unit.storage_type.spatial_dimensions
                 )
                 _LOG.debug('Indexed unit %s @ %s', unit_id, unit.path)
 
@@ -130,12 +141,34 @@ class StorageUnitResource(object):
     def search(self, *expressions, **query):
         """
         Perform a search, returning results as StorageUnit objects.
+
+        Pass `columns` to only fetch some of the storage unit properties (eg. columns=['id', 'path',
+        'descriptor', 'storage_type_ref']). The dataset ids of each unit ('dataset_refs') are costly to
+        fetch, and will be None unless requested.
+
         :type expressions: tuple[datacube.index.fields.PgExpression]
         :type query: dict[str,str|float|datacube.model.Range]
         :rtype list[datacube.model.StorageUnit]
         """
+        columns = query.pop('columns', None)
+        query_exprs = tuple(fields.to_expressions(self.get_field_with_fallback, **query))
+        return self._make(self._db.search_storage_units((expressions + query_exprs), columns=columns))
+
+    def search_rows(self, *expressions, **query):
+        """
+        Perform a search, returning the storage unit columns of each result as a dict, rather than building
+        StorageUnit objects. For callers handling many thousands of results at once.
+
+        Takes `columns` as `search()` does.
+
+        :type expressions: tuple[datacube.index.fields.PgExpression]
+        :type query: dict[str,str|float|datacube.model.Range]
+        :rtype: collections.Iterable[dict]
+        """
+        columns = query.pop('columns', None)
         query_exprs = tuple(fields.to_expressions(self.get_field_with_fallback, **query))
-        return self._make(self._db.search_storage_units((expressions + query_exprs)))
+        return (dict(result) for result in self._db.search_storage_units((expressions + query_exprs),
+                                                                         columns=columns))
 
     def search_summaries(self, *expressions, **query):
         """
@@ -168,13 +201,13 @@ class StorageUnitResource(object):
         :rtype: list[datacube.model.StorageUnit]
         """
         return (StorageUnit(
-            su['dataset_refs'],
-            self.types.get(su['storage_type_ref']),
-            su['descriptor'],
+            su.get('dataset_refs'),
+            self.types.get(su['storage_type_ref']) if su.get('storage_type_ref') is not None else None,
+            su.get('descriptor'),
             # An offset from the location (ie. a URL fragment):
-            su['path'],
-            id_=su['id']
-        ) for su in query_results)
+            su.get('path'),
+            id_=su.get('id')
+        ) for su in (dict(result) for result in query_results))
 
 
 class StorageTypeResource(object):
@@ -185,6 +218,8 @@ class StorageTypeResource(object):
         """
         self._db = db
         self._host_config = host_config
+        # Matcher of all storage types, reloaded when types are added (or periodically, for other processes)
+        self._matcher_cache = cachetools.TTLCache(1, 60)
 
     def add(self, definition):
         """
@@ -213,6 +248,7 @@ class StorageTypeResource(object):
                     dataset_metadata,
                     definition
                 )
+        self._matcher_cache.clear()
 
     def _make(self, record):
         """
@@ -245,9 +281,25 @@ class StorageTypeResource(object):
 
     def get_for_dataset_doc(self, dataset_doc):
         """
+        Storage types whose match document is contained in the dataset's.
+
+        Matched in-process against all storage types, which are only loaded from the database
+        once per minute, or after one is added.
+
         :rtype: list[datacube.model.StorageType]
         """
-        return [self._make(record) for record in self._db.get_storage_types(dataset_doc)]
+        return [self.get(id_) for id_ in self._get_matcher().match_all(dataset_doc)]
+
+    def _get_matcher(self):
+        """
+        :rtype: datacube.index.fields.DocumentMatcher
+        """
+        matcher = self._matcher_cache.get('matcher')
+        if matcher is None:
+            matcher = fields.DocumentMatcher((record['dataset_metadata'], record['id'])
+                                             for record in self._db.get_all_storage_types())
+            self._matcher_cache['matcher'] = matcher
+        return matcher
 
     def get_by_name(self, name):
         """
@@ -3,6 +3,9 @@
 Common datatypes for DB drivers.
 """
 from __future__ import absolute_import
+
+from collections import defaultdict
+
 # For the search API.
 from datacube.model import Range
 
@@ -158,3 +161,105 @@ def get_doc_changes(original, new, base_prefix=()):
             )
 
     return sorted(changed_fields, key=lambda a: a[0])
+
+
+def contains(document, subset):
+    """
+    Is `subset` contained in `document`? Matches the semantics of postgres' JSONB containment (@>),
+    so documents can be matched without a database round trip.
+
+    >>> contains({'a': 1, 'b': {'c': 2, 'd': 3}}, {'b': {'c': 2}})
+    True
+    >>> contains({'a': 1}, {'a': 2})
+    False
+    >>> contains({'a': [1, 2, 3]}, {'a': [3, 1]})
+    True
+    >>> contains({'a': 1}, {})
+    True
+    """
+    if isinstance(subset, dict):
+        return isinstance(document, dict) and all(key in document and contains(document[key], value)
+                                                  for key, value in subset.items())
+    if isinstance(subset, (list, tuple)):
+        return isinstance(document, (list, tuple)) and all(any(contains(item, value) for item in document)
+                                                           for value in subset)
+    return document == subset
+
+
+def _doc_leaves(doc, prefixes=None, path=()):
+    """
+    The (path, value) of each scalar in a document, only descending into paths in `prefixes` if given.
+
+    Lists are skipped: their containment is not a simple lookup.
+    """
+    if isinstance(doc, dict):
+        for key, value in doc.items():
+            child_path = path + (key,)
+            if prefixes is None or child_path in prefixes:
+                for leaf in _doc_leaves(value, prefixes, child_path):
+                    yield leaf
+    elif not isinstance(doc, (list, tuple)):
+        yield path, doc
+
+
+class DocumentMatcher(object):
+    """
+    Find which of many match documents are contained in a document (see `contains`) without
+    comparing against each of them.
+
+    The scalar values of the match documents are indexed by their path, so only the candidates
+    whose every indexed value is present in a document need to be checked in full.
+
+    >>> matcher = DocumentMatcher([({'platform': {'code': 'LANDSAT_5'}}, 'ls5'),
+    ...                            ({'platform': {'code': 'LANDSAT_7'}}, 'ls7'),
+    ...                            ({}, 'anything')])
+    >>> matcher.match_all({'platform': {'code': 'LANDSAT_7'}, 'instrument': {'name': 'ETM'}})
+    ['ls7', 'anything']
+    >>> matcher.match_first({'platform': {'code': 'LANDSAT_8'}})
+    'anything'
+    """
+
+    def __init__(self, candidates):
+        """
+        :param candidates: (match document, item) pairs, in order of preference
+        """
+        self._candidates = list(candidates)
+        self._leaf_counts = []
+        #: :type: dict[(tuple, object), list[int]]
+        self._index = defaultdict(list)
+        self._prefixes = set()
+        for i, (match_doc, _) in enumerate(self._candidates):
+            leaves = set(_doc_leaves(match_doc))
+            self._leaf_counts.append(len(leaves))
+            for path, value in leaves:
+                self._index[(path, value)].append(i)
+                self._prefixes.update(path[:n] for n in range(1, len(path) + 1))
+
+    def match_all(self, document):
+        """
+        All items whose match document is contained in `document`, in order of preference.
+
+        :type document: dict
+        :rtype: list
+        """
+        hits = defaultdict(int)
+        for leaf in _doc_leaves(document, self._prefixes):
+            try:
+                matches = self._index.get(leaf, ())
+            except TypeError:
+                # Unhashable value: nothing can match it.
+                continue
+            for i in matches:
+                hits[i] += 1
+
+        return [item for i, (match_doc, item) in enumerate(self._candidates)
+                if hits[i] == self._leaf_counts[i] and contains(document, match_doc)]
+
+    def match_first(self, document):
+        """
+        The most preferred item whose match document is contained in `document`, or None.
+
+        :type document: dict
+        """
+        matches = self.match_all(document)
+        return matches[0] if matches else None
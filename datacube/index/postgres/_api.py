@@ -9,21 +9,28 @@ from __future__ import absolute_import
 import datetime
 import json
 import logging
+import os
+import threading
 from functools import reduce as reduce_
 
 import numpy
-from sqlalchemy import create_engine, select, text, bindparam, exists, and_, or_, Index, func, alias
-from sqlalchemy.dialects.postgresql import JSONB
+from dateutil import parser as date_parser, tz
+from psycopg2.extras import NumericRange, DateTimeTZRange
+from sqlalchemy import create_engine, event, select, text, bindparam, exists, and_, or_, Index, func, alias, inspect
+from sqlalchemy import case, cast, null, Float
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
 from sqlalchemy.engine.url import URL as EngineUrl
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, DisconnectionError
 
 from datacube.config import LocalConfig
 from datacube.index.fields import OrExpression
-from datacube.index.postgres.tables._core import schema_qualified
+from datacube.index.postgres.tables._core import schema_qualified, SCHEMA_NAME
 from datacube.index.postgres.tables._dataset import DATASET_LOCATION, METADATA_TYPE
+from datacube.model import StorageType
 from . import tables
-from ._fields import parse_fields, NativeField
-from .tables import DATASET, DATASET_SOURCE, STORAGE_TYPE, STORAGE_UNIT, DATASET_STORAGE, COLLECTION
+from ._fields import parse_fields, NativeField, NativeRangeField, RangeDocField, DateRangeDocField, FloatRangeDocField
+from .tables import DATASET, DATASET_SOURCE, STORAGE_TYPE, STORAGE_UNIT, DATASET_STORAGE, COLLECTION, \
+    STORAGE_UNIT_EXTENT_INDEXES
 
 DATASET_URI_FIELD = DATASET_LOCATION.c.uri_scheme + ':' + DATASET_LOCATION.c.uri_body
 _DATASET_SELECT_FIELDS = (
@@ -43,6 +50,16 @@ _DATASET_SELECT_FIELDS = (
 
 PGCODE_UNIQUE_CONSTRAINT = '23505'
 
+# The storage unit extent columns, with the descriptor fields they are read from (the offsets of the default
+# search fields) and their range types.
+_STORAGE_UNIT_EXTENTS = {
+    STORAGE_UNIT.c.time_extent: ([['extents', 'time_min']], [['extents', 'time_max']], DateTimeTZRange),
+    STORAGE_UNIT.c.lat_extent: ([['extents', 'geospatial_lat_min']], [['extents', 'geospatial_lat_max']],
+                                NumericRange),
+    STORAGE_UNIT.c.lon_extent: ([['extents', 'geospatial_lon_min']], [['extents', 'geospatial_lon_max']],
+                                NumericRange),
+}
+
 _LOG = logging.getLogger(__name__)
 
 
@@ -72,12 +89,21 @@ class PostgresDb(object):
     (and can be unit tested without any actual databases)
     """
 
-    def __init__(self, engine, connection):
+    def __init__(self, engine, yield_per=1000):
+        """
+        :param yield_per: number of rows to fetch at a time when streaming search results
+        """
         self._engine = engine
-        self._connection = connection
+        self.yield_per = yield_per
+        self._pid = os.getpid()
+        # The connection of the transaction (if any) begun by each thread.
+        self._local = threading.local()
+        # Pools inherited from a parent process. Kept referenced so their connections are never closed here.
+        self._inherited_pools = []
 
     @classmethod
-    def connect(cls, hostname, database, username=None, password=None, port=None):
+    def connect(cls, hostname, database, username=None, password=None, port=None, pool_size=5, max_overflow=10,
+                yield_per=1000):
         _engine = create_engine(
             EngineUrl(
                 'postgresql',
@@ -91,9 +117,12 @@ class PostgresDb(object):
 
             json_serializer=_to_json,
             # json_deserializer=my_deserialize_fn
+
+            pool_size=pool_size,
+            max_overflow=max_overflow,
         )
-        _connection = _engine.connect()
-        return PostgresDb(_engine, _connection)
+        _guard_pool_across_forks(_engine)
+        return PostgresDb(_engine, yield_per=yield_per)
 
     @classmethod
     def from_config(cls, config=LocalConfig.find()):
@@ -102,16 +131,69 @@ class PostgresDb(object):
             config.db_database,
             config.db_username,
             config.db_password,
-            config.db_port
+            config.db_port,
+            pool_size=config.db_pool_size,
+            max_overflow=config.db_max_overflow,
+            yield_per=config.db_yield_per
         )
 
+    @property
+    def _connection(self):
+        """
+        Where to execute the current operation.
+
+        The connection of this thread's transaction if one was begun. Otherwise the engine, which checks out a
+        pooled connection for each statement (returned once its results are consumed).
+        """
+        self._check_pid()
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            return connection
+        return self._engine
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # We've been forked. The pooled connections share sockets with our parent: start a new pool
+            # rather than closing them, which would end the parent's sessions.
+            _LOG.debug('Process forked, replacing connection pool')
+            self._inherited_pools.append(self._engine.pool)
+            self._engine.pool = self._engine.pool.recreate()
+            self._local = threading.local()
+            self._pid = os.getpid()
+
     def init(self):
         """
         Init a new database (if not already set up).
 
         :return: If it was newly created.
         """
-        return tables.ensure_db(self._connection, self._engine)
+        is_new = tables.ensure_db(self._connection, self._engine)
+        if not is_new:
+            self._add_storage_unit_extents()
+        return is_new
+
+    def _add_storage_unit_extents(self):
+        """
+        Add the storage unit extent columns to a database created before them, and fill them in.
+        """
+        existing = {column['name'] for column in inspect(self._engine).get_columns('storage_unit',
+                                                                                    schema=SCHEMA_NAME)}
+        if 'grid_extent' in existing:
+            return
+
+        _LOG.info('Adding extent columns to storage units')
+        with self.begin():
+            for column in (STORAGE_UNIT.c.time_extent, STORAGE_UNIT.c.lat_extent,
+                           STORAGE_UNIT.c.lon_extent, STORAGE_UNIT.c.grid_extent):
+                self._connection.execute('alter table %s add column %s %s' % (
+                    schema_qualified(STORAGE_UNIT.name),
+                    column.name,
+                    column.type.compile(dialect=self._engine.dialect)
+                ))
+            for update in _storage_unit_extent_updates(self._connection.execute(STORAGE_TYPE.select()).fetchall()):
+                self._connection.execute(update)
+        for index in STORAGE_UNIT_EXTENT_INDEXES:
+            index.create(self._engine)
 
     def begin(self):
         """
@@ -123,9 +205,27 @@ class PostgresDb(object):
             with db.begin() as transaction:
                 db.insert_dataset(...)
 
+        The transaction holds a pooled connection, which is used by all operations of the calling
+        thread until it completes. Transactions begun within it (in the same thread) are part of it.
+
         :return: Tranasction object
         """
-        return _BegunTransaction(self._connection)
+        self._check_pid()
+        if getattr(self._local, 'connection', None) is not None:
+            return _NestedTransaction()
+
+        connection = self._engine.connect()
+        self._local.connection = connection
+
+        def release():
+            self._local.connection = None
+            connection.close()
+
+        try:
+            return _BegunTransaction(connection, on_end=release)
+        except Exception:
+            release()
+            raise
 
     def insert_dataset(self, metadata_doc, dataset_id, collection_id=None):
         """
@@ -207,6 +307,55 @@ class PostgresDb(object):
             uri_body=body,
         )
 
+    def insert_datasets_bulk(self, datasets):
+        """
+        Insert many datasets in one statement, skipping any that are already indexed.
+
+        :param datasets: dicts of 'id', 'collection_ref', 'metadata_type_ref' and 'metadata'
+        :type datasets: list[dict]
+        :return: ids of the datasets that were inserted
+        :rtype: set[str]
+        """
+        if not datasets:
+            return set()
+        res = self._connection.execute(
+            pg_insert(DATASET).values(datasets).on_conflict_do_nothing(
+                index_elements=[DATASET.c.id]
+            ).returning(DATASET.c.id)
+        )
+        return {str(row[0]) for row in res}
+
+    def insert_dataset_locations_bulk(self, locations):
+        """
+        Add many dataset locations in one statement, skipping any already recorded.
+
+        :param locations: (dataset_id, uri) pairs
+        :type locations: list[(str, str)]
+        """
+        if not locations:
+            return
+        rows = []
+        for dataset_id, uri in locations:
+            scheme, body = _split_uri(uri)
+            rows.append({'dataset_ref': dataset_id, 'uri_scheme': scheme, 'uri_body': body})
+        self._connection.execute(pg_insert(DATASET_LOCATION).values(rows).on_conflict_do_nothing())
+
+    def insert_dataset_sources_bulk(self, sources):
+        """
+        Link many datasets to their sources in one statement, skipping existing links.
+
+        :param sources: (classifier, dataset_id, source_dataset_id) tuples
+        :type sources: list[(str, str, str)]
+        """
+        if not sources:
+            return
+        self._connection.execute(
+            pg_insert(DATASET_SOURCE).values([
+                {'classifier': classifier, 'dataset_ref': dataset_id, 'source_dataset_ref': source_dataset_id}
+                for classifier, dataset_id, source_dataset_id in sources
+            ]).on_conflict_do_nothing()
+        )
+
     def contains_dataset(self, dataset_id):
         return bool(self._connection.execute(select([DATASET.c.id]).where(DATASET.c.id == dataset_id)).fetchone())
 
@@ -229,6 +378,17 @@ class PostgresDb(object):
             select(_DATASET_SELECT_FIELDS).where(DATASET.c.id == dataset_id)
         ).first()
 
+    def get_datasets(self, dataset_ids):
+        """
+        :type dataset_ids: list[str]
+        :rtype: list
+        """
+        if not dataset_ids:
+            return []
+        return self._connection.execute(
+            select(_DATASET_SELECT_FIELDS).where(DATASET.c.id.in_(dataset_ids))
+        ).fetchall()
+
     def get_storage_types(self, dataset_metadata):
         """
         Find any storage types that match the given dataset.
@@ -279,21 +439,20 @@ class PostgresDb(object):
         return "cube(" + ','.join(_array_str(p) for p in ['begin', 'end']) + ")"
 
     def get_storage_unit_overlap(self, storage_type):
-        wild_sql_appears = self._storage_unit_cube_sql_str(storage_type.dimensions) + ' as cube'
-
-        su1 = select([
-            STORAGE_UNIT.c.id,
-            text(wild_sql_appears)
-        ]).where(STORAGE_UNIT.c.storage_type_ref == storage_type.id)
-        su1 = alias(su1, name='su1')
-        su2 = alias(su1, name='su2')
+        su1 = alias(STORAGE_UNIT, name='su1')
+        su2 = alias(STORAGE_UNIT, name='su2')
 
         overlaps = select([su1.c.id]).where(
-            exists(
-                select([1]).select_from(su2).where(
-                    and_(
-                        su1.c.id != su2.c.id,
-                        text("su1.cube && su2.cube")
+            and_(
+                su1.c.storage_type_ref == storage_type.id,
+                exists(
+                    select([1]).select_from(su2).where(
+                        and_(
+                            su2.c.storage_type_ref == su1.c.storage_type_ref,
+                            su1.c.id != su2.c.id,
+                            su1.c.time_extent.overlaps(su2.c.time_extent),
+                            su1.c.grid_extent.op('&&')(su2.c.grid_extent)
+                        )
                     )
                 )
             )
@@ -301,7 +460,10 @@ class PostgresDb(object):
 
         return self._connection.execute(overlaps).fetchall()
 
-    def add_storage_unit(self, path, dataset_ids, descriptor, storage_type_id, size_bytes):
+    def add_storage_unit(self, path, dataset_ids, descriptor, storage_type_id, size_bytes, spatial_dimensions=None):
+        """
+        :param spatial_dimensions: names of the (x, y) dimensions of the storage type, for its grid extent
+        """
         if not dataset_ids:
             raise ValueError('Storage unit must be linked to at least one dataset.')
 
@@ -321,7 +483,8 @@ class PostgresDb(object):
                 storage_type_ref=storage_type_id,
                 descriptor=descriptor,
                 path=path,
-                size_bytes=size_bytes
+                size_bytes=size_bytes,
+                **_storage_unit_extents(descriptor, spatial_dimensions)
             ).returning(STORAGE_UNIT.c.id),
         ).scalar()
 
@@ -335,6 +498,11 @@ class PostgresDb(object):
         )
         return unit_id
 
+    def contains_storage_unit(self, path):
+        return bool(self._connection.execute(
+            select([STORAGE_UNIT.c.id]).where(STORAGE_UNIT.c.path == path)
+        ).fetchone())
+
     def get_storage_units(self):
         return self._connection.execute(STORAGE_UNIT.select()).fetchall()
 
@@ -400,6 +568,15 @@ class PostgresDb(object):
                 )
             )
 
+        # Use the indexed extent columns rather than the descriptor for the fields they were read from.
+        for name, field in fields.items():
+            if not isinstance(field, RangeDocField):
+                continue
+            for column, (min_offset, max_offset, range_class) in _STORAGE_UNIT_EXTENTS.items():
+                if field.min_offset == min_offset and field.max_offset == max_offset:
+                    fields[name] = NativeRangeField(name, field.description, collection_result['id'], column,
+                                                    range_class)
+
         return fields
 
     def search_datasets_by_metadata(self, metadata):
@@ -410,9 +587,9 @@ class PostgresDb(object):
         :rtype: dict
         """
         # Find any storage types whose 'dataset_metadata' document is a subset of the metadata.
-        return self._connection.execute(
+        return self._stream_results(
             select(_DATASET_SELECT_FIELDS).where(DATASET.c.metadata.contains(metadata))
-        ).fetchall()
+        )
 
     def search_datasets(self, expressions, select_fields=None):
         """
@@ -436,12 +613,17 @@ class PostgresDb(object):
             select([DATASET_STORAGE.c.dataset_ref]).where(DATASET_STORAGE.c.storage_unit_ref == storage_unit_id)
         ).fetchall()
 
-    def search_storage_units(self, expressions, select_fields=None):
+    def search_storage_units(self, expressions, select_fields=None, columns=None):
         """
         :type select_fields: tuple[datacube.index.postgres._fields.PgField]
         :type expressions: tuple[datacube.index.postgres._fields.PgExpression]
+        :param columns: names of the storage unit columns to return. Their dataset ids ('dataset_refs') are
+                        aggregated only if requested. All columns if None.
+        :type columns: list[str]
         :rtype: dict
         """
+        if columns and 'dataset_refs' not in columns:
+            return self._search_storage_unit_columns(expressions, columns)
 
         if select_fields:
             select_fields = [
@@ -465,6 +647,26 @@ class PostgresDb(object):
             group_by_fields=group_by_fields
         )
 
+    def _search_storage_unit_columns(self, expressions, columns):
+        """
+        Search without joining or aggregating the datasets of each storage unit, unless the search needs them.
+
+        :type expressions: tuple[datacube.index.postgres._fields.PgExpression]
+        :type columns: list[str]
+        """
+        from_expression, raw_expressions = _prepare_expressions(expressions, STORAGE_UNIT)
+
+        select_query = select([STORAGE_UNIT.c[name] for name in columns])
+        if from_expression is STORAGE_UNIT:
+            select_query = select_query.where(and_(*raw_expressions))
+        else:
+            # Searching by dataset fields. Semi-join, so each unit is returned once however many datasets match.
+            select_query = select_query.where(STORAGE_UNIT.c.id.in_(
+                select([STORAGE_UNIT.c.id]).select_from(from_expression).where(and_(*raw_expressions))
+            ))
+
+        return self._stream_results(select_query)
+
     def _search_docs(self, expressions, primary_table, select_fields=None, group_by_fields=None):
         """
 
@@ -479,9 +681,41 @@ class PostgresDb(object):
         if group_by_fields:
             select_query = select_query.group_by(*group_by_fields)
 
-        results = self._connection.execute(select_query)
-        for result in results:
-            yield result
+        return self._stream_results(select_query)
+
+    def _stream_results(self, select_query):
+        """
+        Yield the rows of a query, fetching `yield_per` at a time from a server-side cursor.
+
+        Unlike a normal (client-side) cursor, the full result set is never held in memory.
+
+        Named cursors only exist within a transaction, so the query runs in this thread's transaction, or
+        a new (read-only) transaction that lasts until the results are exhausted or the generator is closed.
+        """
+        self._check_pid()
+        connection = getattr(self._local, 'connection', None)
+        own_connection = connection is None
+        if own_connection:
+            connection = self._engine.connect()
+        try:
+            transaction = _BegunTransaction(connection, read_only=True) if own_connection else _NestedTransaction()
+            with transaction:
+                results = connection.execution_options(
+                    stream_results=True,
+                    max_row_buffer=self.yield_per
+                ).execute(select_query)
+                try:
+                    while True:
+                        rows = results.fetchmany(self.yield_per)
+                        if not rows:
+                            break
+                        for row in rows:
+                            yield row
+                finally:
+                    results.close()
+        finally:
+            if own_connection:
+                connection.close()
 
     def get_collection_for_doc(self, metadata_doc):
         """
@@ -633,6 +867,98 @@ _JOIN_REQUIREMENTS = {
 }
 
 
+def _storage_unit_extents(descriptor, spatial_dimensions=None):
+    """
+    Values of the extent columns of a storage unit.
+
+    >>> extents = _storage_unit_extents({
+    ...     'coordinates': {'time': {'begin': 0, 'end': 1}, 'x': {'begin': 10, 'end': 20},
+    ...                     'y': {'begin': -10, 'end': -20}},
+    ...     'extents': {'time_min': '2001-01-01T00:00:00', 'time_max': '2001-01-02T00:00:00',
+    ...                 'geospatial_lat_min': -35.5, 'geospatial_lat_max': -34.5,
+    ...                 'geospatial_lon_min': 148.5, 'geospatial_lon_max': 149.5}
+    ... }, ('x', 'y'))
+    >>> extents['time_extent'].lower.isoformat(), extents['time_extent'].upper.isoformat()
+    ('2001-01-01T00:00:00+00:00', '2001-01-02T00:00:00+00:00')
+    >>> extents['lat_extent']
+    NumericRange(-35.5, -34.5, '[]')
+    >>> _storage_unit_extents({})['grid_extent'] is None
+    True
+
+    :type descriptor: dict
+    :param spatial_dimensions: names of the (x, y) dimensions of the storage type
+    :rtype: dict
+    """
+    extents = {}
+    for column, (min_offset, max_offset, range_class) in _STORAGE_UNIT_EXTENTS.items():
+        lower = _get_doc_offset(descriptor, min_offset[0])
+        upper = _get_doc_offset(descriptor, max_offset[0])
+        if lower is None or upper is None:
+            extents[column.name] = None
+            continue
+        if range_class is DateTimeTZRange:
+            lower, upper = _to_datetime(lower), _to_datetime(upper)
+        extents[column.name] = range_class(lower, upper, '[]')
+
+    coordinates = descriptor.get('coordinates', {})
+    if spatial_dimensions and all(dim in coordinates for dim in spatial_dimensions):
+        x, y = (coordinates[dim] for dim in spatial_dimensions)
+        extents['grid_extent'] = func.box(func.point(x['begin'], y['begin']), func.point(x['end'], y['end']))
+    else:
+        extents['grid_extent'] = None
+    return extents
+
+
+def _storage_unit_extent_updates(storage_types):
+    """
+    Statements filling in the extent columns of all storage units from their descriptors, within the database.
+
+    :param storage_types: storage type rows, with 'id' and 'definition'
+    :rtype: list
+    """
+    descriptor = STORAGE_UNIT.c.descriptor
+    extents = {}
+    for column, (min_offset, max_offset, range_class) in _STORAGE_UNIT_EXTENTS.items():
+        field_class = DateRangeDocField if range_class is DateTimeTZRange else FloatRangeDocField
+        field = field_class(column.name, None, None, descriptor, min_offset, max_offset)
+        # A range with a missing bound would be unbounded, rather than unknown
+        has_bounds = and_(descriptor[min_offset[0]].isnot(None), descriptor[max_offset[0]].isnot(None))
+        extents[column.name] = case([(has_bounds, field.alchemy_expression)], else_=null())
+    updates = [STORAGE_UNIT.update().values(**extents)]
+
+    # Grid extents are in the storage type's (x, y) dimensions, so differ by storage type
+    for storage_type in storage_types:
+        spatial_dimensions = StorageType(storage_type['definition']).spatial_dimensions
+        if not spatial_dimensions:
+            continue
+        x, y = spatial_dimensions
+        updates.append(STORAGE_UNIT.update().where(STORAGE_UNIT.c.storage_type_ref == storage_type['id']).values(
+            grid_extent=func.box(func.point(_descriptor_coordinate(x, 'begin'), _descriptor_coordinate(y, 'begin')),
+                                 func.point(_descriptor_coordinate(x, 'end'), _descriptor_coordinate(y, 'end')))
+        ))
+    return updates
+
+
+def _descriptor_coordinate(dim, end):
+    return cast(STORAGE_UNIT.c.descriptor[('coordinates', dim, end)].astext, Float)
+
+
+def _get_doc_offset(doc, offset):
+    for key in offset:
+        if not isinstance(doc, dict) or key not in doc:
+            return None
+        doc = doc[key]
+    return doc
+
+
+def _to_datetime(value):
+    if not isinstance(value, datetime.datetime):
+        value = date_parser.parse(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz.tzutc())
+    return value
+
+
 def _prepare_expressions(expressions, primary_table):
     """
     :type expressions: tuple[datacube.index.postgres._fields.PgExpression]
@@ -724,19 +1050,55 @@ def _json_fallback(obj):
     raise TypeError("Type not serializable: {}".format(type(obj)))
 
 
+def _guard_pool_across_forks(engine):
+    """
+    Never hand out a connection that was opened by another process.
+
+    Their sockets are shared with that process, so would be corrupted by using them in both.
+    """
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):  # pylint: disable=unused-variable,unused-argument
+        connection_record.info['pid'] = os.getpid()
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):  # pylint: disable=unused-variable
+        pid = os.getpid()
+        if connection_record.info['pid'] != pid:
+            # Drop it without closing: that would end the other process's session.
+            connection_record.connection = connection_proxy.connection = None
+            raise DisconnectionError(
+                'Connection record belongs to pid %s, attempting to check out in pid %s' %
+                (connection_record.info['pid'], pid)
+            )
+
+
 class _BegunTransaction(object):
-    def __init__(self, connection):
+    def __init__(self, connection, on_end=None, read_only=False):
         self._connection = connection
+        self._on_end = on_end
+        # Only Postgres has read-only transactions (the tests run others against SQLite)
+        self._read_only = read_only and connection.dialect.name == 'postgresql'
         self.begin()
 
     def begin(self):
-        self._connection.execute(text('BEGIN'))
+        self._connection.execute(text('BEGIN READ ONLY' if self._read_only else 'BEGIN'))
 
     def commit(self):
-        self._connection.execute(text('COMMIT'))
+        try:
+            self._connection.execute(text('COMMIT'))
+        finally:
+            self._end()
 
     def rollback(self):
-        self._connection.execute(text('ROLLBACK'))
+        try:
+            self._connection.execute(text('ROLLBACK'))
+        finally:
+            self._end()
+
+    def _end(self):
+        if self._on_end:
+            self._on_end()
+            self._on_end = None
 
     def __enter__(self):
         return self
@@ -746,3 +1108,21 @@ class _BegunTransaction(object):
             self.rollback()
         else:
             self.commit()
+
+
+class _NestedTransaction(object):
+    """
+    A transaction begun within another: it completes with the outer transaction.
+    """
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        raise RuntimeError('Cannot roll back a nested transaction independently of its outer transaction')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
@@ -78,6 +78,24 @@ class NativeField(PgField):
         return None
 
 
+class NativeRangeField(NativeField):
+    """
+    A range column hard-coded into the schema. (eg. the time extent of storage units)
+    """
+
+    def __init__(self, name, description, metadata_type_id, alchemy_column, range_class):
+        super(NativeRangeField, self).__init__(name, description, metadata_type_id, alchemy_column)
+        self._range_class = range_class
+
+    def between(self, low, high):
+        """
+        :rtype: Expression
+        """
+        if self._range_class is DateTimeTZRange:
+            low, high = _default_utc(low), _default_utc(high)
+        return RangeBetweenExpression(self, low, high, _range_class=self._range_class)
+
+
 class SimpleDocField(PgField):
     """
     A field with a single value (eg. String, int)
@@ -182,23 +200,24 @@ class DateRangeDocField(RangeDocField):
         # Call the postgres 'tstzrange()' function, hinting to SQLAlchemy that it returns a TSTZRANGE.
         return functools.partial(func.tstzrange, type_=TSTZRANGE)
 
-    def _default_utc(self, d):
-        if d.tzinfo is None:
-            return d.replace(tzinfo=tz.tzutc())
-        return d
-
     def between(self, low, high):
         """
         :rtype: Expression
         """
         return RangeBetweenExpression(
             self,
-            self._default_utc(low),
-            self._default_utc(high),
+            _default_utc(low),
+            _default_utc(high),
             _range_class=DateTimeTZRange
         )
 
 
+def _default_utc(d):
+    if d.tzinfo is None:
+        return d.replace(tzinfo=tz.tzutc())
+    return d
+
+
 class PgExpression(Expression):
     def __init__(self, field):
         super(PgExpression, self).__init__()
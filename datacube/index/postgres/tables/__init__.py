@@ -6,10 +6,10 @@ from __future__ import absolute_import
 
 from ._core import ensure_db, View
 from ._dataset import DATASET, DATASET_SOURCE, COLLECTION
-from ._storage import STORAGE_UNIT, STORAGE_TYPE, DATASET_STORAGE
+from ._storage import STORAGE_UNIT, STORAGE_TYPE, DATASET_STORAGE, STORAGE_UNIT_EXTENT_INDEXES
 
 __all__ = [
     'ensure_db', 'View',
     'DATASET', 'DATASET_SOURCE', 'COLLECTION',
-    'STORAGE_UNIT', 'STORAGE_TYPE', 'DATASET_STORAGE'
+    'STORAGE_UNIT', 'STORAGE_TYPE', 'DATASET_STORAGE', 'STORAGE_UNIT_EXTENT_INDEXES'
 ]
@@ -9,6 +9,7 @@ from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.schema import CreateSchema
 from sqlalchemy.sql.expression import Executable, ClauseElement
 from sqlalchemy.sql.functions import GenericFunction
+from sqlalchemy.types import UserDefinedType
 
 SQL_NAMING_CONVENTIONS = {
     "ix": 'ix_%(column_0_label)s',
@@ -29,6 +30,17 @@ def schema_qualified(name):
     return '{}.{}'.format(SCHEMA_NAME, name)
 
 
+class Box(UserDefinedType):
+    """
+    Postgres' native two-dimensional box type.
+
+    Values are created in SQL, with the box() and point() functions.
+    """
+
+    def get_col_spec(self):
+        return 'BOX'
+
+
 def ensure_db(connection, engine):
     is_new = False
     if not has_schema(engine, connection):
@@ -6,8 +6,9 @@ Tables for indexing the storage of a dataset in a reprojected or new form.
 """
 from __future__ import absolute_import
 from sqlalchemy import ForeignKey, SmallInteger, CheckConstraint, BigInteger
-from sqlalchemy import Table, Column, Integer, String, DateTime
+from sqlalchemy import Table, Column, Integer, String, DateTime, Index
 from sqlalchemy.dialects import postgres
+from sqlalchemy.dialects.postgresql import NUMRANGE, TSTZRANGE
 from sqlalchemy.sql import func
 
 from . import _core
@@ -52,8 +53,21 @@ STORAGE_UNIT = Table(
     # When it was added and by whom.
     Column('added', DateTime(timezone=True), server_default=func.now(), nullable=False),
     Column('added_by', String, server_default=func.current_user(), nullable=False),
+
+    # Extents from the descriptor, materialised so they can be indexed and compared without parsing it.
+    Column('time_extent', TSTZRANGE),
+    Column('lat_extent', NUMRANGE),
+    Column('lon_extent', NUMRANGE),
+    # The spatial coordinates of the unit, in the CRS of its storage type.
+    Column('grid_extent', _core.Box),
 )
 
+STORAGE_UNIT_EXTENT_INDEXES = [
+    Index('ix_storage_unit_%s' % column.name, column, postgresql_using='gist')
+    for column in (STORAGE_UNIT.c.time_extent, STORAGE_UNIT.c.lat_extent,
+                   STORAGE_UNIT.c.lon_extent, STORAGE_UNIT.c.grid_extent)
+]
+
 DATASET_STORAGE = Table(
     'dataset_storage', _core.METADATA,
     Column('dataset_ref', None, ForeignKey(_dataset.DATASET.c.id), primary_key=True, nullable=False),
@@ -5,6 +5,7 @@ Ingest datasets into the AGDC.
 from __future__ import absolute_import
 
 from collections import defaultdict
+from functools import partial
 from itertools import groupby
 import os
 import logging
@@ -13,6 +14,7 @@ from datacube import ui, storage
 from datacube.storage.tiling import tile_datasets_with_storage_type
 from datacube.executor import SerialExecutor
 from datacube.index import index_connect
+from datacube.ledger import task_key, PENDING, WRITTEN, INDEXED
 from datacube.model import _uri_to_local_path
 
 _LOG = logging.getLogger(__name__)
@@ -32,14 +34,16 @@ def index_datasets(path, index=None):
     if not metadata_path or not metadata_path.exists():
         raise ValueError('No supported metadata docs found for dataset {}'.format(path))
 
-    datasets = [index.datasets.add(metadata_doc, metadata_path)
-                for metadata_path, metadata_doc
-                in ui.read_documents(metadata_path)]
+    datasets = [dataset for dataset, was_inserted
+                in index.datasets.add_many((metadata_doc, metadata_path.absolute().as_uri())
+                                           for metadata_path, metadata_doc
+                                           in ui.read_documents(metadata_path))]
     _LOG.info('Indexed datasets %s', path)
     return datasets
 
 
-def store_datasets(datasets, index=None, executor=SerialExecutor()):
+def store_datasets(datasets, index=None, executor=SerialExecutor(), max_pending=16, index_batch_size=10,
+                   ledger=None, warp_threads=1):
     """
     Create any necessary storage units for the given datasets.
 
@@ -47,19 +51,153 @@ def store_datasets(datasets, index=None, executor=SerialExecutor()):
     Create storage units for datasets according to the storage_type
     Add storage units to the index
 
+    Storage units are created in a pipeline: at most `max_pending` are in progress at once, and they are
+    indexed (and committed) in batches of `index_batch_size` as they complete. If creating one fails, the
+    rest in progress are still finished and indexed before the error is raised.
+
+    If a `ledger` is given, the progress of each storage unit is recorded in it, so a re-run with the same
+    ledger skips those already written or indexed, and only removes the output of those left half-written.
+
+    Each storage unit is warped with `warp_threads` threads. Balance it against the executor's processes:
+    their product should be around the number of cores available. Only resampling done by GDAL (cubic, lanczos,
+    etc.) is fully spread across them: nearest and bilinear resampling apply precomputed plans in Python, which
+    runs single-threaded apart from reading the sources.
+
     :type datasets: list[datacube.model.Dataset]
     :type index: datacube.index._api.Index
+    :type ledger: datacube.ledger.TaskLedger
+    :type warp_threads: int
     """
     index = index or index_connect()
 
     storage_types = find_storage_types_for_datasets(datasets, index)
 
-    storage_units = []
     for storage_type, datasets in storage_types.items():
         _LOG.info('Storing %s dataset(s) using %s', len(datasets), storage_type)
-        storage_units += create_storage_units(datasets, storage_type, executor=executor)
 
-    index.storage.add_many(executor.result(value) for value in storage_units)
+    tasks = _remove_temporary_files(task
+                                    for storage_type, datasets in storage_types.items()
+                                    for task in _storage_unit_tasks(datasets, storage_type))
+
+    batch = []
+
+    def index_batch():
+        try:
+            index.storage.add_many([storage_unit for _, storage_unit in batch])
+            if ledger is not None:
+                ledger.mark_indexed([key for key, _ in batch])
+        finally:
+            # A failed batch isn't retried: its units stay written in the ledger, to be indexed by a re-run
+            del batch[:]
+
+    def add_to_batch(key, storage_unit):
+        batch.append((key, storage_unit))
+        if len(batch) >= index_batch_size:
+            index_batch()
+
+    if ledger is not None:
+        tasks = _resume_tasks(tasks, ledger, index, add_to_batch)
+
+    try:
+        for task, storage_unit in _create_storage_units_pipelined(tasks, executor, max_pending, warp_threads):
+            key = _task_key(task)
+            if ledger is not None:
+                ledger.mark_written(key, storage_unit)
+            add_to_batch(key, storage_unit)
+    finally:
+        if batch:
+            index_batch()
+
+
+def _task_key(task):
+    tile_index, storage_type, datasets = task
+    return task_key(storage_type, tile_index, datasets[0].time)
+
+
+def _remove_temporary_files(tasks):
+    """
+    Remove storage units left partially written by previous runs that died, from each directory the tasks will
+    write into, before the first task writing there is started. Those still being written are left alone.
+    """
+    swept = set()
+    for task in tasks:
+        tile_index, storage_type, datasets = task
+        directory = _uri_to_local_path(storage.generate_filename(tile_index, datasets, storage_type)).parent
+        if directory not in swept:
+            storage.remove_temporary_files(directory)
+            swept.add(directory)
+        yield task
+
+
+def _resume_tasks(tasks, ledger, index, add_written):
+    """
+    Filter tasks against the ledger, yielding those still to be done.
+
+    Storage units the ledger has as written are passed to `add_written(key, storage_unit)` to be indexed (unless
+    a previous run indexed them but didn't record it). Those left pending are removed, to be created again.
+    Tasks are marked pending as they are taken, so only tasks that may have started will be cleaned up by a
+    later run.
+    """
+    for task in tasks:
+        key = _task_key(task)
+        state = ledger.state(key)
+        if state == INDEXED:
+            _LOG.debug('Skipping indexed storage unit %s', key)
+            continue
+        if state == WRITTEN:
+            storage_unit = ledger.storage_unit(key, task[1])
+            if index.storage.has(storage_unit):
+                ledger.mark_indexed([key])
+            else:
+                add_written(key, storage_unit)
+            continue
+        if state == PENDING:
+            _LOG.info('Removing incomplete storage unit %s', key)
+            _remove_storage_unit(task)
+        ledger.mark_pending(key)
+        yield task
+
+
+def _create_storage_units_pipelined(tasks, executor, max_pending, warp_threads=1):
+    """
+    Create storage units, yielding each (with its task) as soon as it is complete.
+
+    Failed tasks leave no output (storage units are only renamed into place once complete). The first error
+    is raised once the other tasks in progress are complete (no more are started).
+    """
+    tasks = iter(tasks)
+    create = partial(_create_storage_unit, warp_threads=warp_threads)
+    pending = {}
+    error = None
+    exhausted = False
+    while True:
+        while error is None and not exhausted and len(pending) < max_pending:
+            task = next(tasks, None)
+            if task is None:
+                exhausted = True
+                break
+            try:
+                future = executor.submit(create, task)
+                pending[id(future)] = (future, task)
+            except Exception as e:  # pylint: disable=broad-except
+                _LOG.error('Failed to create storage unit: %s', e)
+                error = error or e
+
+        if not pending:
+            break
+
+        future = next(iter(executor.as_completed([future for future, _ in pending.values()])))
+        _, task = pending.pop(id(future))
+        try:
+            storage_unit = executor.result(future)
+        except Exception as e:  # pylint: disable=broad-except
+            _LOG.error('Failed to create storage unit: %s', e)
+            error = error or e
+            continue
+        yield task, storage_unit
+
+    if error is not None:
+        raise error
 
 
 def find_storage_types_for_datasets(datasets, index=None):
@@ -85,7 +223,7 @@ def find_storage_types_for_datasets(datasets, index=None):
     return {index.storage.types.get(id): datasets for id, datasets in storage_types.items()}
 
 
-def create_storage_units(datasets, storage_type, executor=SerialExecutor()):
+def create_storage_units(datasets, storage_type, executor=SerialExecutor(), warp_threads=1):
     """
     Create storage units for datasets using storage_type
     Add storage units to the index
@@ -93,27 +231,25 @@ def create_storage_units(datasets, storage_type, executor=SerialExecutor()):
     :type datasets: list[datacube.model.Dataset]
     :type storage_type: datacube.model.StorageType
     """
+    return executor.map(partial(_create_storage_unit, warp_threads=warp_threads),
+                        list(_storage_unit_tasks(datasets, storage_type)))
+
+
+def _storage_unit_tasks(datasets, storage_type):
     # :type tile_index: (x,y)
     # Each task is an entire storage unit, safe to run tasks in parallel
 
     # datasets.sort(key=lambda ds: ds.time)
-    tasks = [(tile_index, storage_type, list(dataset_group))
-             for tile_index, datasets in tile_datasets_with_storage_type(datasets, storage_type).items()
-             for time, dataset_group in groupby(datasets, lambda ds: ds.time)]
-
-    try:
-        storage_units = executor.map(_create_storage_unit, tasks)
-        return storage_units
-    except:
-        for task in tasks:
-            _remove_storage_unit(task)
-        raise
+    return ((tile_index, storage_type, list(dataset_group))
+            for tile_index, datasets in tile_datasets_with_storage_type(datasets, storage_type).items()
+            for time, dataset_group in groupby(datasets, lambda ds: ds.time))
 
 
-def _create_storage_unit(task):
+def _create_storage_unit(task, warp_threads=1):
     tile_index, storage_type, datasets = task
     filename = storage.generate_filename(tile_index, datasets, storage_type)
-    return storage.create_storage_unit_from_datasets(tile_index, datasets, storage_type, filename)
+    return storage.create_storage_unit_from_datasets(tile_index, datasets, storage_type, filename,
+                                                     warp_threads=warp_threads)
 
 
 def _remove_storage_unit(task):
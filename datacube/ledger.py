@@ -0,0 +1,105 @@
+# coding=utf-8
+"""
+Record the progress of ingest tasks, so an interrupted ingest can be resumed.
+"""
+from __future__ import absolute_import
+
+import pickle
+import sqlite3
+import threading
+
+from datacube.model import StorageUnit
+
+#: The task's output may be partially written
+PENDING = 'pending'
+#: The storage unit is complete on disk, but not yet indexed
+WRITTEN = 'written'
+#: The storage unit is complete and indexed
+INDEXED = 'indexed'
+
+_SCHEMA = """
+create table if not exists task (
+    storage_type text not null,
+    tile_index text not null,
+    time text not null,
+    state text not null,
+    -- The pickled storage unit (dataset ids, descriptor, path), once written
+    storage_unit blob,
+    primary key (storage_type, tile_index, time)
+)
+"""
+
+_UPSERT = 'insert or replace into task (storage_type, tile_index, time, state, storage_unit) values (?, ?, ?, ?, ?)'
+
+
+def task_key(storage_type, tile_index, time):
+    """
+    Identify an ingest task: the storage unit of a storage type at a tile index and time
+
+    >>> task_key(type('StorageType', (), {'name': 'ls5_nbar'}), (-35, 148), '1990-03-02T23:11:16')
+    ('ls5_nbar', '-35_148', '1990-03-02T23:11:16')
+    """
+    return (storage_type.name,
+            '_'.join(str(i) for i in tile_index),
+            time.isoformat() if hasattr(time, 'isoformat') else str(time))
+
+
+class TaskLedger(object):
+    """
+    A SQLite file recording the state of each ingest task: pending, written or indexed.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: SQLite file. Created if it doesn't exist
+        :type path: str
+        """
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+
+    def state(self, key):
+        """
+        :rtype: str or None
+        """
+        row = self._query('select state from task where storage_type=? and tile_index=? and time=?', key)
+        return row[0] if row else None
+
+    def storage_unit(self, key, storage_type):
+        """
+        The storage unit recorded for a written task.
+
+        :type storage_type: datacube.model.StorageType
+        :rtype: datacube.model.StorageUnit
+        """
+        row = self._query('select storage_unit from task where storage_type=? and tile_index=? and time=?', key)
+        dataset_ids, descriptor, path = pickle.loads(bytes(row[0]))
+        return StorageUnit(dataset_ids, storage_type, descriptor, path)
+
+    def mark_pending(self, key):
+        self._set(key, PENDING)
+
+    def mark_written(self, key, storage_unit):
+        """
+        :type storage_unit: datacube.model.StorageUnit
+        """
+        # Pickled: descriptors hold datetimes, tuples and numpy values
+        record = (storage_unit.dataset_ids, storage_unit.descriptor, storage_unit.path)
+        self._set(key, WRITTEN, sqlite3.Binary(pickle.dumps(record, protocol=2)))
+
+    def mark_indexed(self, keys):
+        with self._lock, self._connection:
+            self._connection.executemany(_UPSERT, [tuple(key) + (INDEXED, None) for key in keys])
+
+    def _set(self, key, state, storage_unit=None):
+        with self._lock, self._connection:
+            self._connection.execute(_UPSERT, tuple(key) + (state, storage_unit))
+
+    def _query(self, sql, params):
+        with self._lock:
+            return self._connection.execute(sql, tuple(params)).fetchone()
+
+    def close(self):
+        self._connection.close()
@@ -7,9 +7,11 @@ from __future__ import absolute_import, division
 import codecs
 import logging
 import os
+import threading
 from collections import namedtuple, defaultdict
 from pathlib import Path
 
+import cachetools
 import dateutil.parser
 import numpy
 from affine import Affine
@@ -30,6 +32,91 @@ Variable = namedtuple('Variable', ('dtype', 'nodata', 'dimensions', 'units'))
 NETCDF_VAR_OPTIONS = {'zlib', 'complevel', 'shuffle', 'fletcher32', 'contiguous'}
 VALID_VARIABLE_ATTRS = {'standard_name', 'long_name', 'units', 'flags_definition'}
 
+#: Maximum number of parsed coordinate reference systems (and transformations between them) to keep
+MAX_CACHED_CRS = 256
+
+
+class SpatialReferenceCache(object):
+    """
+    Parsed `osr.SpatialReference` objects by CRS string (WKT, EPSG:xxxx, ...), and coordinate transformations
+    between them, so each is only parsed once.
+
+    The objects returned are shared: they must not be modified. OGR coordinate transformations aren't
+    thread-safe, so each thread gets its own.
+
+    >>> cache = SpatialReferenceCache()
+    >>> cache.spatial_reference('EPSG:4326') is cache.spatial_reference('EPSG:4326')
+    True
+    >>> sorted(cache.stats.items())
+    [('hits', 1), ('misses', 1), ('spatial_references', 1), ('transformations', 0)]
+    """
+    def __init__(self, max_size=MAX_CACHED_CRS):
+        self._lock = threading.Lock()
+        self._spatial_references = cachetools.LRUCache(max_size)
+        self._transformations = cachetools.LRUCache(max_size)
+        self._hits = 0
+        self._misses = 0
+
+    def spatial_reference(self, crs_str):
+        """
+        :type crs_str: str
+        :rtype: osr.SpatialReference
+        """
+        return self._get(self._spatial_references, crs_str, _parse_spatial_reference)
+
+    def transformation(self, src_crs_str, dst_crs_str):
+        """
+        :type src_crs_str: str
+        :type dst_crs_str: str
+        :rtype: osr.CoordinateTransformation
+        """
+        def make_transformation(key):
+            return osr.CoordinateTransformation(self.spatial_reference(src_crs_str),
+                                                self.spatial_reference(dst_crs_str))
+        key = (src_crs_str, dst_crs_str, threading.current_thread().ident)
+        return self._get(self._transformations, key, make_transformation)
+
+    def _get(self, cache, key, make):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                self._hits += 1
+                return value
+            self._misses += 1
+        # Made outside the lock: a transformation looks up its spatial references
+        value = make(key)
+        with self._lock:
+            return cache.setdefault(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._spatial_references.clear()
+            self._transformations.clear()
+
+    @property
+    def stats(self):
+        """
+        Counters for checking the cache is effective
+
+        :rtype: dict[str, int]
+        """
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'spatial_references': len(self._spatial_references),
+            'transformations': len(self._transformations),
+        }
+
+
+def _parse_spatial_reference(crs_str):
+    sr = osr.SpatialReference()
+    sr.SetFromUserInput(crs_str)
+    return sr
+
+
+#: Shared by the model classes
+SPATIAL_REFERENCES = SpatialReferenceCache()
+
 
 def _uri_to_local_path(local_uri):
     """
@@ -164,7 +251,7 @@ class StorageType(object):  # pylint: disable=too-many-public-methods
         Latitude/Longitude or X/Y
         :rtype: tuple
         """
-        sr = osr.SpatialReference(self.crs)
+        sr = SPATIAL_REFERENCES.spatial_reference(self.crs)
         if sr.IsGeographic():
             return 'longitude', 'latitude'
         elif sr.IsProjected():
@@ -217,6 +304,9 @@ class StorageType(object):  # pylint: disable=too-many-public-methods
 
 
 class StorageUnit(object):
+    # Searches can return many thousands of these: no per-instance dict
+    __slots__ = ('dataset_ids', 'storage_type', '_descriptor', 'path', 'id', '_coordinates', '_coordinate_values')
+
     def __init__(self, dataset_ids, storage_type, descriptor, relative_path=None, output_uri=None, id_=None):
         if relative_path and output_uri:
             raise ValueError('only specify one of `relative_path` or `output_uri`')
@@ -232,7 +322,6 @@ class StorageUnit(object):
         #
         # Contains 'coordinates', and 'extents'
         # 'extents' contains 'time_min', 'time_max', 'geospatial_lat_min', 'geospatial_lon_max', ...
-        #: :type: dict
         self.descriptor = descriptor
 
         # An offset from the location defined in the storage type.
@@ -246,6 +335,18 @@ class StorageUnit(object):
         #: :type: int
         self.id = id_
 
+    @property
+    def descriptor(self):
+        #: :rtype: dict
+        return self._descriptor
+
+    @descriptor.setter
+    def descriptor(self, descriptor):
+        self._descriptor = descriptor
+        # Derived from the descriptor on first use
+        self._coordinates = None
+        self._coordinate_values = None
+
     @property
     def local_path(self):
         file_uri = self.storage_type.resolve_location(self.path)
@@ -258,13 +359,32 @@ class StorageUnit(object):
 
     @property
     def coordinates(self):
+        """
+        Shared by every caller: don't modify it
+        """
         #: :rtype: dict[str, Coordinate]
-        return {name: Coordinate(dtype=numpy.dtype(attributes['dtype']),
-                                 begin=attributes['begin'],
-                                 end=attributes['end'],
-                                 length=attributes['length'],
-                                 units=attributes.get('units', None))
-                for name, attributes in self.descriptor['coordinates'].items()}
+        if self._coordinates is None:
+            self._coordinates = {name: Coordinate(dtype=numpy.dtype(attributes['dtype']),
+                                                  begin=attributes['begin'],
+                                                  end=attributes['end'],
+                                                  length=attributes['length'],
+                                                  units=attributes.get('units', None))
+                                 for name, attributes in self.descriptor['coordinates'].items()}
+        return self._coordinates
+
+    @property
+    def coordinate_values(self):
+        """
+        Coordinate labels recorded in the index, for dimensions that are not evenly spaced (eg. time)
+
+        Shared by every caller: don't modify it. The arrays are read-only.
+        """
+        #: :rtype: dict[str, numpy.ndarray]
+        if self._coordinate_values is None:
+            self._coordinate_values = {name: _read_only(numpy.array(attributes['values'], dtype=attributes['dtype']))
+                                       for name, attributes in self.descriptor['coordinates'].items()
+                                       if 'values' in attributes}
+        return self._coordinate_values
 
     @property
     def size_bytes(self):
@@ -280,6 +400,8 @@ class StorageUnit(object):
 
 
 class Dataset(object):
+    __slots__ = ('collection', 'metadata_type', 'metadata_doc', 'local_uri')
+
     def __init__(self, collection, metadata_doc, local_uri):
         """
         A dataset on disk.
@@ -472,6 +594,7 @@ class GeoPolygon(object):
     """
     Polygon with a CRS
     """
+    __slots__ = ('points', 'crs_str')
 
     def __init__(self, points, crs_str=None):
         self.points = points
@@ -479,9 +602,12 @@ class GeoPolygon(object):
 
     @property
     def crs(self):
-        crs = osr.SpatialReference()
-        crs.SetFromUserInput(self.crs_str)
-        return crs
+        """
+        Shared with other users of the CRS: don't modify it
+
+        :rtype: osr.SpatialReference
+        """
+        return SPATIAL_REFERENCES.spatial_reference(self.crs_str)
 
     @property
     def boundingbox(self):
@@ -495,12 +621,10 @@ class GeoPolygon(object):
         :param crs_str:
         :return: new GeoPolygon with CRS specified by crs_str
         """
-        crs = osr.SpatialReference()
-        crs.SetFromUserInput(crs_str)
-        if self.crs.IsSame(crs):
+        if crs_str == self.crs_str or self.crs.IsSame(SPATIAL_REFERENCES.spatial_reference(crs_str)):
             return self
 
-        transform = osr.CoordinateTransformation(self.crs, crs)
+        transform = SPATIAL_REFERENCES.transformation(self.crs_str, crs_str)
         return GeoPolygon([p[:2] for p in transform.TransformPoints(self.points)], crs_str)
 
 
@@ -527,6 +651,7 @@ class GeoBox(object):
     :param affine: Affine transformation defining the location of the storage unit
     :type affine: affine.Affine
     """
+    __slots__ = ('width', 'height', 'affine', 'extent', '_coordinates', '_coordinate_labels')
 
     def __init__(self, width, height, affine, crs_str):
         self.width = width
@@ -537,6 +662,10 @@ class GeoBox(object):
         self.affine.itransform(points)
         self.extent = GeoPolygon(points, crs_str)
 
+        # Computed on first use
+        self._coordinates = None
+        self._coordinate_labels = None
+
     @classmethod
     def from_storage_type(cls, storage_type, tile_index):
         """
@@ -585,6 +714,16 @@ class GeoBox(object):
 
     @property
     def coordinates(self):
+        """
+        Shared by every caller: don't modify it
+
+        :rtype: dict[str, Coordinate]
+        """
+        if self._coordinates is None:
+            self._coordinates = self._make_coordinates()
+        return self._coordinates
+
+    def _make_coordinates(self):
         xs = numpy.array([0, self.width - 1]) * self.affine.a + self.affine.c + self.affine.a / 2
         ys = numpy.array([0, self.height - 1]) * self.affine.e + self.affine.f + self.affine.e / 2
 
@@ -604,8 +743,18 @@ class GeoBox(object):
 
     @property
     def coordinate_labels(self):
-        xs = numpy.arange(self.width) * self.affine.a + self.affine.c + self.affine.a / 2
-        ys = numpy.arange(self.height) * self.affine.e + self.affine.f + self.affine.e / 2
+        """
+        Shared by every caller: don't modify it. The arrays are read-only.
+
+        :rtype: dict[str, numpy.ndarray]
+        """
+        if self._coordinate_labels is None:
+            self._coordinate_labels = self._make_coordinate_labels()
+        return self._coordinate_labels
+
+    def _make_coordinate_labels(self):
+        xs = _read_only(numpy.arange(self.width) * self.affine.a + self.affine.c + self.affine.a / 2)
+        ys = _read_only(numpy.arange(self.height) * self.affine.e + self.affine.f + self.affine.e / 2)
 
         crs = self.crs
         if crs.IsGeographic():
@@ -626,6 +775,11 @@ class GeoBox(object):
         return self.extent.to_crs('EPSG:4326')
 
 
+def _read_only(array):
+    array.flags.writeable = False
+    return array
+
+
 def _get_tile_transform(tile_index, tile_size, tile_res):
     x = (tile_index[0] + (1 if tile_res[0] < 0 else 0)) * tile_size[0]
     y = (tile_index[1] + (1 if tile_res[1] < 0 else 0)) * tile_size[1]
@@ -50,6 +50,7 @@ def read_netcdf_structure(filename):
     extents['time_max'] = netCDF4.num2date(ncsu.coordinates['time'].end, time_units)
 
     coordinates = namedtuples2dicts(ncsu.coordinates)
+    coordinates['time']['values'] = ncsu.get_coord('time')[0].tolist()
 
     return dict(coordinates=coordinates, extents=extents)
 
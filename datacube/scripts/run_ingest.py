@@ -18,6 +18,7 @@ from datacube.ui import click as ui
 from datacube.ui.click import CLICK_SETTINGS
 from datacube.model import Range
 from datacube.ingest import index_datasets, store_datasets
+from datacube.ledger import TaskLedger
 from datacube.storage.storage import stack_storage_units
 from datacube.storage import tile_datasets_with_storage_type
 
@@ -95,12 +96,12 @@ def check(index, check_missing, check_overlaps, types):
     for storage_type in storage_types:
         click.echo('Checking %s' % storage_type.name)
         if check_overlaps:
-            click.echo('Overlaps. Might take REALLY long time...')
+            click.echo('Overlaps...')
             try:
                 overlaps = list(index.storage.get_overlaps(storage_type))
                 click.echo('%s overlaping storage units' % len(overlaps))
             except DBAPIError:
-                click.echo('Failed to get overlaps! cube extension might not be loaded')
+                click.echo('Failed to get overlaps! Storage unit extents may be missing: run "database init"')
 
         if check_missing:
             missing_units = 0
@@ -121,17 +122,29 @@ def check(index, check_missing, check_overlaps, types):
 @cli.command('ingest', help="Ingest datasets into the Data Cube.")
 @ui.executor_cli_options
 @click.option('--no-storage', is_flag=True, help="Don't create storage units")
+@click.option('--ledger', type=click.Path(dir_okay=False, writable=True),
+              help="Record progress in this file, and resume from it. Use the same file to continue an "
+                   "interrupted ingest.")
+@click.option('--warp-threads', type=click.IntRange(min=1), default=1,
+              help="Threads warping each storage unit. Keep (executor workers x warp threads) near the number "
+                   "of cores. Nearest and bilinear resampling gain little from more than one.")
 @click.argument('datasets',
                 type=click.Path(exists=True, readable=True, writable=False),
                 nargs=-1)
 @ui.pass_index
-def ingest(index, executor, datasets, no_storage):
+def ingest(index, executor, datasets, no_storage, ledger, warp_threads):
     indexed_datasets = []
     for dataset_path in datasets:
         indexed_datasets += index_datasets(Path(dataset_path), index=index)
 
     if not no_storage:
-        store_datasets(indexed_datasets, index=index, executor=executor)
+        task_ledger = TaskLedger(ledger) if ledger else None
+        try:
+            store_datasets(indexed_datasets, index=index, executor=executor, ledger=task_ledger,
+                           warp_threads=warp_threads)
+        finally:
+            if task_ledger is not None:
+                task_ledger.close()
 
 
 if __name__ == '__main__':
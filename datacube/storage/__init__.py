@@ -6,5 +6,6 @@ from __future__ import absolute_import
 
 from .storage import (generate_filename,
                       create_storage_unit_from_datasets,
-                      stack_storage_units)
+                      stack_storage_units,
+                      remove_temporary_files)
 from datacube.storage.tiling import tile_datasets_with_storage_type
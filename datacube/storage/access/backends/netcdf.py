@@ -15,8 +15,10 @@
 
 from __future__ import absolute_import, division, print_function
 
-import contextlib
+import os
 import threading
+import weakref
+from contextlib import contextmanager
 
 import numpy
 import netCDF4 as nc4
@@ -24,8 +26,27 @@ import netCDF4 as nc4
 from ..core import StorageUnitBase
 from datacube.model import Coordinate, Variable
 from ..indexing import Range, range_to_index, normalize_index
+from ..pool import HandlePool
+
+#: How reads are serialised:
+#:  - 'global': one read at a time in the process. Required unless HDF5 and netCDF were built thread-safe.
+#:  - 'file': one read at a time per file, different files are read concurrently. Requires a thread-safe HDF5.
+#:  - 'none': no locking at all. Requires thread-safe HDF5 and netCDF libraries.
+LOCKING_MODES = ('global', 'file', 'none')
+
+
+def _check_locking_mode(mode):
+    if mode not in LOCKING_MODES:
+        raise ValueError('Unknown NetCDF locking mode %r, expected one of %s' % (mode, LOCKING_MODES))
+    return mode
+
+
+_LOCKING = {'mode': _check_locking_mode(os.environ.get('DATACUBE_NETCDF_LOCKING', 'global'))}
 
 _GLOBAL_LOCK = threading.RLock()
+#: Locks of the files being read. Dropped once no reader holds them.
+_FILE_LOCKS = weakref.WeakValueDictionary()
+_FILE_LOCKS_GUARD = threading.Lock()
 
 
 def _open_dataset(filepath):
@@ -37,6 +58,52 @@ def _open_dataset(filepath):
     return ncds
 
 
+#: Open read-only datasets, shared by all storage units in the process
+HANDLE_POOL = HandlePool(_open_dataset)
+
+
+def set_locking(mode):
+    """
+    Choose how reads of NetCDF files are serialised. See `LOCKING_MODES`.
+
+    Can also be set with the `DATACUBE_NETCDF_LOCKING` environment variable.
+    """
+    _LOCKING['mode'] = _check_locking_mode(mode)
+
+
+class _NoLock(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _read_lock(path):
+    mode = _LOCKING['mode']
+    if mode == 'global':
+        return _GLOBAL_LOCK
+    if mode == 'file':
+        with _FILE_LOCKS_GUARD:
+            lock = _FILE_LOCKS.get(path)
+            if lock is None:
+                lock = _FILE_LOCKS[path] = threading.RLock()
+            return lock
+    return _NoLock()
+
+
+@contextmanager
+def _locked_dataset(filepath):
+    """
+    Borrow an open dataset from the pool, holding the lock for the configured locking mode.
+
+    :type filepath: pathlib.Path
+    """
+    path = os.path.abspath(str(filepath))
+    with _read_lock(path), HANDLE_POOL.open(path) as ncds:
+        yield ncds
+
+
 def _get_dims_and_dtype(var):
     if var.dtype == str or var.dtype.kind == 'S':
         fake_dim = [d for d in var.dimensions if d.endswith('nchar')]
@@ -61,11 +128,13 @@ def _make_crs(grid_mappings, standard_names):
 
 
 class NetCDF4StorageUnit(StorageUnitBase):
-    def __init__(self, file_path, variables, coordinates, attributes=None, crs=None):
+    def __init__(self, file_path, variables, coordinates, attributes=None, crs=None, coordinate_values=None):
         """
         :param variables: variables in the SU. dict of name: Variable
         :param coordinates: coordinates in the SU
+        :param coordinate_values: known coordinate labels, so they don't need to be read from the file
         :type file_path: pathlib.Path
+        :type coordinate_values: dict[str, numpy.ndarray]
         """
         self.file_path = file_path
         self.coordinates = coordinates
@@ -73,6 +142,7 @@ class NetCDF4StorageUnit(StorageUnitBase):
         self.attributes = attributes or {}
         self.crs = crs or {}
         self._coord_values = {coord_name: None for coord_name in coordinates}
+        self._coord_values.update(coordinate_values or {})
 
     def get_crs(self):
         # Use units for sensible default
@@ -88,7 +158,7 @@ class NetCDF4StorageUnit(StorageUnitBase):
         grid_mappings = {}
         standard_names = {}
 
-        with _GLOBAL_LOCK, contextlib.closing(_open_dataset(file_path)) as ncds:
+        with _locked_dataset(file_path) as ncds:
             attributes = {k: getattr(ncds, k) for k in ncds.ncattrs()}
             for name, var in ncds.variables.items():
                 dims = var.dimensions
@@ -118,23 +188,23 @@ class NetCDF4StorageUnit(StorageUnitBase):
 
         if isinstance(index, slice):
             if self._coord_values[dim] is None:
-                with _GLOBAL_LOCK, contextlib.closing(_open_dataset(self.file_path)) as ncds:
+                with _locked_dataset(self.file_path) as ncds:
                     self._coord_values[dim] = ncds[dim][:]
             return self._coord_values[dim][index], index
 
         if isinstance(index, Range):
             if self._coord_values[dim] is None:
-                with _GLOBAL_LOCK, contextlib.closing(_open_dataset(self.file_path)) as ncds:
+                with _locked_dataset(self.file_path) as ncds:
                     self._coord_values[dim] = ncds[dim][:]
             index = range_to_index(self._coord_values[dim], index)
             return self._coord_values[dim][index], index
 
     def _fill_data(self, name, index, dest):
-        with _GLOBAL_LOCK, contextlib.closing(_open_dataset(self.file_path)) as ncds:
+        with _locked_dataset(self.file_path) as ncds:
             if dest.dtype.kind == 'S' and dest.dtype.itemsize > 1:
                 dest = dest.view('S1').reshape(dest.shape + (-1,))
             numpy.copyto(dest, ncds[name][index])
 
     def get_chunk(self, name, index):
-        with _GLOBAL_LOCK, contextlib.closing(_open_dataset(self.file_path)) as ncds:
+        with _locked_dataset(self.file_path) as ncds:
             return ncds[name][index]
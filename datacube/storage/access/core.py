@@ -233,6 +233,49 @@ class StorageUnitDimensionProxy(StorageUnitBase):
         return dest
 
 
+class StorageUnitSliceProxy(StorageUnitBase):
+    """
+    Proxy exposing a hyperslab of a storage unit
+    """
+    def __init__(self, storage_unit, **slices):
+        """
+        :param storage_unit: storage unit to proxy
+        :param slices: integer slice for each of the dimensions to restrict
+        :type storage_unit: StorageUnitBase
+        :type slices: dict[str, slice]
+        """
+        self._storage_unit = storage_unit
+        self._offsets = {}
+        self._coord_values = {}
+        self.coordinates = storage_unit.coordinates.copy()
+        for dim, slice_ in slices.items():
+            values, index = storage_unit.get_coord(dim, slice_)
+            coord = self.coordinates[dim]
+            self.coordinates[dim] = Coordinate(coord.dtype, values[0], values[-1], values.size, coord.units)
+            self._coord_values[dim] = values
+            self._offsets[dim] = int(index.start)
+        self.variables = storage_unit.variables
+
+    def __getattr__(self, item):
+        return getattr(self._storage_unit, item)
+
+    def get_crs(self):
+        return self._storage_unit.get_crs()
+
+    def get_coord(self, dim, index=None):
+        if dim not in self._coord_values:
+            return self._storage_unit.get_coord(dim, index)
+        coord = self._coord_values[dim]
+        index = make_index(coord, index)
+        return coord[index], index
+
+    def _fill_data(self, name, index, dest):
+        dims = self.variables[name].dimensions
+        index = tuple(slice(i.start + self._offsets.get(dim, 0), i.stop + self._offsets.get(dim, 0), i.step)
+                      for dim, i in zip(dims, index))
+        self._storage_unit._fill_data(name, index, dest)  # pylint: disable=protected-access
+
+
 class StorageUnitStack(StorageUnitBase):
     """
     Proxy stacking multiple storage units along a dimension
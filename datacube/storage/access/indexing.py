@@ -41,11 +41,11 @@ def range_to_index(coord, range_):
     size = coord.size
 
     if size > 1 and coord[0] > coord[1]:  # reversed
-        return slice(size-numpy.searchsorted(coord[::-1], range_.end, side='right') if range_.end else 0,
-                     size-numpy.searchsorted(coord[::-1], range_.begin) if range_.begin else size, 1)
+        return slice(size-numpy.searchsorted(coord[::-1], range_.end, side='right') if range_.end is not None else 0,
+                     size-numpy.searchsorted(coord[::-1], range_.begin) if range_.begin is not None else size, 1)
     else:
-        return slice(numpy.searchsorted(coord, range_.begin) if range_.begin else 0,
-                     numpy.searchsorted(coord, range_.end, side='right') if range_.end else size, 1)
+        return slice(numpy.searchsorted(coord, range_.begin) if range_.begin is not None else 0,
+                     numpy.searchsorted(coord, range_.end, side='right') if range_.end is not None else size, 1)
 
 
 def _expand_index(coord, slice_):
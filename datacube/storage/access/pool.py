@@ -0,0 +1,293 @@
+#    Copyright 2016 Geoscience Australia
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+
+"""
+Pool of open file handles shared between storage units
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import itertools
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from datacube import compat
+
+_LOG = logging.getLogger(__name__)
+
+#: By default a pool may use up to the process file descriptor limit divided by this
+_FD_LIMIT_DIVISOR = 4
+
+
+def _default_max_fds():
+    try:
+        import resource
+    except ImportError:
+        # No rlimits on Windows
+        return None
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit == resource.RLIM_INFINITY:
+        return None
+    return max(1, soft_limit // _FD_LIMIT_DIVISOR)
+
+
+def _key_path(key):
+    """
+    The file a pool key refers to: the key itself, if it is a path
+    """
+    if isinstance(key, compat.string_types):
+        return key
+    return None
+
+
+def _file_identity(path):
+    """
+    Identifies the file at `path`: it changes when the file is modified or replaced
+
+    :rtype: tuple or None
+    """
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_mtime
+
+
+class _PoolEntry(object):
+    def __init__(self, identity):
+        self.handle = None
+        #: The file that was opened, as from `_file_identity`
+        self.identity = identity
+        self.users = 0
+        #: Set once the handle is open (or opening failed)
+        self.ready = threading.Event()
+        self.error = None
+        #: Replaced by a newer handle of the file: closed once no longer in use
+        self.stale = False
+
+
+class HandlePool(object):
+    """
+    LRU cache of open, read-only file handles
+
+    Handles are keyed by file path and shared by every reader of that file. At most `max_handles` handles are
+    kept open, or fewer if they would use more than `max_fds` file descriptors: past that, idle handles are
+    closed in least-recently-used order. Handles that are in use are never closed, so the limits can be
+    exceeded while many are in use at once.
+
+    Files are opened outside the pool's lock, so a slow open only holds up readers of the same file, which wait
+    for it rather than opening the file again. If the file at a path is modified or replaced, the next reader
+    gets a new handle, and the old one is closed once its current readers are done.
+
+    For handles that can't be used by two threads at once, an `exclusive` pool lends each handle to one reader
+    at a time. Readers of a file share its idle handles, and another is opened when they are all in use.
+
+    A pool inherited by a forked child process forgets the handles of its parent, and reopens files as needed.
+
+    >>> pool = HandlePool(opener=lambda path: [path], closer=lambda handle: None, max_handles=1)
+    >>> with pool.open('a') as handle:
+    ...     handle
+    ['a']
+    >>> with pool.open('a') as handle:
+    ...     pass
+    >>> with pool.open('b') as handle:
+    ...     pass
+    >>> sorted(pool.stats.items())
+    [('evictions', 1), ('hits', 1), ('misses', 2), ('open', 1)]
+    """
+    def __init__(self, opener, closer=None, max_handles=64, max_fds=None, fds_per_handle=1, path=_key_path,
+                 exclusive=False):
+        """
+        :param opener: function opening a handle, given the key
+        :param closer: function closing a handle. Calls `handle.close()` by default
+        :param max_handles: maximum number of handles to keep open
+        :param max_fds: maximum number of file descriptors to use. Defaults to a fraction of the process limit
+        :param fds_per_handle: number of file descriptors used by each handle
+        :param path: function giving the file a key refers to, to check whether it has changed. None if unknown
+        :param exclusive: lend each handle to one reader at a time
+        :type max_handles: int
+        :type max_fds: int
+        :type fds_per_handle: int
+        :type exclusive: bool
+        """
+        self._opener = opener
+        self._closer = closer or (lambda handle: handle.close())
+        self._path = path
+        self.exclusive = exclusive
+        self.max_handles = max_handles
+        self.max_fds = max_fds if max_fds is not None else _default_max_fds()
+        self.fds_per_handle = fds_per_handle
+
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        #: Handles by slot: the key, or (key, serial number) in an exclusive pool
+        #: :type: dict[object, _PoolEntry]
+        self._entries = OrderedDict()
+        self._serials = itertools.count()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            # We've been forked: the handles belong to the parent process. Don't touch them.
+            _LOG.debug('Process forked, dropping %s inherited handles', len(self._entries))
+            self._reset()
+
+    @property
+    def _capacity(self):
+        capacity = self.max_handles
+        if self.max_fds is not None:
+            capacity = min(capacity, max(1, self.max_fds // self.fds_per_handle))
+        return capacity
+
+    @contextmanager
+    def open(self, key):
+        """
+        Borrow the handle for `key`, opening it if needed
+
+        :param key: usually the path to the file
+        """
+        slot, entry = self._checkout(key)
+        try:
+            yield entry.handle
+        finally:
+            self._checkin(slot, entry)
+
+    def _checkout(self, key):
+        self._check_pid()
+        identity = _file_identity(self._path(key))
+        to_close = []
+        with self._lock:
+            slot, entry = self._find(key, identity, to_close)
+            is_new = entry is None
+            if is_new:
+                self._misses += 1
+                entry = _PoolEntry(identity)
+                slot = (key, next(self._serials)) if self.exclusive else key
+            else:
+                self._hits += 1
+                del self._entries[slot]
+            # Most recently used go last
+            self._entries[slot] = entry
+            entry.users += 1
+        self._close_all(to_close)
+
+        if is_new:
+            self._open_entry(key, slot, entry)
+        else:
+            entry.ready.wait()
+            if entry.error is not None:
+                self._checkin(slot, entry)
+                raise entry.error
+        return slot, entry
+
+    def _find(self, key, identity, to_close):
+        """
+        The slot and entry of a handle to lend for `key`, or None for the entry if a new one is needed. Handles of
+        a file that has changed since are removed, to be closed once idle.
+        """
+        if self.exclusive:
+            candidates = [(slot, entry) for slot, entry in self._entries.items() if slot[0] == key]
+        else:
+            candidates = [(key, self._entries[key])] if key in self._entries else []
+
+        found = None
+        for slot, entry in candidates:
+            if entry.ready.is_set() and entry.identity != identity:
+                _LOG.debug('%s has changed, reopening it', key)
+                entry.stale = True
+                del self._entries[slot]
+                if entry.users == 0:
+                    to_close.append((slot, entry))
+            elif found is None and (not self.exclusive or entry.users == 0):
+                found = slot, entry
+        return found or (None, None)
+
+    def _open_entry(self, key, slot, entry):
+        # Outside the lock: other files can be borrowed meanwhile. Readers of this one wait for `entry.ready`.
+        try:
+            entry.handle = self._opener(key)
+        except Exception as e:
+            entry.error = e
+            with self._lock:
+                if self._entries.get(slot) is entry:
+                    del self._entries[slot]
+            entry.ready.set()
+            self._checkin(slot, entry)
+            raise
+        entry.ready.set()
+
+    def _checkin(self, slot, entry):
+        with self._lock:
+            entry.users -= 1
+            to_close = self._evict()
+            if entry.stale and entry.users == 0 and entry.error is None:
+                to_close.append((slot, entry))
+        self._close_all(to_close)
+
+    def _evict(self):
+        """
+        Remove the least recently used idle handles over capacity, returning them to be closed
+        """
+        excess = len(self._entries) - self._capacity
+        if excess <= 0:
+            return []
+        idle = [key for key, entry in self._entries.items()
+                if entry.users == 0 and entry.ready.is_set()][:excess]
+        self._evictions += len(idle)
+        return [(key, self._entries.pop(key)) for key in idle]
+
+    def _close_all(self, entries):
+        for slot, entry in entries:
+            try:
+                self._closer(entry.handle)
+            except Exception:  # pylint: disable=broad-except
+                _LOG.warning('Failed to close %s', slot, exc_info=True)
+
+    def clear(self):
+        """
+        Close all idle handles
+        """
+        self._check_pid()
+        with self._lock:
+            idle = [key for key, entry in self._entries.items() if entry.users == 0 and entry.ready.is_set()]
+            to_close = [(key, self._entries.pop(key)) for key in idle]
+        self._close_all(to_close)
+
+    @property
+    def stats(self):
+        """
+        Counters for sizing the pool
+
+        :rtype: dict[str, int]
+        """
+        return {
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'open': len(self._entries),
+        }
+
+    def __len__(self):
+        return len(self._entries)
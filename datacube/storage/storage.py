@@ -4,7 +4,13 @@ Create/store dataset data into storage units based on the provided storage mappi
 """
 from __future__ import absolute_import, division, print_function
 
+import errno
+import itertools
 import logging
+import os
+import socket
+import time
+from collections import OrderedDict
 from contextlib import contextmanager
 from datetime import datetime
 from itertools import groupby
@@ -24,9 +30,11 @@ from rasterio.warp import RESAMPLING
 from datacube import compat
 from datacube.model import StorageUnit, GeoBox, Variable, _uri_to_local_path, time_coordinate_value
 from datacube.storage import netcdf_writer
-from datacube.utils import namedtuples2dicts
+from datacube.storage.warp import get_warp_plan, PLANNED_RESAMPLING
+from datacube.utils import namedtuples2dicts, prefetch
 from datacube.storage.access.core import StorageUnitBase, StorageUnitDimensionProxy, StorageUnitStack
 from datacube.storage.access.backends import NetCDF4StorageUnit, GeoTifStorageUnit
+from datacube.storage.access.pool import HandlePool
 
 _LOG = logging.getLogger(__name__)
 
@@ -39,9 +47,27 @@ RESAMPLING_METHODS = {
     'average': RESAMPLING.average,
 }
 
+#: Storage units are written to a file with this suffix (followed by the host and pid of the writer), and renamed
+#: once complete.
+TEMPORARY_SUFFIX = '.datacube-tmp'
+
+#: Seconds since it was last modified before a temporary file is assumed abandoned, when its writer can't be checked
+ABANDONED_TEMPORARY_FILE_AGE = 24 * 60 * 60
+
+# Buffers needed to prefetch rows of data: one being written, one waiting, and one being read.
+_PREFETCH_BUFFERS = 3
+
+#: Threads GDAL uses to warp each block of data, when blocks aren't warped in parallel
+DEFAULT_GDAL_WARP_THREADS = 4
+
 
 class WarpingStorageUnit(StorageUnitBase):
-    def __init__(self, datasets, geobox, mapping, fuse_func=None):
+    def __init__(self, datasets, geobox, mapping, fuse_func=None, warp_threads=1):
+        """
+        :param warp_threads: warp this many bands of rows of the data at once. Only safe if reading the
+                             datasets does not use the NetCDF/HDF libraries. Planned (nearest and bilinear)
+                             resampling holds the GIL while applying its plan, so only the reads overlap.
+        """
         if not datasets:
             raise ValueError('Shall not make empty StorageUnit')
 
@@ -50,6 +76,7 @@ class WarpingStorageUnit(StorageUnitBase):
         self._varmap = {name: attrs['src_varname'] for name, attrs in mapping.items()}
         self._mapping = mapping
         self._fuse_func = fuse_func
+        self._warp_threads = warp_threads
 
         self.coord_data = self.geobox.coordinate_labels
         self.coordinates = self.geobox.coordinates
@@ -86,25 +113,62 @@ class WarpingStorageUnit(StorageUnitBase):
             src_variable_name = self._varmap[name]
             resampling = RESAMPLING_METHODS[self._mapping[name]['resampling_method']]
             sources = [DatasetSource(dataset, src_variable_name) for dataset in self._datasets]
-            fuse_sources(sources,
-                         dest,
-                         self.geobox[index].affine,  # NOTE: Overloaded GeoBox.__getitem__
-                         self.geobox.crs_str,
-                         self.variables[name].nodata,
-                         resampling=resampling,
-                         fuse_func=self._fuse_func)
+
+            def warp(index, dest, num_threads):
+                fuse_sources(sources,
+                             dest,
+                             self.geobox[index].affine,  # NOTE: Overloaded GeoBox.__getitem__
+                             self.geobox.crs_str,
+                             self.variables[name].nodata,
+                             resampling=resampling,
+                             fuse_func=self._fuse_func,
+                             num_threads=num_threads)
+
+            if self._warp_threads > 1:
+                _warp_in_blocks(warp, index, dest, self._warp_threads)
+            else:
+                warp(index, dest, DEFAULT_GDAL_WARP_THREADS)
         return dest
 
 
+def _warp_in_blocks(warp, index, dest, threads):
+    """
+    Warp bands of rows of `dest` concurrently. GDAL releases the GIL while reading and warping.
+
+    :param warp: function warping the data at (index, dest, num_threads)
+    :type index: tuple[slice]
+    :type dest: numpy.ndarray
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    first_row = index[0].start or 0
+    bounds = numpy.linspace(0, dest.shape[0], min(threads, dest.shape[0]) + 1).astype(int)
+    with ThreadPoolExecutor(len(bounds) - 1) as pool:
+        futures = [pool.submit(warp,
+                               (slice(first_row + begin, first_row + end),) + tuple(index[1:]),
+                               dest[begin:end],
+                               1)
+                   for begin, end in zip(bounds[:-1], bounds[1:])]
+        for future in futures:
+            future.result()
+
+
 # TODO: global_attributes and variable_attributes should be members of access_unit
-def write_access_unit_to_netcdf(access_unit, global_attributes, variable_attributes, variable_params, filename):
+def write_access_unit_to_netcdf(access_unit, global_attributes, variable_attributes, variable_params, filename,
+                                prefetch_data=False):
     """
     Write access.StorageUnit to NetCDF4.
+
+    The file is written alongside `filename` with the TEMPORARY_SUFFIX and the host and pid of this process, and
+    renamed once complete, so `filename` never holds a partially written storage unit.
+
     :param access_unit:
     :param global_attributes: key value pairs to write as global attributes
     :param variable_attributes: mapping of variable name to key-value pairs
     :param variable_params: mapping of variable name to netcdf variable creation params
     :param filename: output filename
+    :param prefetch_data: read the next block of data in a background thread while writing the current one.
+                          Only safe if reading does not use the NetCDF library.
     :return:
 
     :type access_unit: datacube.storage.access.StorageUnitBase
@@ -117,34 +181,199 @@ def write_access_unit_to_netcdf(access_unit, global_attributes, variable_attribu
     except OSError:
         pass
 
+    temporary_filename = _temporary_path(filename)
+    try:
+        _write_netcdf(access_unit, global_attributes, variable_attributes, variable_params, temporary_filename,
+                      prefetch_data)
+        os.rename(str(temporary_filename), str(filename))
+    except:
+        _remove_file(temporary_filename)
+        raise
+
+
+def _write_netcdf(access_unit, global_attributes, variable_attributes, variable_params, filename, prefetch_data):
     nco = netcdf_writer.create_netcdf(str(filename))
-    for name, coord in access_unit.coordinates.items():
-        coord_var = netcdf_writer.create_coordinate(nco, name, coord)
-        coord_var[:] = access_unit.get_coord(name)[0]
-    netcdf_writer.create_grid_mapping_variable(nco, access_unit.crs)
-    if hasattr(access_unit, 'affine'):
-        netcdf_writer.write_gdal_attributes(nco, access_unit.crs, access_unit.affine)
-    netcdf_writer.write_geographical_extents_attributes(nco, access_unit.extent.to_crs('EPSG:4326').points)
-
-    for name, variable in access_unit.variables.items():
-        # Create variable
-        var_params = variable_params.get(name, {})
-        data_var = netcdf_writer.create_variable(nco, name, variable, **var_params)
-
-        # Write data
-        data_var[:] = netcdf_writer.netcdfy_data(access_unit.get(name).values)
-
-        # Write extra attributes
-        for key, value in variable_attributes.get(name, {}).items():
-            if key == 'flags_definition':
-                netcdf_writer.write_flag_definition(data_var, value)
-            else:
-                setattr(data_var, key, value)
+    try:
+        for name, coord in access_unit.coordinates.items():
+            coord_var = netcdf_writer.create_coordinate(nco, name, coord)
+            coord_var[:] = access_unit.get_coord(name)[0]
+        netcdf_writer.create_grid_mapping_variable(nco, access_unit.crs)
+        if hasattr(access_unit, 'affine'):
+            netcdf_writer.write_gdal_attributes(nco, access_unit.crs, access_unit.affine)
+        netcdf_writer.write_geographical_extents_attributes(nco, access_unit.extent.to_crs('EPSG:4326').points)
+
+        data_vars = {}
+        for name, variable in access_unit.variables.items():
+            # Create variable
+            var_params = variable_params.get(name, {})
+            data_var = netcdf_writer.create_variable(nco, name, variable, **var_params)
+
+            # Write extra attributes
+            for key, value in variable_attributes.get(name, {}).items():
+                if key == 'flags_definition':
+                    netcdf_writer.write_flag_definition(data_var, value)
+                else:
+                    setattr(data_var, key, value)
+
+            shape = data_var.shape[:len(variable.dimensions)]
+            data_vars[name] = (data_var, shape, _row_chunksizes(data_var, shape))
+
+        def read_blocks():
+            blocks = _read_variable_rows(access_unit, [(name, shape, chunksizes)
+                                                       for name, (_, shape, chunksizes) in data_vars.items()],
+                                         buffers=_PREFETCH_BUFFERS if prefetch_data else 1)
+            for name, index, data in blocks:
+                yield name, index, netcdf_writer.netcdfy_data(data)
+
+        # Write data, one row of chunks at a time
+        for name, index, data in (prefetch(read_blocks()) if prefetch_data else read_blocks()):
+            data_vars[name][0][index or slice(None)] = data
+
+        # write global atrributes
+        for key, value in global_attributes.items():
+            setattr(nco, key, value)
+    finally:
+        nco.close()
+
+
+def _row_chunksizes(data_var, shape):
+    """
+    Chunk sizes of a NetCDF variable in all but its last dimension (one element if it isn't chunked)
+    """
+    chunking = data_var.chunking()
+    if chunking == 'contiguous':
+        return (1,) * (len(shape) - 1)
+    return tuple(chunking[:max(len(shape) - 1, 0)])
 
-    # write global atrributes
-    for key, value in global_attributes.items():
-        setattr(nco, key, value)
-    nco.close()
+
+def _chunk_rows(shape, chunksizes):
+    """
+    Index of each row of chunks in an array: one chunk deep in every dimension but the last, which is whole.
+
+    >>> list(_chunk_rows((3, 5), (2,)))
+    [(slice(0, 2, None),), (slice(2, 3, None),)]
+    >>> list(_chunk_rows((5,), ()))
+    [()]
+    """
+    starts = [range(0, size, chunksize) for size, chunksize in zip(shape[:-1], chunksizes)]
+    for start in itertools.product(*starts):
+        yield tuple(slice(begin, min(begin + chunksize, size))
+                    for begin, chunksize, size in zip(start, chunksizes, shape))
+
+
+def _read_chunk_rows(access_unit, name, shape, chunksizes, buffers=1):
+    """
+    Read a variable one row of chunks (see `_chunk_rows`) at a time, so memory use doesn't grow with the
+    size of the variable.
+
+    Rows are read into a ring of `buffers` reusable arrays, so each is only valid until `buffers - 1` more
+    have been read.
+
+    :type access_unit: datacube.storage.access.StorageUnitBase
+    :rtype: collections.Iterable[(tuple[slice], numpy.ndarray)]
+    """
+    for _, index, data in _read_variable_rows(access_unit, [(name, shape, chunksizes)], buffers):
+        yield index, data
+
+
+def _read_variable_rows(access_unit, variables, buffers=1):
+    """
+    Read variables one row of chunks at a time, as `_read_chunk_rows` does. Variables chunked alike are read a
+    row at a time across all of them (rather than one variable after another), so each row's warp plans are
+    used by every band while they are still cached.
+
+    :param variables: (name, shape, chunksizes) of each variable
+    :rtype: collections.Iterable[(str, tuple[slice], numpy.ndarray)]
+    """
+    row_bytes = [int(numpy.prod([min(chunksize, size) for chunksize, size in zip(chunksizes, shape)] +
+                                list(shape[len(chunksizes):]))) * access_unit.variables[name].dtype.itemsize
+                 for name, shape, chunksizes in variables]
+    ring = [numpy.empty(max(row_bytes + [0]), dtype=numpy.uint8) for _ in range(buffers)]
+
+    chunkings = OrderedDict()
+    for name, shape, chunksizes in variables:
+        chunkings.setdefault((tuple(shape), tuple(chunksizes)), []).append(name)
+
+    reads = itertools.count()
+    for (shape, chunksizes), names in chunkings.items():
+        for index in _chunk_rows(shape, chunksizes):
+            block_shape = tuple(s.stop - s.start for s in index) + shape[len(index):]
+            for name in names:
+                variable = access_unit.variables[name]
+                # A contiguous block at the start of the buffer, even when the row is cut short at an edge
+                nbytes = int(numpy.prod(block_shape)) * variable.dtype.itemsize
+                dest = ring[next(reads) % buffers][:nbytes].view(variable.dtype).reshape(block_shape)
+                yield name, index, access_unit.get(name, dest=dest, **dict(zip(variable.dimensions, index))).values
+
+
+def _temporary_path(filename):
+    """
+    :type filename: pathlib.Path
+    :rtype: pathlib.Path
+    """
+    return filename.with_name('%s%s.%s.%s' % (filename.name, TEMPORARY_SUFFIX, socket.gethostname(), os.getpid()))
+
+
+def _temporary_file_owner(path):
+    """
+    The host and pid of the process writing a temporary file, or None if it isn't recorded.
+
+    >>> from pathlib import Path
+    >>> _temporary_file_owner(Path('unit.nc.datacube-tmp.node1.example.com.1234'))
+    ('node1.example.com', 1234)
+    >>> _temporary_file_owner(Path('unit.nc.datacube-tmp')) is None
+    True
+
+    :type path: pathlib.Path
+    :rtype: (str, int)
+    """
+    owner = path.name.split(TEMPORARY_SUFFIX, 1)[1]
+    host, _, pid = owner[1:].rpartition('.')
+    if not host or not pid.isdigit():
+        return None
+    return host, int(pid)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _is_abandoned(path, max_age):
+    owner = _temporary_file_owner(path)
+    if owner is not None and owner[0] == socket.gethostname() and not _is_running(owner[1]):
+        return True
+    # Writers on other hosts can't be checked: assume they died if they haven't written anything for a while
+    try:
+        return time.time() - path.stat().st_mtime > max_age
+    except OSError:
+        return False
+
+
+def _remove_file(path):
+    try:
+        os.unlink(str(path))
+    except OSError:
+        pass
+
+
+def remove_temporary_files(directory, max_age=ABANDONED_TEMPORARY_FILE_AGE):
+    """
+    Remove storage units left partially written (by a writer that died) in a directory.
+
+    Files being written by other processes are left alone. A file is only removed if the process that wrote it
+    (on this host) is no longer running, or if it hasn't been modified for `max_age` seconds.
+
+    :type directory: pathlib.Path
+    :param max_age: seconds
+    """
+    for path in directory.glob('*' + TEMPORARY_SUFFIX + '*'):
+        if _is_abandoned(path, max_age):
+            _LOG.info('Removing incomplete storage unit %s', path)
+            _remove_file(path)
 
 
 def _accesss_unit_descriptor(access_unit, **stuff):
@@ -157,17 +386,20 @@ def _accesss_unit_descriptor(access_unit, **stuff):
         'time_min': datetime.fromtimestamp(access_unit.coordinates['time'].begin, tzutc()),
         'time_max': datetime.fromtimestamp(access_unit.coordinates['time'].end, tzutc())
     }
-    coordinates = access_unit.coordinates
-    descriptor = dict(coordinates=namedtuples2dicts(coordinates), extents=extents)
+    coordinates = namedtuples2dicts(access_unit.coordinates)
+    # Time is irregular: record the values so readers don't have to open the file to find them
+    coordinates['time']['values'] = access_unit.get_coord('time')[0].tolist()
+    descriptor = dict(coordinates=coordinates, extents=extents)
     descriptor.update(stuff)
     return descriptor
 
 
-def create_storage_unit_from_datasets(tile_index, datasets, storage_type, output_uri):
+def create_storage_unit_from_datasets(tile_index, datasets, storage_type, output_uri, warp_threads=1):
     """
     Create storage unit at `tile_index` for datasets using mapping
 
     :param tile_index: X,Y index of the storage unit
+    :param warp_threads: threads to warp each block of data with (see `WarpingStorageUnit`)
     :type tile_index: tuple[int, int]
     :type datasets:  list[datacube.model.Dataset]
     :type storage_type:  datacube.model.StorageType
@@ -175,9 +407,12 @@ def create_storage_unit_from_datasets(tile_index, datasets, storage_type, output
     """
     datasets_grouped_by_time = _group_datasets_by_time(datasets)
     geobox = GeoBox.from_storage_type(storage_type, tile_index)
+    # GDAL reads NetCDF/HDF through libraries that aren't thread-safe
+    thread_safe_sources = not any(_is_netcdf_or_hdf(dataset.format) for dataset in datasets)
 
     storage_units = [StorageUnitDimensionProxy(
-        WarpingStorageUnit(group, geobox, mapping=storage_type.measurements),
+        WarpingStorageUnit(group, geobox, mapping=storage_type.measurements,
+                           warp_threads=warp_threads if thread_safe_sources else 1),
         time_coordinate_value(time))
                      for time, group in datasets_grouped_by_time]
     access_unit = StorageUnitStack(storage_units=storage_units, stack_dim='time')
@@ -186,7 +421,9 @@ def create_storage_unit_from_datasets(tile_index, datasets, storage_type, output
                                 storage_type.global_attributes,
                                 storage_type.variable_attributes,
                                 storage_type.variable_params,
-                                _uri_to_local_path(output_uri))
+                                _uri_to_local_path(output_uri),
+                                # Warp the next block of data while writing the current one
+                                prefetch_data=thread_safe_sources)
 
     descriptor = _accesss_unit_descriptor(access_unit, tile_index=tile_index)
     return StorageUnit([dataset.id for dataset in datasets],
@@ -211,7 +448,8 @@ def storage_unit_to_access_unit(storage_unit):
         }
     if storage_unit.storage_type.driver == 'NetCDF CF':
         variables['extra_metadata'] = Variable(numpy.dtype('S30000'), None, ('time',), None)
-        return NetCDF4StorageUnit(storage_unit.local_path, coordinates=coordinates, variables=variables)
+        return NetCDF4StorageUnit(storage_unit.local_path, coordinates=coordinates, variables=variables,
+                                  coordinate_values=storage_unit.coordinate_values)
 
     if storage_unit.storage_type.driver == 'GeoTiff':
         result = GeoTifStorageUnit(storage_unit.local_path, coordinates=coordinates, variables=variables)
@@ -276,9 +514,21 @@ def _parse_time(time):
 
 
 def fuse_sources(sources, destination, dst_transform, dst_projection, dst_nodata,
-                 resampling=RESAMPLING.nearest, fuse_func=None):
+                 resampling=RESAMPLING.nearest, fuse_func=None, num_threads=DEFAULT_GDAL_WARP_THREADS):
+    """
+    Warp the sources onto the destination grid, fusing them into `destination`.
+
+    :param num_threads: threads GDAL warps with. Planned resampling (see `PLANNED_RESAMPLING`) doesn't use GDAL
+                        to warp: it runs in the calling thread, and ignores this.
+    """
     def reproject(source, dest):
         with source.open() as src:
+            if resampling in PLANNED_RESAMPLING and dst_nodata is not None:
+                # Reuse the pixel mapping computed for other bands of the same grid
+                plan = get_warp_plan(source.transform, source.crs, src.shape,
+                                     dst_transform, dst_projection, dest.shape, resampling)
+                plan.apply(src, source.nodata, dest, dst_nodata)
+                return
             rasterio.warp.reproject(src,
                                     dest,
                                     src_transform=source.transform,
@@ -288,7 +538,7 @@ def fuse_sources(sources, destination, dst_transform, dst_projection, dst_nodata
                                     dst_crs=dst_projection,
                                     dst_nodata=dst_nodata,
                                     resampling=resampling,
-                                    NUM_THREADS=4)
+                                    NUM_THREADS=num_threads)
 
     def copyto_fuser(dest, src):
         numpy.copyto(dest, src, where=(src != dst_nodata))
@@ -311,6 +561,44 @@ def fuse_sources(sources, destination, dst_transform, dst_projection, dst_nodata
     return destination
 
 
+def _is_netcdf_or_hdf(format_):
+    return any(nasty_format in format_.lower() for nasty_format in ('netcdf', 'hdf'))
+
+
+class _OpenRaster(object):
+    """
+    An open source raster, with its georeferencing read once
+    """
+    def __init__(self, filename):
+        self.dataset = rasterio.open(filename)
+        self.transform = self.dataset.affine
+        self.crs = self.dataset.crs
+        self.nodatavals = self.dataset.nodatavals
+
+    def close(self):
+        self.dataset.close()
+
+
+def _raster_path(filename):
+    """
+    The file holding a raster, or a subdataset of it
+
+    >>> _raster_path('NetCDF:"/data/unit.nc":B10')
+    '/data/unit.nc'
+    >>> _raster_path('/data/scene_B1.tif')
+    '/data/scene_B1.tif'
+    """
+    if '"' in filename:
+        return filename.split('"')[1]
+    return filename
+
+
+#: Source rasters open in this process, keyed by filename or subdataset. Shared between the bands, storage units
+#: and threads that read them. GDAL handles can't be used by two threads at once, so each is lent to one reader at
+#: a time, and more are opened for concurrent readers.
+RASTER_POOL = HandlePool(_OpenRaster, exclusive=True, path=_raster_path)
+
+
 class DatasetSource(object):
     def __init__(self, dataset, measurement_id):
         dataset_measurement_descriptor = dataset.metadata.measurements_dict[measurement_id]
@@ -323,22 +611,20 @@ class DatasetSource(object):
 
     @contextmanager
     def open(self):
-        for nasty_format in ('netcdf', 'hdf'):
-            if nasty_format in self.format.lower():
-                filename = '%s:"%s":%s' % (self.format, self._filename, self._band_id)
-                bandnumber = 1
-                break
+        if _is_netcdf_or_hdf(self.format):
+            filename = '%s:"%s":%s' % (self.format, self._filename, self._band_id)
+            bandnumber = 1
         else:
             filename = self._filename
             bandnumber = self._band_id
 
         try:
             _LOG.debug("openening %s, band %s", filename, bandnumber)
-            with rasterio.open(filename) as src:
-                self.transform = src.affine
+            with RASTER_POOL.open(filename) as src:
+                self.transform = src.transform
                 self.crs = src.crs
                 self.nodata = src.nodatavals[0] or (0 if self.format == 'JPEG2000' else None)  # TODO: sentinel 2 hack
-                yield rasterio.band(src, bandnumber)
+                yield rasterio.band(src.dataset, bandnumber)
         except Exception as e:
             _LOG.error("Error opening source dataset: %s", filename)
             raise e
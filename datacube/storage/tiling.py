@@ -1,8 +1,11 @@
 from collections import defaultdict
 
-from osgeo import osr, ogr
+import numpy
 from rasterio.coords import BoundingBox
-from rasterio.warp import transform_bounds
+from rasterio.warp import transform
+
+#: Points along each side of a dataset's bounds, when projecting its footprint onto the tile grid
+_FOOTPRINT_SIDE_POINTS = 8
 
 
 def tile_datasets_with_storage_type(datasets, storage_type):
@@ -24,46 +27,109 @@ def _roi_to_bounds(roi, dims):
 
 def _grid_datasets(datasets, bounds_override, grid_proj, grid_size):
     tiles = defaultdict(list)
-    for dataset in datasets:
-        dataset_proj = dataset.crs
-        dataset_bounds = dataset.bounds
-        bounds = bounds_override or BoundingBox(*transform_bounds(dataset_proj, grid_proj, *dataset_bounds))
-
-        for y in range(int(bounds.bottom // grid_size[1]), int(bounds.top // grid_size[1]) + 1):
-            for x in range(int(bounds.left // grid_size[0]), int(bounds.right // grid_size[0]) + 1):
-                tile_index = (x, y)
-                if _check_intersect(tile_index, grid_size, grid_proj, dataset_bounds, dataset_proj):
-                    tiles[tile_index].append(dataset)
+    for dataset, footprint in zip(datasets, _project_footprints(datasets, grid_proj)):
+        for tile_index in _footprint_tiles(footprint, grid_size, bounds_override):
+            tiles[tile_index].append(dataset)
 
     return tiles
 
 
-def _check_intersect(tile_index, tile_size, tile_crs, dataset_bounds, dataset_crs):
-    tile_sr = osr.SpatialReference()
-    tile_sr.SetFromUserInput(tile_crs)
-    dataset_sr = osr.SpatialReference()
-    dataset_sr.SetFromUserInput(dataset_crs)
-    transform = osr.CoordinateTransformation(tile_sr, dataset_sr)
-
-    tile_poly = _poly_from_bounds(tile_index[0] * tile_size[0],
-                                  tile_index[1] * tile_size[1],
-                                  (tile_index[0] + 1) * tile_size[0],
-                                  (tile_index[1] + 1) * tile_size[1],
-                                  32)
-    tile_poly.Transform(transform)
-
-    return tile_poly.Intersects(_poly_from_bounds(*dataset_bounds))
-
-
-def _poly_from_bounds(left, bottom, right, top, segments=None):
-    ring = ogr.Geometry(ogr.wkbLinearRing)
-    ring.AddPoint(left, bottom)
-    ring.AddPoint(left, top)
-    ring.AddPoint(right, top)
-    ring.AddPoint(right, bottom)
-    ring.AddPoint(left, bottom)
-    if segments:
-        ring.Segmentize(2 * (right + top - left - bottom) / segments)
-    poly = ogr.Geometry(ogr.wkbPolygon)
-    poly.AddGeometry(ring)
-    return poly
+def _footprint_rings(bounds, side_points=_FOOTPRINT_SIDE_POINTS):
+    """
+    Points around the edge of each bounding box, anticlockwise from the bottom left
+
+    >>> xs, ys = _footprint_rings([BoundingBox(0, 0, 2, 1)], side_points=2)
+    >>> list(zip(xs[0].tolist(), ys[0].tolist()))
+    [(0.0, 0.0), (1.0, 0.0), (2.0, 0.0), (2.0, 0.5), (2.0, 1.0), (1.0, 1.0), (0.0, 1.0), (0.0, 0.5)]
+
+    :type bounds: list[rasterio.coords.BoundingBox]
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    left, bottom, right, top = numpy.asarray(bounds, dtype=numpy.float64).reshape(-1, 4).T[:, :, None]
+    steps = numpy.linspace(0, 1, side_points, endpoint=False)
+    shape = (left.shape[0], side_points)
+    xs = numpy.concatenate([left + (right - left) * steps, numpy.broadcast_to(right, shape),
+                            right - (right - left) * steps, numpy.broadcast_to(left, shape)], axis=1)
+    ys = numpy.concatenate([numpy.broadcast_to(bottom, shape), bottom + (top - bottom) * steps,
+                            numpy.broadcast_to(top, shape), top - (top - bottom) * steps], axis=1)
+    return xs, ys
+
+
+def _project_footprints(datasets, crs):
+    """
+    The footprint of each dataset (see `_footprint_rings`), in `crs`.
+
+    The footprints of all datasets in the same CRS are projected together, so the projection is only set up
+    once per CRS.
+
+    :type datasets: list[datacube.model.Dataset]
+    :rtype: list[(numpy.ndarray, numpy.ndarray)]
+    """
+    footprints = [None] * len(datasets)
+    datasets_by_crs = defaultdict(list)
+    for i, dataset in enumerate(datasets):
+        datasets_by_crs[dataset.crs].append(i)
+
+    for dataset_crs, indexes in datasets_by_crs.items():
+        xs, ys = _footprint_rings([datasets[i].bounds for i in indexes])
+        if dataset_crs != crs:
+            projected_xs, projected_ys = transform(dataset_crs, crs, xs.ravel(), ys.ravel())
+            xs = numpy.asarray(projected_xs).reshape(xs.shape)
+            ys = numpy.asarray(projected_ys).reshape(ys.shape)
+        for i, x, y in zip(indexes, xs, ys):
+            footprints[i] = (x, y)
+    return footprints
+
+
+def _footprint_tiles(footprint, grid_size, bounds_override=None):
+    """
+    Indexes of the tiles a footprint touches, rasterising it one row of tiles at a time.
+
+    Within each row, every tile between the leftmost and rightmost points of the footprint in the row is
+    covered: exact for convex footprints, like projected bounding boxes.
+
+    >>> xs, ys = _footprint_rings([BoundingBox(5, 5, 25, 15)])
+    >>> sorted(_footprint_tiles((xs[0], ys[0]), (10, 10)))
+    [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)]
+
+    :param footprint: (xs, ys) of the points around the footprint
+    :param bounds_override: only tiles within these bounds
+    :type bounds_override: rasterio.coords.BoundingBox
+    :rtype: list[tuple[int, int]]
+    """
+    xs, ys = footprint
+    width, height = grid_size
+    # Edges from each point to the next
+    x0, y0 = xs, ys
+    x1, y1 = numpy.concatenate((xs[1:], xs[:1])), numpy.concatenate((ys[1:], ys[:1]))
+
+    bottom, top = ys.min(), ys.max()
+    if bounds_override:
+        bottom, top = max(bottom, bounds_override.bottom), min(top, bounds_override.top)
+        if bottom > top:
+            return []
+    rows = numpy.arange(numpy.floor(bottom / height), numpy.floor(top / height) + 1)
+
+    # Clip each edge to the vertical extent of each row
+    row_bottoms, row_tops = rows[:, None] * height, (rows[:, None] + 1) * height
+    low = numpy.maximum(numpy.minimum(y0, y1), row_bottoms)
+    high = numpy.minimum(numpy.maximum(y0, y1), row_tops)
+    in_row = low <= high
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slope = (x1 - x0) / (y1 - y0)
+        horizontal = y1 == y0
+        x_low = numpy.where(horizontal, x0, x0 + (low - y0) * slope)
+        x_high = numpy.where(horizontal, x1, x0 + (high - y0) * slope)
+    lefts = numpy.where(in_row, numpy.minimum(x_low, x_high), numpy.inf).min(axis=1)
+    rights = numpy.where(in_row, numpy.maximum(x_low, x_high), -numpy.inf).max(axis=1)
+
+    tiles = []
+    for row, left, right in zip(rows, lefts, rights):
+        if left > right:
+            continue
+        if bounds_override:
+            left, right = max(left, bounds_override.left), min(right, bounds_override.right)
+            if left > right:
+                continue
+        tiles.extend((x, int(row)) for x in range(int(left // width), int(right // width) + 1))
+    return tiles
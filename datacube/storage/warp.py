@@ -0,0 +1,263 @@
+# coding=utf-8
+"""
+Warp plans: where each pixel of a destination grid is read from in a source grid.
+
+Computing the mapping means projecting every destination pixel, which GDAL repeats for every band it warps.
+A plan is computed once per pair of grids, and applied to each band of the source with a NumPy gather.
+"""
+from __future__ import absolute_import, division
+
+import logging
+import os
+import threading
+
+import cachetools
+import numpy
+import rasterio.warp
+from rasterio.warp import RESAMPLING
+
+_LOG = logging.getLogger(__name__)
+
+#: Resampling methods that can be planned. Others are left to GDAL.
+PLANNED_RESAMPLING = (RESAMPLING.nearest, RESAMPLING.bilinear)
+
+# Pixels between those projected exactly, when projecting between coordinate reference systems
+_APPROXIMATION_STEP = 16
+
+#: Memory used by cached plans, in bytes (set in megabytes by DATACUBE_WARP_PLAN_CACHE_MB). Plans take 8 bytes per
+#: destination pixel for nearest resampling and 41 for bilinear, so the default holds those of a 4000 x 500 pixel
+#: row of chunks from 16 nearest or 3 bilinear sources.
+MAX_CACHED_PLAN_BYTES = int(os.environ.get('DATACUBE_WARP_PLAN_CACHE_MB', 256)) * 1024 * 1024
+
+
+def _plan_cache(max_bytes):
+    return cachetools.LRUCache(max_bytes, getsizeof=lambda plan: plan.nbytes)
+
+
+_PLANS = {'cache': _plan_cache(MAX_CACHED_PLAN_BYTES)}
+_PLANS_LOCK = threading.Lock()
+
+
+def set_plan_cache_size(max_bytes):
+    """
+    Change the memory used by cached plans, in bytes. Plans already cached are dropped.
+
+    Can also be set (in megabytes) with the `DATACUBE_WARP_PLAN_CACHE_MB` environment variable.
+
+    :type max_bytes: int
+    """
+    with _PLANS_LOCK:
+        _PLANS['cache'] = _plan_cache(max_bytes)
+
+
+def _crs_key(crs):
+    if isinstance(crs, dict):
+        return tuple(sorted(crs.items()))
+    return str(crs)
+
+
+def _same_crs(crs1, crs2):
+    return _crs_key(crs1) == _crs_key(crs2)
+
+
+class WarpPlan(object):
+    """
+    The source pixels each destination pixel is resampled from.
+
+    Only the destination pixels with source pixels to read are kept, as offsets into the window of the source
+    read. For nearest resampling each reads one source pixel, for bilinear the four around it, with weights.
+    """
+
+    def __init__(self, resampling, window, dst_index, src_index, inside=None, weights=None, centre=None):
+        """
+        :param window: ((row_begin, row_end), (col_begin, col_end)) of the source to read, or None for nothing
+        :param dst_index: flat indexes of the destination pixels that are read
+        :param src_index: flat indexes into the window of the pixels read (for each corner, if bilinear)
+        :param inside: whether each corner is inside the window (if bilinear)
+        :param weights: the weight of each corner (if bilinear)
+        :param centre: the corner whose pixel contains each point (if bilinear)
+        """
+        self.resampling = resampling
+        self.window = window
+        self.dst_index = dst_index
+        self.src_index = src_index
+        self.inside = inside
+        self.weights = weights
+        self.centre = centre
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.dst_index, self.src_index, self.inside, self.weights, self.centre)
+                   if a is not None)
+
+    def apply(self, band, src_nodata, dest, dst_nodata):
+        """
+        Resample a source band into `dest`. Pixels without valid source data are set to `dst_nodata`.
+
+        :type band: rasterio.Band
+        :type dest: numpy.ndarray
+        """
+        dest.fill(dst_nodata)
+        if self.window is None:
+            return dest
+
+        data = band.ds.read(band.bidx, window=self.window).ravel()
+
+        if self.resampling == RESAMPLING.nearest:
+            values = data[self.src_index]
+            valid = _is_data(values, src_nodata)
+            dest.flat[self.dst_index[valid]] = values[valid]
+            return dest
+
+        values = data[self.src_index]
+        usable = self.inside & _is_data(values, src_nodata)
+        weights = numpy.where(usable, self.weights, 0)
+        total = (weights * numpy.where(usable, values, 0)).sum(axis=0, dtype=numpy.float64)
+        weight = weights.sum(axis=0, dtype=numpy.float64)
+
+        # As in GDAL, only interpolate around source pixels that have data themselves
+        valid = usable[self.centre, numpy.arange(self.centre.size)] & (weight > 0)
+        values = total[valid] / weight[valid]
+        if numpy.issubdtype(dest.dtype, numpy.integer):
+            values = numpy.round(values)
+        dest.flat[self.dst_index[valid]] = values
+        return dest
+
+
+def _is_data(values, nodata):
+    if nodata is None:
+        return numpy.ones(values.shape, dtype=bool)
+    if numpy.issubdtype(numpy.asarray(nodata).dtype, numpy.floating) and numpy.isnan(nodata):
+        return ~numpy.isnan(values)
+    return values != nodata
+
+
+def _index_dtype(size):
+    """
+    The smallest signed integer type able to index an array of `size` elements
+
+    >>> _index_dtype(4000 * 4000), _index_dtype(2 ** 31 + 1)
+    (dtype('int32'), dtype('int64'))
+    """
+    return numpy.dtype(numpy.int32 if size <= numpy.iinfo(numpy.int32).max else numpy.int64)
+
+
+def _sample_points(size):
+    """
+    Points projected exactly along a dimension, between which positions are interpolated.
+
+    >>> _sample_points(40).tolist()
+    [0, 16, 32, 39]
+    """
+    return numpy.unique(numpy.append(numpy.arange(0, size, _APPROXIMATION_STEP), size - 1))
+
+
+def _source_pixels(src_transform, src_crs, dst_transform, dst_crs, dst_shape):
+    """
+    The (fractional) source pixel position of the centre of each destination pixel.
+
+    Like GDAL's approximate transformer, only every few pixels are projected exactly, and the positions
+    between them interpolated.
+    """
+    def to_source(dst_rows, dst_cols):
+        xs = dst_transform.a * dst_cols + dst_transform.b * dst_rows + dst_transform.c
+        ys = dst_transform.d * dst_cols + dst_transform.e * dst_rows + dst_transform.f
+        if not _same_crs(src_crs, dst_crs):
+            shape = xs.shape
+            xs, ys = rasterio.warp.transform(dst_crs, src_crs, xs.ravel(), ys.ravel())
+            xs, ys = numpy.asarray(xs).reshape(shape), numpy.asarray(ys).reshape(shape)
+        inverse = ~src_transform
+        return inverse.d * xs + inverse.e * ys + inverse.f, inverse.a * xs + inverse.b * ys + inverse.c
+
+    if _same_crs(src_crs, dst_crs):
+        dst_rows, dst_cols = numpy.indices(dst_shape, dtype=numpy.float64) + 0.5
+        return to_source(dst_rows, dst_cols)
+
+    sample_rows, sample_cols = _sample_points(dst_shape[0]), _sample_points(dst_shape[1])
+    grid_rows, grid_cols = numpy.meshgrid(sample_rows + 0.5, sample_cols + 0.5, indexing='ij')
+    grid = to_source(grid_rows, grid_cols)
+
+    def interpolate(values):
+        # Along each row of the grid, then down each column
+        rows = numpy.array([numpy.interp(numpy.arange(dst_shape[1]), sample_cols, row) for row in values])
+        return numpy.array([numpy.interp(numpy.arange(dst_shape[0]), sample_rows, col) for col in rows.T]).T
+
+    return interpolate(grid[0]), interpolate(grid[1])
+
+
+def make_warp_plan(src_transform, src_crs, src_shape, dst_transform, dst_crs, dst_shape, resampling):
+    """
+    Work out where each pixel of the destination grid is read from in the source grid.
+
+    >>> from affine import Affine
+    >>> plan = make_warp_plan(Affine.scale(1, 1), 'EPSG:4326', (4, 4), Affine.scale(2, 2), 'EPSG:4326', (3, 3),
+    ...                       RESAMPLING.nearest)
+    >>> plan.window, plan.dst_index.tolist(), plan.src_index.tolist()
+    (((1, 4), (1, 4)), [0, 1, 3, 4], [0, 2, 6, 8])
+
+    :type src_shape: tuple[int, int]
+    :type dst_shape: tuple[int, int]
+    :rtype: WarpPlan
+    """
+    rows, cols = _source_pixels(src_transform, src_crs, dst_transform, dst_crs, dst_shape)
+
+    if resampling == RESAMPLING.nearest:
+        rows, cols = numpy.floor(rows).ravel(), numpy.floor(cols).ravel()
+        extent = 1
+    else:
+        # Interpolate between the centres of the surrounding pixels
+        rows, cols = rows.ravel() - 0.5, cols.ravel() - 0.5
+        top, left = numpy.floor(rows), numpy.floor(cols)
+        row_offsets, col_offsets = rows - top, cols - left
+        rows, cols = top, left
+        extent = 2
+
+    needed = (rows + extent > 0) & (rows < src_shape[0]) & (cols + extent > 0) & (cols < src_shape[1])
+    dst_index = numpy.flatnonzero(needed).astype(_index_dtype(dst_shape[0] * dst_shape[1]))
+    if not dst_index.size:
+        return WarpPlan(resampling, None, dst_index, dst_index)
+
+    rows, cols = rows[needed].astype(numpy.int64), cols[needed].astype(numpy.int64)
+    row_begin, row_end = max(rows.min(), 0), min(rows.max() + extent, src_shape[0])
+    col_begin, col_end = max(cols.min(), 0), min(cols.max() + extent, src_shape[1])
+    window = ((int(row_begin), int(row_end)), (int(col_begin), int(col_end)))
+    rows, cols = rows - row_begin, cols - col_begin
+    width = col_end - col_begin
+    # Plans are kept for many bands and chunks: use the narrowest indexes that fit the window read
+    src_dtype = _index_dtype((row_end - row_begin) * width)
+
+    if resampling == RESAMPLING.nearest:
+        return WarpPlan(resampling, window, dst_index, (rows * width + cols).astype(src_dtype))
+
+    row_offsets, col_offsets = row_offsets[needed], col_offsets[needed]
+    corners = [(0, 0), (0, 1), (1, 0), (1, 1)]
+    corner_rows = numpy.array([rows + row_step for row_step, _ in corners])
+    corner_cols = numpy.array([cols + col_step for _, col_step in corners])
+    inside = ((corner_rows >= 0) & (corner_rows < row_end - row_begin) &
+              (corner_cols >= 0) & (corner_cols < width))
+    src_index = numpy.where(inside, corner_rows * width + corner_cols, 0).astype(src_dtype)
+    weights = numpy.array([(row_offsets if row_step else 1 - row_offsets) *
+                           (col_offsets if col_step else 1 - col_offsets)
+                           for row_step, col_step in corners], dtype=numpy.float32)
+    centre = (row_offsets >= 0.5) * 2 + (col_offsets >= 0.5)
+    return WarpPlan(resampling, window, dst_index, src_index, inside, weights, centre.astype(numpy.int8))
+
+
+def get_warp_plan(src_transform, src_crs, src_shape, dst_transform, dst_crs, dst_shape, resampling):
+    """
+    A warp plan (see `make_warp_plan`) shared by every band read between the same grids.
+
+    :rtype: WarpPlan
+    """
+    key = (tuple(src_transform), _crs_key(src_crs), tuple(src_shape),
+           tuple(dst_transform), _crs_key(dst_crs), tuple(dst_shape), resampling)
+    with _PLANS_LOCK:
+        plan = _PLANS['cache'].get(key)
+    if plan is None:
+        plan = make_warp_plan(src_transform, src_crs, src_shape, dst_transform, dst_crs, dst_shape, resampling)
+        with _PLANS_LOCK:
+            try:
+                _PLANS['cache'][key] = plan
+            except ValueError:
+                _LOG.debug('Warp plan of %s bytes is too large to cache', plan.nbytes)
+    return plan
@@ -5,9 +5,12 @@ Utility functions used in storage modules
 from __future__ import absolute_import, division, print_function
 
 import logging
+import threading
 from datetime import datetime
 from dateutil.tz import tzutc
 
+from datacube.compat import queue
+
 _LOG = logging.getLogger(__name__)
 
 
@@ -33,3 +36,52 @@ def attrs_all_equal(iterable, attr_name):
     :rtype: bool
     """
     return len({getattr(item, attr_name, float('nan')) for item in iterable}) <= 1
+
+
+def prefetch(iterable, size=1):
+    """
+    Iterate over `iterable` in a background thread, keeping up to `size` items ready for the consumer
+
+    Lets producing the next item (eg. reading and warping data) overlap with consuming the current one
+    (eg. writing it), while bounding how many items are held in memory.
+
+    >>> list(prefetch(range(5)))
+    [0, 1, 2, 3, 4]
+    """
+    items = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:  # pylint: disable=broad-except
+            put((done, e))
+            return
+        put((done, None))
+
+    producer = threading.Thread(target=produce, name='prefetch')
+    producer.daemon = True
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
@@ -23,7 +23,7 @@ setup(name='datacube',
           'click>=5.0',
           'pathlib',
           'pyyaml',
-          'sqlalchemy',
+          'sqlalchemy>=1.1',
           'python-dateutil',
           'jsonschema',
           'cachetools',
@@ -2,9 +2,12 @@
 
 from __future__ import absolute_import
 
+import contextlib
+import copy
 import datetime
+from collections import namedtuple
 
-from datacube.index._datasets import _ensure_dataset
+from datacube.index._datasets import _ensure_dataset, _ensure_datasets, CollectionResource, DatasetResource
 from datacube.model import Collection, DatasetOffsets, DatasetMatcher, MetadataType
 
 _nbar_uuid = 'f2f12372-8366-11e5-817e-1040f381a756'
@@ -141,6 +144,7 @@ class MockDb(object):
         self.dataset = []
         self.dataset_source = set()
         self.already_ingested = set()
+        self.bulk_inserts = 0
 
     def insert_dataset(self, metadata_doc, dataset_id, collection_id=None):
         # Will we pretend this one was already ingested?
@@ -153,6 +157,18 @@ class MockDb(object):
     def insert_dataset_source(self, classifier, dataset_id, source_dataset_id):
         self.dataset_source.add((classifier, dataset_id, source_dataset_id))
 
+    def insert_datasets_bulk(self, datasets):
+        self.bulk_inserts += 1
+        inserted = set()
+        for dataset in datasets:
+            if dataset['id'] not in self.already_ingested and dataset['id'] not in inserted:
+                self.dataset.append((dataset['metadata'], dataset['id'], dataset['collection_ref']))
+                inserted.add(dataset['id'])
+        return inserted
+
+    def insert_dataset_sources_bulk(self, sources):
+        self.dataset_source.update(sources)
+
 
 class MockCollectionResource(object):
     def __init__(self, collection):
@@ -231,3 +247,90 @@ def test_index_two_levels_already_ingested():
         ('ortho', _nbar_uuid, _ortho_uuid),
         ('satellite_telemetry_data', _ortho_uuid, _telemetry_uuid)
     }
+
+
+def test_index_many_datasets():
+    mock_db = MockDb()
+    mock_db.already_ingested = {_telemetry_uuid}
+    results = _ensure_datasets(mock_db, lambda doc: _EXAMPLE_COLLECTION, [_EXAMPLE_NBAR])
+
+    assert [(dataset_id, was_inserted) for dataset_id, _, _, was_inserted in results] == [(_nbar_uuid, True)]
+    assert {d[1] for d in mock_db.dataset} == {_nbar_uuid, _ortho_uuid}
+    assert mock_db.dataset_source == {
+        ('ortho', _nbar_uuid, _ortho_uuid),
+        ('satellite_telemetry_data', _ortho_uuid, _telemetry_uuid)
+    }
+    # One insert per level of lineage, rather than per dataset
+    assert mock_db.bulk_inserts == 3
+
+
+_DatasetRecord = namedtuple('_DatasetRecord', ('id', 'collection_ref', 'metadata', 'local_uri'))
+
+
+class MockBatchDb(MockDb):
+    def __init__(self, stored):
+        super(MockBatchDb, self).__init__()
+        self.stored = stored
+        self.already_ingested = set(stored)
+        self.locations = []
+
+    @contextlib.contextmanager
+    def begin(self):
+        yield self
+
+    def insert_dataset_locations_bulk(self, locations):
+        self.locations.extend(locations)
+
+    def get_datasets(self, dataset_ids):
+        return [self.stored[dataset_id] for dataset_id in dataset_ids]
+
+
+class MockCollectionIdResource(MockCollectionResource):
+    def get(self, id_):
+        return self.collection
+
+
+def test_add_many_returns_the_stored_documents_of_existing_datasets():
+    stored_doc = copy.deepcopy(_EXAMPLE_NBAR)
+    stored_doc['ga_label'] = 'previously indexed'
+    mock_db = MockBatchDb({_nbar_uuid: _DatasetRecord(_nbar_uuid, 1, stored_doc, 'file:///data/existing.yaml')})
+    datasets = DatasetResource(mock_db, None, MockCollectionIdResource(_EXAMPLE_COLLECTION))
+
+    ortho_doc = _EXAMPLE_NBAR['lineage']['source_datasets']['ortho']
+    results = datasets.add_many([(_EXAMPLE_NBAR, 'file:///data/new.yaml'), (ortho_doc, None)], batch_size=10)
+
+    (nbar, nbar_inserted), (ortho, ortho_inserted) = results
+    assert not nbar_inserted
+    assert nbar.metadata_doc['ga_label'] == 'previously indexed'
+    assert nbar.local_uri == 'file:///data/existing.yaml'
+    assert ortho_inserted
+    assert ortho.metadata_doc['id'] == _ortho_uuid
+
+
+class MockCollectionDb(object):
+    def __init__(self, records):
+        self.records = records
+        self.loads = 0
+
+    def get_all_collections(self):
+        self.loads += 1
+        return self.records
+
+
+class MockMetadataTypeResource(object):
+    def get(self, id_):
+        return _EXAMPLE_METADATA_TYPE
+
+
+def test_match_collection_by_priority():
+    db = MockCollectionDb([
+        {'id': 1, 'name': 'eo', 'dataset_metadata': {}, 'match_priority': 999, 'metadata_type_ref': 1},
+        {'id': 2, 'name': 'ortho', 'dataset_metadata': {'product_type': 'ortho'}, 'match_priority': 10,
+         'metadata_type_ref': 1},
+    ])
+    collections = CollectionResource(db, MockMetadataTypeResource())
+
+    assert collections.get_for_dataset_doc({'product_type': 'ortho', 'id': _ortho_uuid}).name == 'ortho'
+    assert collections.get_for_dataset_doc(_EXAMPLE_NBAR).name == 'eo'
+    # Collections were loaded once
+    assert db.loads == 1
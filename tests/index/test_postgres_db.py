@@ -0,0 +1,171 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import os
+import threading
+
+from sqlalchemy import create_engine, select, literal_column, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import QueuePool
+
+from datacube.index.postgres._api import PostgresDb, _guard_pool_across_forks, _BegunTransaction
+from datacube.index.postgres._api import _storage_unit_extents, _storage_unit_extent_updates
+from datacube.index.postgres.tables import STORAGE_UNIT
+
+
+def _sqlite_db():
+    engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=2,
+                           connect_args={'check_same_thread': False})
+    _guard_pool_across_forks(engine)
+    return PostgresDb(engine)
+
+
+def test_operations_use_the_threads_transaction():
+    db = _sqlite_db()
+    assert db._connection is db._engine
+
+    with db.begin():
+        connection = db._connection
+        assert connection is not db._engine
+
+        with db.begin():
+            # Nested transactions join the outer one
+            assert db._connection is connection
+
+        seen_by_other_thread = []
+        thread = threading.Thread(target=lambda: seen_by_other_thread.append(db._connection))
+        thread.start()
+        thread.join()
+        assert seen_by_other_thread == [db._engine]
+
+    assert db._connection is db._engine
+    assert db._engine.pool.checkedout() == 0
+
+
+def test_transaction_connection_released_on_error():
+    db = _sqlite_db()
+    try:
+        with db.begin():
+            raise ValueError('Something went wrong')
+    except ValueError:
+        pass
+
+    assert db._connection is db._engine
+    assert db._engine.pool.checkedout() == 0
+
+
+def test_forked_db_does_not_reuse_parent_connections():
+    db = _sqlite_db()
+    with db.begin():
+        pass
+    parent_pool = db._engine.pool
+
+    # Pretend we are in a child process
+    db._pid = os.getpid() + 1
+    assert db._connection is db._engine
+
+    assert db._engine.pool is not parent_pool
+    assert db._pid == os.getpid()
+
+
+def test_streamed_results_release_their_connection():
+    db = _sqlite_db()
+    db.yield_per = 2
+    query = select([literal_column('1')]).select_from(text('(select 1 union all select 2 union all select 3) a'))
+
+    assert len(list(db._stream_results(query))) == 3
+    assert db._engine.pool.checkedout() == 0
+
+    results = db._stream_results(query)
+    next(results)
+    assert db._engine.pool.checkedout() == 1
+    results.close()
+    assert db._engine.pool.checkedout() == 0
+
+
+class _RecordingConnection(object):
+    def __init__(self, dialect):
+        self.dialect = postgresql.dialect() if dialect == 'postgresql' else create_engine('sqlite://').dialect
+        self.statements = []
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+
+
+def test_streaming_transactions_are_read_only():
+    connection = _RecordingConnection('postgresql')
+    with _BegunTransaction(connection, read_only=True):
+        pass
+    with _BegunTransaction(connection):
+        pass
+    assert connection.statements == ['BEGIN READ ONLY', 'COMMIT', 'BEGIN', 'COMMIT']
+
+    # SQLite has no read-only transactions
+    connection = _RecordingConnection('sqlite')
+    with _BegunTransaction(connection, read_only=True):
+        pass
+    assert connection.statements == ['BEGIN', 'COMMIT']
+
+
+def test_storage_unit_search_of_some_columns_skips_datasets():
+    db = _sqlite_db()
+    db._stream_results = lambda query: query
+
+    lean = str(db.search_storage_units((), columns=['id', 'path']).compile(dialect=postgresql.dialect()))
+    assert 'array_agg' not in lean
+    assert 'dataset_storage' not in lean
+
+    with_datasets = db.search_storage_units((), columns=['id', 'dataset_refs'])
+    assert 'array_agg' in str(with_datasets.compile(dialect=postgresql.dialect()))
+
+
+def test_storage_unit_extents_are_searched_by_column():
+    db = _sqlite_db()
+    search_fields = {
+        'time': {'type': 'datetime-range',
+                 'min_offset': [['extents', 'time_min']], 'max_offset': [['extents', 'time_max']]},
+        'lat': {'type': 'float-range',
+                'min_offset': [['extents', 'geospatial_lat_min']], 'max_offset': [['extents', 'geospatial_lat_max']]},
+        'other': {'type': 'float-range',
+                  'min_offset': [['extents', 'other_min']], 'max_offset': [['extents', 'other_max']]},
+    }
+    fields = db.get_storage_unit_fields({'id': 1, 'definition': {'storage_unit': {'search_fields': search_fields}}})
+
+    assert fields['time'].alchemy_column is STORAGE_UNIT.c.time_extent
+    assert fields['lat'].alchemy_column is STORAGE_UNIT.c.lat_extent
+    assert fields['other'].alchemy_column is STORAGE_UNIT.c.descriptor
+
+    expression = fields['time'].between(datetime.datetime(2001, 1, 1), datetime.datetime(2002, 1, 1))
+    assert 'time_extent &&' in str(expression.alchemy_expression.compile(dialect=postgresql.dialect()))
+
+
+def _storage_type_row(id_, crs):
+    return {'id': id_, 'definition': {'storage': {'crs': crs}}}
+
+
+def test_storage_unit_extents_are_filled_in_by_the_database():
+    updates = _storage_unit_extent_updates([_storage_type_row(1, 'EPSG:4326'), _storage_type_row(2, 'EPSG:3577')])
+
+    compiled = [str(update.compile(dialect=postgresql.dialect())) for update in updates]
+    # One statement for every storage unit, then one per storage type for the grid extents
+    assert len(compiled) == 3
+    assert 'WHERE' not in compiled[0]
+    assert 'tstzrange' in compiled[0] and 'numrange' in compiled[0]
+    assert 'storage_type_ref' in compiled[1] and 'storage_type_ref' in compiled[2]
+
+    # Geographic storage types have their grid extent in (longitude, latitude)
+    params = updates[1].compile(dialect=postgresql.dialect()).params
+    assert params['descriptor_1'] == ('coordinates', 'longitude', 'begin')
+    assert params['descriptor_2'] == ('coordinates', 'latitude', 'begin')
+
+
+def test_storage_unit_grid_extent_uses_the_spatial_dimensions():
+    descriptor = {'coordinates': {'latitude': {'begin': -35.0, 'end': -36.0},
+                                  'longitude': {'begin': 148.0, 'end': 149.0}}}
+
+    grid_extent = _storage_unit_extents(descriptor, ('longitude', 'latitude'))['grid_extent']
+    params = grid_extent.compile(dialect=postgresql.dialect()).params
+    assert sorted(params.items()) == [('point_1', 148.0), ('point_2', -35.0), ('point_3', 149.0), ('point_4', -36.0)]
+
+    assert _storage_unit_extents(descriptor)['grid_extent'] is None
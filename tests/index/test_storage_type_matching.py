@@ -0,0 +1,59 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+from datacube.index._storage import StorageTypeResource
+from datacube.index.fields import DocumentMatcher
+
+
+class MockDb(object):
+    def __init__(self, records):
+        self.records = records
+        self.loads = 0
+
+    def get_all_storage_types(self):
+        self.loads += 1
+        return self.records
+
+    def get_storage_type(self, id_):
+        return [record for record in self.records if record['id'] == id_][0]
+
+
+class MockConfig(object):
+    location_mappings = {'eotiles': 'file:///tmp/'}
+
+
+def _record(id_, match):
+    return {
+        'id': id_,
+        'name': 'type_%s' % id_,
+        'dataset_metadata': match,
+        'definition': {'location_name': 'eotiles', 'match': {'metadata': match}},
+    }
+
+
+def test_storage_types_are_matched_in_process():
+    db = MockDb([
+        _record(1, {'platform': {'code': 'LANDSAT_5'}, 'product_type': 'NBAR'}),
+        _record(2, {'platform': {'code': 'LANDSAT_7'}, 'product_type': 'NBAR'}),
+        _record(3, {'product_type': 'NBAR'}),
+    ])
+    types = StorageTypeResource(db, MockConfig())
+
+    for _ in range(3):
+        matched = types.get_for_dataset_doc({'platform': {'code': 'LANDSAT_7'}, 'product_type': 'NBAR'})
+        assert sorted(storage_type.id for storage_type in matched) == [2, 3]
+
+    assert types.get_for_dataset_doc({'platform': {'code': 'LANDSAT_7'}, 'product_type': 'PQ'}) == []
+    # All storage types were loaded once
+    assert db.loads == 1
+
+
+def test_matcher_requires_whole_match_document():
+    matcher = DocumentMatcher([
+        ({'a': 1, 'b': {'c': 2}}, 'both'),
+        ({'d': [1, 2]}, 'list'),
+    ])
+    assert matcher.match_all({'a': 1}) == []
+    assert matcher.match_all({'a': 1, 'b': {'c': 2, 'e': 3}}) == ['both']
+    assert matcher.match_all({'d': [3, 2, 1]}) == ['list']
+    assert matcher.match_all({'d': 1}) == []
@@ -15,7 +15,12 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+import subprocess
+import sys
+
 import numpy
+import pytest
 
 from datacube.storage.access.core import StorageUnitVariableProxy, StorageUnitDimensionProxy, StorageUnitStack
 from datacube.storage.access.backends import FauxStorageUnit
@@ -149,3 +154,34 @@ def test_netcdf_storage_unit(data_folder):
     assert len(data.coords['longitude']) == 800
     assert len(data.coords['latitude']) == 600
     assert (data.values == 2).all()
+
+
+def test_netcdf_locking_modes():
+    from datacube.storage.access.backends import netcdf
+
+    try:
+        netcdf.set_locking('file')
+        assert netcdf._read_lock('/a.nc') is netcdf._read_lock('/a.nc')
+        assert netcdf._read_lock('/a.nc') is not netcdf._read_lock('/b.nc')
+        # Locks of files no longer being read are not kept
+        lock = netcdf._read_lock('/c.nc')
+        assert '/c.nc' in netcdf._FILE_LOCKS
+        del lock
+        assert '/c.nc' not in netcdf._FILE_LOCKS
+
+        netcdf.set_locking('global')
+        assert netcdf._read_lock('/a.nc') is netcdf._read_lock('/b.nc')
+
+        with pytest.raises(ValueError):
+            netcdf.set_locking('sometimes')
+    finally:
+        netcdf.set_locking('global')
+
+
+def test_netcdf_locking_mode_from_environment_is_checked_on_import():
+    env = dict(os.environ, DATACUBE_NETCDF_LOCKING='sometimes')
+    process = subprocess.Popen([sys.executable, '-c', 'import datacube.storage.access.backends.netcdf'],
+                               env=env, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    assert process.returncode != 0
+    assert b'Unknown NetCDF locking mode' in stderr
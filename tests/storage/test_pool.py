@@ -0,0 +1,200 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import threading
+import time
+
+from datacube.storage.access.pool import HandlePool
+
+
+class FakeHandle(object):
+    def __init__(self, key):
+        self.key = key
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_handles_are_reused():
+    pool = HandlePool(FakeHandle, max_handles=4)
+
+    with pool.open('a') as first:
+        pass
+    with pool.open('a') as second:
+        pass
+
+    assert first is second
+    assert not first.closed
+    assert pool.stats == {'hits': 1, 'misses': 1, 'evictions': 0, 'open': 1}
+
+
+def test_exclusive_handles_are_lent_to_one_reader_at_a_time():
+    pool = HandlePool(FakeHandle, max_handles=4, exclusive=True)
+
+    with pool.open('a') as first:
+        with pool.open('a') as second:
+            assert first is not second
+    with pool.open('a') as third:
+        pass
+
+    # Idle handles are shared by later readers
+    assert third in (first, second)
+    assert not first.closed and not second.closed
+    assert pool.stats == {'hits': 1, 'misses': 2, 'evictions': 0, 'open': 2}
+
+
+def test_least_recently_used_is_evicted():
+    pool = HandlePool(FakeHandle, max_handles=2)
+
+    handles = {}
+    for key in ['a', 'b', 'a', 'c']:
+        with pool.open(key) as handle:
+            handles[key] = handle
+
+    assert handles['b'].closed
+    assert not handles['a'].closed
+    assert not handles['c'].closed
+    assert len(pool) == 2
+    assert pool.stats['evictions'] == 1
+
+
+def test_handles_in_use_are_not_evicted():
+    pool = HandlePool(FakeHandle, max_handles=1)
+
+    with pool.open('a') as a:
+        with pool.open('b') as b:
+            assert not a.closed
+            assert len(pool) == 2
+        assert b.closed
+    assert not a.closed
+    assert len(pool) == 1
+
+
+def test_file_descriptor_cap():
+    pool = HandlePool(FakeHandle, max_handles=10, max_fds=4, fds_per_handle=2)
+
+    for key in 'abcd':
+        with pool.open(key):
+            pass
+
+    assert len(pool) == 2
+
+
+def test_forked_pool_forgets_parent_handles():
+    pool = HandlePool(FakeHandle)
+    with pool.open('a') as parent_handle:
+        pass
+
+    # Pretend we are in a child process
+    pool._pid = os.getpid() + 1
+    with pool.open('a') as child_handle:
+        pass
+
+    assert child_handle is not parent_handle
+    assert not parent_handle.closed
+    assert pool.stats['misses'] == 1
+
+
+def test_clear_closes_idle_handles():
+    pool = HandlePool(FakeHandle)
+    with pool.open('a') as a:
+        pass
+
+    pool.clear()
+
+    assert a.closed
+    assert len(pool) == 0
+
+
+def test_replaced_files_are_reopened(tmpdir):
+    path = str(tmpdir.join('unit.nc'))
+    with open(path, 'w') as f:
+        f.write('old')
+    pool = HandlePool(FakeHandle)
+
+    with pool.open(path) as old:
+        # Replaced while in use, as a new storage unit is renamed into place
+        replacement = str(tmpdir.join('unit.nc.tmp'))
+        with open(replacement, 'w') as f:
+            f.write('new')
+        os.rename(replacement, path)
+
+        with pool.open(path) as new:
+            assert new is not old
+        assert not old.closed
+    assert old.closed
+    assert not new.closed
+
+    with pool.open(path) as handle:
+        assert handle is new
+
+
+def test_concurrent_opens_of_a_file_are_shared():
+    opened = []
+
+    def slow_open(key):
+        opened.append(key)
+        time.sleep(0.1)
+        return FakeHandle(key)
+
+    pool = HandlePool(slow_open)
+    handles = []
+
+    def read():
+        with pool.open('a') as handle:
+            handles.append(handle)
+
+    threads = [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert opened == ['a']
+    assert len(handles) == 4
+    assert all(handle is handles[0] for handle in handles)
+
+
+def test_slow_open_does_not_block_other_files():
+    other_file_opened = threading.Event()
+
+    def opener(key):
+        if key == 'slow':
+            # Only completes if 'fast' can be opened meanwhile
+            assert other_file_opened.wait(5)
+        return FakeHandle(key)
+
+    pool = HandlePool(opener)
+
+    def open_slow():
+        with pool.open('slow'):
+            pass
+
+    thread = threading.Thread(target=open_slow)
+    thread.start()
+    with pool.open('fast'):
+        other_file_opened.set()
+    thread.join()
+    assert len(pool) == 2
+
+
+def test_failed_open_is_not_cached():
+    calls = []
+
+    def opener(key):
+        calls.append(key)
+        if len(calls) == 1:
+            raise IOError('not yet')
+        return FakeHandle(key)
+
+    pool = HandlePool(opener)
+    try:
+        with pool.open('a'):
+            pass
+    except IOError:
+        pass
+    assert len(pool) == 0
+
+    with pool.open('a') as handle:
+        assert handle.key == 'a'
@@ -15,14 +15,26 @@
 
 from __future__ import absolute_import, division, print_function
 
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import mock
 import numpy
 import netCDF4
+import pytest
 from pathlib import Path
 from affine import Affine
 
 from datacube.model import Coordinate, Variable, GeoBox
+from datacube.storage import storage
+from datacube.storage.access.pool import HandlePool
 from datacube.storage.access.backends.geobox import GeoBoxStorageUnit
-from datacube.storage.storage import write_access_unit_to_netcdf
+from datacube.storage.storage import write_access_unit_to_netcdf, remove_temporary_files, TEMPORARY_SUFFIX, \
+    _read_chunk_rows, _read_variable_rows, _warp_in_blocks
 
 
 GEO_PROJ = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],' \
@@ -30,20 +42,173 @@ GEO_PROJ = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.25722
            'AUTHORITY["EPSG","4326"]]'
 
 
-def test_write_access_unit_to_netcdf(tmpnetcdf_filename):
+def _make_access_unit(storage_unit_class=GeoBoxStorageUnit):
     affine = Affine.scale(0.1, 0.1)*Affine.translation(20, 30)
     geobox = GeoBox(100, 100, affine, GEO_PROJ)
-    ds1 = GeoBoxStorageUnit(geobox,
-                            {'time': Coordinate(numpy.dtype(numpy.int), begin=100, end=400, length=4, units='seconds')},
-                            {
-                                'B10': Variable(numpy.dtype(numpy.float32),
-                                                nodata=numpy.nan,
-                                                dimensions=('time', 'latitude', 'longitude'),
-                                                units='1')
-                            })
+    return storage_unit_class(geobox,
+                              {'time': Coordinate(numpy.dtype(numpy.int), begin=100, end=400, length=4,
+                                                  units='seconds')},
+                              {
+                                  'B10': Variable(numpy.dtype(numpy.float32),
+                                                  nodata=numpy.nan,
+                                                  dimensions=('time', 'latitude', 'longitude'),
+                                                  units='1')
+                              })
+
+
+def test_write_access_unit_to_netcdf(tmpnetcdf_filename):
+    ds1 = _make_access_unit()
     write_access_unit_to_netcdf(ds1, {}, {}, {}, Path(tmpnetcdf_filename))
+    assert not list(Path(tmpnetcdf_filename).parent.glob('*' + TEMPORARY_SUFFIX + '*'))
 
     with netCDF4.Dataset(tmpnetcdf_filename) as nco:
         assert 'B10' in nco.variables
         var = nco.variables['B10']
         assert (var[:] == ds1.get('B10').values).all()
+
+
+class _FailingStorageUnit(GeoBoxStorageUnit):
+    def get(self, name, dest=None, **kwargs):
+        raise IOError('Worker died')
+
+
+def test_failed_write_leaves_no_storage_unit(tmpnetcdf_filename):
+    with pytest.raises(IOError):
+        write_access_unit_to_netcdf(_make_access_unit(_FailingStorageUnit), {}, {}, {}, Path(tmpnetcdf_filename))
+
+    assert not Path(tmpnetcdf_filename).exists()
+    assert not list(Path(tmpnetcdf_filename).parent.glob('*' + TEMPORARY_SUFFIX + '*'))
+
+
+def test_remove_temporary_files(tmpdir):
+    host = socket.gethostname()
+    finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+    finished.wait()
+
+    orphan = tmpdir.join('unit.nc%s.%s.%s' % (TEMPORARY_SUFFIX, host, finished.pid))
+    in_progress = tmpdir.join('unit2.nc%s.%s.%s' % (TEMPORARY_SUFFIX, host, os.getpid()))
+    other_host = tmpdir.join('unit3.nc%s.%s.%s' % (TEMPORARY_SUFFIX, 'elsewhere.example.com', os.getpid()))
+    stale_other_host = tmpdir.join('unit4.nc%s.%s.%s' % (TEMPORARY_SUFFIX, 'elsewhere.example.com', os.getpid()))
+    complete = tmpdir.join('unit5.nc')
+    for path in (orphan, in_progress, other_host, stale_other_host, complete):
+        path.write('')
+    two_days_ago = time.time() - 2 * 24 * 60 * 60
+    stale_other_host.setmtime(two_days_ago)
+
+    remove_temporary_files(Path(str(tmpdir)))
+
+    # Only files whose writer is known to have died, or that haven't been written to for a long time
+    assert not orphan.check()
+    assert not stale_other_host.check()
+    assert in_progress.check()
+    assert other_host.check()
+    assert complete.check()
+
+
+def test_read_chunk_rows():
+    access_unit = _make_access_unit()
+    expected = access_unit.get('B10').values
+
+    data = numpy.empty_like(expected)
+    for index, block in _read_chunk_rows(access_unit, 'B10', expected.shape, (3, 30), buffers=2):
+        assert block.shape[:2] == (min(3, 4 - index[0].start), min(30, 100 - index[1].start))
+        data[index] = block
+    assert (data == expected).all()
+
+
+def test_read_variable_rows_across_variables():
+    affine = Affine.scale(0.1, 0.1)*Affine.translation(20, 30)
+    time = Coordinate(numpy.dtype(numpy.int), begin=100, end=400, length=4, units='seconds')
+    dimensions = ('time', 'latitude', 'longitude')
+    access_unit = GeoBoxStorageUnit(GeoBox(100, 100, affine, GEO_PROJ), {'time': time},
+                                    {'B10': Variable(numpy.dtype(numpy.float32), numpy.nan, dimensions, '1'),
+                                     'B20': Variable(numpy.dtype(numpy.int16), -999, dimensions, '1')})
+    shape = (4, 100, 100)
+
+    blocks = [(name, index[0].start, block.copy())
+              for name, index, block in _read_variable_rows(access_unit, [('B10', shape, (2, 100)),
+                                                                          ('B20', shape, (2, 100))], buffers=2)]
+
+    # Every variable's row before the next row, so each row is warped for all bands at once
+    assert [(name, start) for name, start, _ in blocks] == [('B10', 0), ('B20', 0), ('B10', 2), ('B20', 2)]
+    for name, start, block in blocks:
+        assert block.dtype == access_unit.variables[name].dtype
+        assert (block == access_unit.get(name).values[start:start + 2]).all()
+
+
+def test_warp_in_blocks():
+    dest = numpy.zeros((10, 4), dtype=numpy.int32)
+    blocks = []
+
+    def warp(index, block, num_threads):
+        blocks.append(index[0])
+        # Fill each row with its index in the whole tile
+        block[:] = numpy.arange(index[0].start, index[0].stop)[:, None]
+
+    _warp_in_blocks(warp, (slice(20, 30), slice(0, 4)), dest, threads=3)
+
+    assert sorted(blocks, key=lambda s: s.start) == [slice(20, 23), slice(23, 26), slice(26, 30)]
+    assert (dest == numpy.arange(20, 30)[:, None]).all()
+
+
+class _FakeRaster(object):
+    opened = []
+
+    def __init__(self, filename):
+        self.opened.append(filename)
+        self.affine = Affine.identity()
+        self.crs = {'init': 'EPSG:4326'}
+        self.nodatavals = (-999,)
+        self.dtypes = ('int16', 'int16')
+        self.shape = (10, 10)
+
+    def close(self):
+        pass
+
+
+def test_dataset_sources_share_open_rasters(monkeypatch):
+    monkeypatch.setattr(storage.rasterio, 'open', _FakeRaster)
+    monkeypatch.setattr(storage, 'RASTER_POOL', HandlePool(storage._OpenRaster, exclusive=True,
+                                                           path=storage._raster_path))
+    dataset = mock.Mock(format='GeoTIFF', local_path=Path('/data/scene/ga-metadata.yaml'))
+    dataset.metadata.measurements_dict = {'blue': {'path': 'scene.tif', 'layer': 1},
+                                          'green': {'path': 'scene.tif', 'layer': 2}}
+
+    for tile in range(3):
+        for band in ('blue', 'green'):
+            source = storage.DatasetSource(dataset, band)
+            with source.open() as band_source:
+                assert band_source.bidx == dataset.metadata.measurements_dict[band]['layer']
+            assert source.nodata == -999
+            assert source.transform == Affine.identity()
+
+    # Opened once, for all bands of all tiles
+    assert _FakeRaster.opened == ['/data/scene/scene.tif']
+
+
+def test_dataset_sources_share_open_rasters_between_threads(monkeypatch):
+    monkeypatch.setattr(storage.rasterio, 'open', _FakeRaster)
+    monkeypatch.setattr(storage, 'RASTER_POOL', HandlePool(storage._OpenRaster, exclusive=True,
+                                                           path=storage._raster_path))
+    monkeypatch.setattr(_FakeRaster, 'opened', [])
+    dataset = mock.Mock(format='GeoTIFF', local_path=Path('/data/scene/ga-metadata.yaml'))
+    dataset.metadata.measurements_dict = {'blue': {'path': 'scene.tif', 'layer': 1}}
+
+    def read():
+        with storage.DatasetSource(dataset, 'blue').open():
+            pass
+
+    # Short-lived threads, one after another, reuse the same handle
+    for _ in range(3):
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+    assert _FakeRaster.opened == ['/data/scene/scene.tif']
+
+    # A concurrent reader gets a handle of its own
+    with storage.DatasetSource(dataset, 'blue').open():
+        thread = threading.Thread(target=read)
+        thread.start()
+        thread.join()
+    assert _FakeRaster.opened == ['/data/scene/scene.tif'] * 2
+    assert len(storage.RASTER_POOL) == 2
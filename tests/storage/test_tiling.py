@@ -0,0 +1,54 @@
+from __future__ import absolute_import, division, print_function
+
+from collections import namedtuple
+
+import numpy
+from rasterio.coords import BoundingBox
+from rasterio.warp import transform
+
+from datacube.storage.tiling import _grid_datasets
+
+Dataset = namedtuple('Dataset', ['crs', 'bounds'])
+
+ALBERS = 'EPSG:3577'
+
+
+def test_grid_datasets_in_grid_crs():
+    first = Dataset(ALBERS, BoundingBox(5, 5, 25, 15))
+    second = Dataset(ALBERS, BoundingBox(21, 11, 29, 19))
+
+    tiles = _grid_datasets([first, second], None, ALBERS, (10, 10))
+
+    assert sorted(tiles) == [(0, 0), (0, 1), (1, 0), (1, 1), (2, 0), (2, 1)]
+    assert tiles[(0, 0)] == [first]
+    assert tiles[(2, 1)] == [first, second]
+
+
+def test_grid_datasets_within_bounds_override():
+    dataset = Dataset(ALBERS, BoundingBox(5, 5, 25, 15))
+
+    tiles = _grid_datasets([dataset], BoundingBox(12, 0, 30, 8), ALBERS, (10, 10))
+
+    assert sorted(tiles) == [(1, 0), (2, 0)]
+
+
+def test_grid_datasets_outside_bounds_override():
+    dataset = Dataset(ALBERS, BoundingBox(5, 5, 15, 15))
+
+    assert _grid_datasets([dataset], BoundingBox(16, 0, 19, 30), ALBERS, (10, 10)) == {}
+    assert _grid_datasets([dataset], BoundingBox(0, 16, 30, 19), ALBERS, (10, 10)) == {}
+
+
+def test_grid_projected_datasets():
+    # A 1 degree scene, in a 100km Albers grid
+    dataset = Dataset('EPSG:4326', BoundingBox(148, -36, 149, -35))
+
+    tiles = _grid_datasets([dataset], None, ALBERS, (100000, 100000))
+
+    # Every tile containing a point in the scene is found, and no more than those around its projected bounds
+    lons, lats = numpy.meshgrid(numpy.linspace(148, 149, 50), numpy.linspace(-36, -35, 50))
+    xs, ys = transform('EPSG:4326', ALBERS, lons.ravel(), lats.ravel())
+    covered = {(int(x // 100000), int(y // 100000)) for x, y in zip(xs, ys)}
+    assert covered <= set(tiles)
+    assert len(tiles) <= (max(x for x, _ in covered) - min(x for x, _ in covered) + 1) * \
+        (max(y for _, y in covered) - min(y for _, y in covered) + 1)
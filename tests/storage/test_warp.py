@@ -0,0 +1,112 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy
+import pytest
+import rasterio.warp
+from affine import Affine
+from rasterio.warp import RESAMPLING
+
+from datacube.storage import warp
+from datacube.storage.warp import make_warp_plan, get_warp_plan, set_plan_cache_size, MAX_CACHED_PLAN_BYTES
+
+NODATA = -999
+SRC_CRS = 'EPSG:4326'
+SRC_TRANSFORM = Affine(0.00025, 0, 148.0, 0, -0.00025, -35.0)
+DST_CRS = 'EPSG:3577'
+
+
+class _Band(object):
+    """ In-memory stand-in for a rasterio band """
+    bidx = 1
+
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.ds = self
+
+    def read(self, bidx, window):
+        (row_begin, row_end), (col_begin, col_end) = window
+        return self.data[row_begin:row_end, col_begin:col_end]
+
+
+def _source():
+    rows, cols = numpy.indices((300, 300))
+    data = (cols * 3 + rows * 2).astype(numpy.int16)
+    data[140:150, 140:150] = NODATA
+    return data
+
+
+def _dst_transform():
+    # 100 pixels of 25m around the centre of the source
+    (x,), (y,) = rasterio.warp.transform(SRC_CRS, DST_CRS, [148.0375], [-35.0375])
+    return Affine(25, 0, x - 50 * 25, 0, -25, y + 50 * 25)
+
+
+# GDAL's approximations differ slightly: nearest can pick the neighbouring pixel (the source increases by up to 3
+# per pixel) for points on the boundary between them, and bilinear can round the other way.
+@pytest.mark.parametrize('resampling, max_difference', [(RESAMPLING.nearest, 3), (RESAMPLING.bilinear, 1)])
+def test_warp_plan_matches_gdal(resampling, max_difference):
+    source = _source()
+    dst_transform = _dst_transform()
+
+    expected = numpy.empty((100, 100), dtype=numpy.int16)
+    rasterio.warp.reproject(source, expected,
+                            src_transform=SRC_TRANSFORM, src_crs=SRC_CRS, src_nodata=NODATA,
+                            dst_transform=dst_transform, dst_crs=DST_CRS, dst_nodata=NODATA,
+                            resampling=resampling)
+
+    warped = numpy.empty((100, 100), dtype=numpy.int16)
+    plan = make_warp_plan(SRC_TRANSFORM, SRC_CRS, source.shape, dst_transform, DST_CRS, warped.shape, resampling)
+    plan.apply(_Band(source), NODATA, warped, NODATA)
+
+    assert ((warped == NODATA) == (expected == NODATA)).all()
+    assert numpy.abs(warped.astype(numpy.int32) - expected).max() <= max_difference
+
+
+def test_warp_plan_outside_source():
+    source = _source()
+    dst_transform = _dst_transform() * Affine.translation(10000, 0)
+    warped = numpy.zeros((100, 100), dtype=numpy.int16)
+
+    get_warp_plan(SRC_TRANSFORM, SRC_CRS, source.shape, dst_transform, DST_CRS, warped.shape,
+                  RESAMPLING.nearest).apply(_Band(source), NODATA, warped, NODATA)
+
+    assert (warped == NODATA).all()
+
+
+def test_warp_plans_are_shared():
+    args = (SRC_TRANSFORM, SRC_CRS, (300, 300), _dst_transform(), DST_CRS, (100, 100), RESAMPLING.bilinear)
+    assert get_warp_plan(*args) is get_warp_plan(*args)
+
+
+def _tile_row_transform(row):
+    # A 4000 x 4000 tile of 25m pixels inside a 4000 x 4000 pixel source, and the transform of a row of 500
+    (x,), (y,) = rasterio.warp.transform(SRC_CRS, DST_CRS, [148.5], [-35.5])
+    return Affine(25, 0, x - 2000 * 25, 0, -25, y + 2000 * 25) * Affine.translation(0, row * 500)
+
+
+@pytest.mark.parametrize('resampling, bytes_per_pixel', [(RESAMPLING.nearest, 8), (RESAMPLING.bilinear, 41)])
+def test_warp_plan_size_for_a_tile_row(resampling, bytes_per_pixel):
+    plan = make_warp_plan(SRC_TRANSFORM, SRC_CRS, (4000, 4000), _tile_row_transform(3), DST_CRS, (500, 4000),
+                          resampling)
+
+    assert plan.dst_index.dtype == numpy.int32
+    assert plan.src_index.dtype == numpy.int32
+    assert plan.dst_index.size > 0.9 * 500 * 4000
+    assert plan.nbytes <= 500 * 4000 * bytes_per_pixel
+
+
+def test_tile_row_plans_are_shared_by_bands():
+    row_plan_bytes = make_warp_plan(SRC_TRANSFORM, SRC_CRS, (4000, 4000), _tile_row_transform(0), DST_CRS,
+                                    (500, 4000), RESAMPLING.bilinear).nbytes
+    # Room for one row's plan: enough when each row is written for every band before the next
+    set_plan_cache_size(int(row_plan_bytes * 1.5))
+    try:
+        for row in range(2):
+            args = (SRC_TRANSFORM, SRC_CRS, (4000, 4000), _tile_row_transform(row), DST_CRS, (500, 4000),
+                    RESAMPLING.bilinear)
+            plans = [get_warp_plan(*args) for _ in ('band_1', 'band_2', 'band_3')]
+            assert plans[0] is plans[1] is plans[2]
+            assert len(warp._PLANS['cache']) == 1
+    finally:
+        set_plan_cache_size(MAX_CACHED_PLAN_BYTES)
@@ -23,10 +23,12 @@ from affine import Affine
 
 from .util import isclose
 
-from datacube.model import Range, Coordinate, Variable, GeoBox
+from datacube.model import Range, Coordinate, Variable, GeoBox, StorageUnit
 from datacube.storage.access.backends.geobox import GeoBoxStorageUnit
-from datacube.api._api import _get_dimension_properties
-from datacube.api._storage import MemoryStorageUnit
+from datacube.api._api import _get_dimension_properties, _get_data_array_dict, _prune_catalogue
+from datacube.api._api import _window_storage_units
+from datacube.api._catalogue import StorageUnitCatalogue
+from datacube.api._storage import MemoryStorageUnit, make_storage_unit
 from datacube.api._conversion import convert_descriptor_dims_to_search_dims, convert_descriptor_dims_to_selector_dims
 from datacube.api._conversion import datetime_to_timestamp
 from datacube.api._stratify import _stratify_irregular_dimension
@@ -259,6 +261,50 @@ def test_stratify_irregular_dimension():
                 assert su and numpy.any(su.get_coord('time')[0] == coord)
 
 
+def test_stratify_splits_storage_units_into_shared_runs():
+    def make_unit(values):
+        coordinates = {'time': Coordinate(dtype='int64', begin=values[0], end=values[-1], length=len(values),
+                                          units='seconds')}
+        variables = {'test': Variable(dimensions=('time',), dtype=int, nodata=0, units='dummy')}
+        return MemoryStorageUnit(coordinates, variables, coodinate_values={'time': numpy.array(values)})
+
+    output_sus = _stratify_irregular_dimension([make_unit([1, 2, 3, 4, 5]), make_unit([3, 4, 5, 6])], 'time')
+
+    assert [list(su.get_coord('time')[0]) for su in output_sus] == [[1, 2], [3, 4, 5], [3, 4, 5], [6]]
+    assert list(output_sus[3].get_chunk('test', Ellipsis)) == [3]
+
+
+def _make_time_unit(values):
+    coordinates = {'time': Coordinate(dtype='int64', begin=values[0], end=values[-1], length=len(values),
+                                      units='seconds')}
+    variables = {'test': Variable(dimensions=('time',), dtype=int, nodata=0, units='dummy')}
+    return MemoryStorageUnit(coordinates, variables, coodinate_values={'time': numpy.array(values)})
+
+
+def test_stratify_several_overlapping_storage_units():
+    units = [_make_time_unit([1, 2, 3, 4, 5, 6]), _make_time_unit([2, 3, 4]), _make_time_unit([4, 5, 7])]
+
+    output_sus = _stratify_irregular_dimension(units, 'time')
+
+    # Runs are cut wherever any storage unit starts, stops or skips a value
+    assert [list(su.get_coord('time')[0]) for su in output_sus] == [[1], [2, 3], [4], [5], [6],
+                                                                     [2, 3], [4],
+                                                                     [4], [5], [7]]
+
+
+def test_stratify_leaves_storage_units_without_the_dimension():
+    coordinates = {'x': Coordinate(dtype='float64', begin=0.0, end=2.0, length=3, units='metre')}
+    variables = {'test': Variable(dimensions=('x',), dtype=int, nodata=0, units='dummy')}
+    flat_unit = MemoryStorageUnit(coordinates, variables, coodinate_values={'x': numpy.array([0.0, 1.0, 2.0])})
+    units = [_make_time_unit([1, 2, 3]), flat_unit, _make_time_unit([2, 3])]
+
+    output_sus = _stratify_irregular_dimension(units, 'time')
+
+    assert flat_unit in output_sus
+    assert [list(su.get_coord('time')[0]) for su in output_sus if su is not flat_unit] == [[1], [2, 3], [2, 3]]
+    assert _stratify_irregular_dimension([flat_unit], 'time') == [flat_unit]
+
+
 def test_dask():
     GEO_PROJ = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],' \
                'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433],' \
@@ -290,3 +336,190 @@ def test_dask():
     assert da_computed[0, 199, 199] == 9999
     assert numpy.isnan(da_computed[0, 0, 150])
     assert numpy.isnan(da_computed[0, 150, 0])
+
+
+class _ChunkedStorageType(object):
+    dimensions = ['time', 'y', 'x']
+
+    def __init__(self, chunking):
+        self.variable_params = {'B10': {'chunksizes': chunking}}
+
+
+def _make_chunked_storage_units(dimensions):
+    storage_units = []
+    for begin in (0, 10):
+        coordinates = {
+            'time': Coordinate(numpy.dtype('int32'), begin=100, end=200, length=2, units='seconds'),
+            'y': Coordinate(numpy.dtype('float32'), begin=begin, end=begin + 9, length=10, units='m'),
+            'x': Coordinate(numpy.dtype('float32'), begin=0, end=9, length=10, units='m'),
+        }
+        variables = {'B10': Variable(numpy.dtype('int32'), nodata=-1, dimensions=dimensions, units='1')}
+        storage_units.append(MemoryStorageUnit(coordinates, variables,
+                                               attributes={'storage_type': _ChunkedStorageType([1, 4, 5])},
+                                               crs={'time': None, 'y': None, 'x': None}))
+    return storage_units
+
+
+def test_dask_is_split_by_storage_chunking():
+    dimensions = ('time', 'y', 'x')
+    storage_units = _make_chunked_storage_units(dimensions)
+
+    dim_props = _get_dimension_properties(storage_units, dimensions, {})
+    da = get_dask_array(storage_units, 'B10', dimensions, dim_props)
+    assert da.chunks == ((1, 1), (4, 4, 2, 4, 4, 2), (5, 5))
+
+    expected = numpy.concatenate([numpy.arange(200).reshape(2, 10, 10)] * 2, axis=1)
+    assert (da.compute() == expected).all()
+
+    reads = []
+    for su in storage_units:
+        su.get_chunk = _recording(su.get_chunk, reads)
+    da = get_dask_array(storage_units, 'B10', dimensions, dim_props)
+    assert (da[0, 11:13, 6:8].compute() == expected[0, 11:13, 6:8]).all()
+    assert reads == [(slice(0, 1), slice(0, 4), slice(5, 10))]
+
+
+def _recording(get_chunk, reads):
+    def wrapper(name, index):
+        reads.append(index)
+        return get_chunk(name, index)
+    return wrapper
+
+
+def test_selection_only_reads_intersecting_storage_units():
+    dimensions = ('time', 'y', 'x')
+    storage_units = _make_chunked_storage_units(dimensions)
+    reads = []
+    for su in storage_units:
+        su._fill_data = _recording_fill(su._fill_data, reads)
+
+    dimension_ranges = {'y': {'range': (11, 12)}, 'x': {'range': (0, 3)}}
+    data = _get_data_array_dict({'B10': storage_units}, dimensions, dimension_ranges)['B10']
+
+    assert data.shape == (2, 2, 4)
+    assert list(data.coords['y'].values) == [11, 12]
+    expected = numpy.arange(200).reshape(2, 10, 10)[:, 1:3, 0:4]
+    assert (data.values == expected).all()
+    # Only the second storage unit is read, and only the hyperslab that was asked for
+    assert sorted(reads, key=str) == [(id(storage_units[1]), (slice(0, 1), slice(1, 3), slice(0, 4))),
+                                      (id(storage_units[1]), (slice(1, 2), slice(1, 3), slice(0, 4)))]
+
+
+def _recording_fill(fill_data, reads):
+    def wrapper(name, index, dest):
+        reads.append((id(fill_data.__self__), index))
+        return fill_data(name, index, dest)
+    return wrapper
+
+
+class _IndexedStorageType(object):
+    driver = 'NetCDF CF'
+    dimensions = ['time', 'y', 'x']
+    spatial_dimensions = ['y', 'x']
+    crs = 'EPSG:3577'
+    measurements = {'B10': {'dtype': 'int16', 'nodata': -999, 'units': '1'}}
+
+    @staticmethod
+    def resolve_location(path):
+        return 'file:///does/not/exist/' + path
+
+
+def test_storage_unit_coordinates_come_from_the_index():
+    descriptor = {
+        'coordinates': {
+            'time': {'dtype': 'float64', 'begin': 100.0, 'end': 400.0, 'length': 3, 'units': 'seconds',
+                     'values': [100.0, 350.0, 400.0]},
+            'y': {'dtype': 'float64', 'begin': 0.0, 'end': 30.0, 'length': 4, 'units': 'metre'},
+            'x': {'dtype': 'float64', 'begin': 10.0, 'end': 40.0, 'length': 4, 'units': 'metre'},
+        }
+    }
+    su = StorageUnit([], _IndexedStorageType(), descriptor, relative_path='unit.nc')
+
+    for is_diskless in (True, False):
+        unit = make_storage_unit(su, is_diskless=is_diskless)
+        assert list(unit.get_coord('time')[0]) == [100.0, 350.0, 400.0]
+        assert list(unit.get_coord('y')[0]) == [0.0, 10.0, 20.0, 30.0]
+        assert list(unit.get_coord('x')[0]) == [10.0, 20.0, 30.0, 40.0]
+
+
+def test_windowing_irregular_units_with_the_same_extent():
+    # Both units span 100-400 over 3 steps, but only the second has a label inside the range
+    storage_units = []
+    for times in ([100.0, 150.0, 400.0], [100.0, 350.0, 400.0]):
+        descriptor = {
+            'coordinates': {
+                'time': {'dtype': 'float64', 'begin': times[0], 'end': times[-1], 'length': len(times),
+                         'units': 'seconds', 'values': times},
+                'y': {'dtype': 'float64', 'begin': 0.0, 'end': 30.0, 'length': 4, 'units': 'metre'},
+                'x': {'dtype': 'float64', 'begin': 10.0, 'end': 40.0, 'length': 4, 'units': 'metre'},
+            }
+        }
+        su = StorageUnit([], _IndexedStorageType(), descriptor, relative_path='unit.nc')
+        storage_units.append(make_storage_unit(su, is_diskless=True))
+
+    windowed = _window_storage_units({'B10': storage_units}, ('time', 'y', 'x'), {'time': {'range': (300, 360)}})
+
+    assert len(windowed['B10']) == 1
+    assert list(windowed['B10'][0].get_coord('time')[0]) == [350.0]
+
+
+def _indexed_row(id_, x_begin, times):
+    return {
+        'id': id_,
+        'storage_type_ref': 1,
+        'path': 'unit_%s.nc' % id_,
+        'descriptor': {
+            'tile_index': [x_begin // 40, 0],
+            'coordinates': {
+                'time': {'dtype': 'float64', 'begin': times[0], 'end': times[-1], 'length': len(times),
+                         'units': 'seconds', 'values': times},
+                'y': {'dtype': 'float64', 'begin': 0.0, 'end': 30.0, 'length': 4, 'units': 'metre'},
+                'x': {'dtype': 'float64', 'begin': x_begin, 'end': x_begin + 30.0, 'length': 4, 'units': 'metre'},
+            }
+        }
+    }
+
+
+def test_get_descriptor_from_index_rows():
+    from datacube.api import API
+    from mock import MagicMock
+
+    storage_type = _IndexedStorageType()
+    storage_type.name = 'ls5_nbar'
+    storage_type.variable_params = {}
+    index = MagicMock()
+    index.datasets.get_fields.return_value = {}
+    index.storage.types.get.return_value = storage_type
+    # The same storage unit can be found more than once
+    index.storage.search_rows.return_value = [_indexed_row(1, 0.0, [100.0, 200.0]),
+                                              _indexed_row(2, 40.0, [100.0, 200.0]),
+                                              _indexed_row(1, 0.0, [100.0, 200.0]),
+                                              _indexed_row(3, 0.0, [300.0])]
+
+    descriptor = API(index=index).get_descriptor({})['ls5_nbar']
+
+    assert descriptor['dimensions'] == ['time', 'y', 'x']
+    assert set(descriptor['variables']) == {'B10'}
+    assert descriptor['result_shape'] == (3, 4, 8)
+    assert sorted(descriptor['storage_units']) == [(100.0, 0.0, 0.0), (100.0, 0.0, 40.0), (300.0, 0.0, 0.0)]
+    stats = descriptor['storage_units'][(100.0, 0.0, 40.0)]
+    assert stats['storage_max'] == (200.0, 30.0, 70.0)
+    assert stats['storage_shape'] == (2, 4, 4)
+    assert stats['storage_path'] == '/does/not/exist/unit_2.nc'
+    assert stats['irregular_indicies'] == {'time': [100.0, 200.0]}
+
+
+def test_catalogue_grouping_and_pruning():
+    rows = [_indexed_row(1, 40.0, [100.0]), _indexed_row(2, 0.0, [100.0]), _indexed_row(3, 80.0, [100.0])]
+    rows[1]['storage_type_ref'] = 2
+    catalogue = StorageUnitCatalogue.from_rows(rows)
+
+    groups = catalogue.group_by_storage_type()
+    assert [(type_id, units.ids.tolist()) for type_id, units in groups] == [(1, [1, 3]), (2, [2])]
+    assert groups[0][1].tile_indexes.tolist() == [[1, 0], [2, 0]]
+
+    dimensions = ('time', 'y', 'x')
+    assert _prune_catalogue(catalogue, dimensions, {'x': {'range': (75, 85)}}).ids.tolist() == [3]
+    assert _prune_catalogue(catalogue, dimensions, {'x': {'range': (25, 45)}}).ids.tolist() == [1, 2]
+    # Nothing intersects: keep them all for the selectors to give the empty result
+    assert len(_prune_catalogue(catalogue, dimensions, {'x': {'range': (500, 600)}})) == 3
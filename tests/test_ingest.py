@@ -0,0 +1,172 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import os
+import socket
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pathlib import Path
+
+from datacube import ingest
+from datacube.executor import SerialExecutor, MultiprocessingExecutor
+from datacube.ledger import TaskLedger, INDEXED
+from datacube.model import StorageUnit, StorageType
+from datacube.storage.storage import TEMPORARY_SUFFIX
+
+
+def _fake_create(task, warp_threads=1):
+    if task == 'bad':
+        raise ValueError('Failed to warp')
+    return 'unit-%s' % task
+
+
+@pytest.fixture
+def removed(monkeypatch):
+    removed = []
+    monkeypatch.setattr(ingest, '_create_storage_unit', _fake_create)
+    monkeypatch.setattr(ingest, '_remove_storage_unit', removed.append)
+    return removed
+
+
+def test_pipeline_yields_storage_units(removed):
+    executor = MultiprocessingExecutor(ThreadPoolExecutor(2))
+    units = ingest._create_storage_units_pipelined(iter(range(10)), executor, max_pending=3)
+    assert sorted(units) == sorted((i, 'unit-%s' % i) for i in range(10))
+    assert removed == []
+
+
+def test_pipeline_keeps_completed_units_on_failure(removed):
+    created = []
+    with pytest.raises(ValueError):
+        for _, unit in ingest._create_storage_units_pipelined(iter([1, 'bad', 2, 3]), SerialExecutor(),
+                                                              max_pending=2):
+            created.append(unit)
+
+    # Completed units are kept, failures leave nothing to remove, and no more tasks are started after one
+    assert removed == []
+    assert created == ['unit-1']
+
+
+class _Dataset(object):
+    def __init__(self, time):
+        self.time = time
+
+
+class _StorageType(object):
+    name = 'ls5_nbar'
+
+    def __init__(self, location):
+        self.location = location
+
+    def generate_uri(self, tile_index, start_time, end_time):
+        return Path(self.location, '%s_%s_%s.nc' % (tile_index[0], tile_index[1], start_time)).as_uri()
+
+
+class _StorageIndex(object):
+    def __init__(self, fail=False):
+        self.indexed = []
+        self.batches = []
+        self.fail = fail
+
+    def add_many(self, storage_units):
+        self.batches.append(len(storage_units))
+        if self.fail:
+            raise IOError('Database went away')
+        self.indexed.extend(storage_units)
+
+    def has(self, storage_unit):
+        return storage_unit in self.indexed
+
+
+def test_store_datasets_resumes_from_ledger(monkeypatch, tmpdir):
+    storage_type = _StorageType(str(tmpdir))
+    tasks = [((0, i), storage_type, [_Dataset(datetime.datetime(2001, 1, i + 1))]) for i in range(4)]
+    monkeypatch.setattr(ingest, 'find_storage_types_for_datasets', lambda datasets, index: {storage_type: []})
+    monkeypatch.setattr(ingest, '_storage_unit_tasks', lambda datasets, storage_type: iter(tasks))
+
+    created = []
+    removed = []
+    monkeypatch.setattr(ingest, '_create_storage_unit',
+                        lambda task, warp_threads: created.append(task[0]) or StorageUnit([], storage_type, {},
+                                                                                          str(task[0])))
+    monkeypatch.setattr(ingest, '_remove_storage_unit', lambda task: removed.append(task[0]))
+
+    task_ledger = TaskLedger(str(tmpdir.join('ledger.db')))
+    keys = [ingest._task_key(task) for task in tasks]
+    task_ledger.mark_indexed([keys[0]])
+    task_ledger.mark_written(keys[1], StorageUnit([], storage_type, {}, 'written'))
+    task_ledger.mark_pending(keys[2])
+
+    index = type('Index', (), {'storage': _StorageIndex()})
+    ingest.store_datasets([], index=index, ledger=task_ledger)
+
+    # Only the unfinished tasks are run, and only the half-written one is cleaned up first
+    assert created == [(0, 2), (0, 3)]
+    assert removed == [(0, 2)]
+    assert sorted(unit.path for unit in index.storage.indexed) == ['(0, 2)', '(0, 3)', 'written']
+    assert all(task_ledger.state(key) == INDEXED for key in keys)
+
+
+def _fake_store(monkeypatch, tasks, storage_type):
+    monkeypatch.setattr(ingest, 'find_storage_types_for_datasets', lambda datasets, index: {storage_type: []})
+    monkeypatch.setattr(ingest, '_storage_unit_tasks', lambda datasets, storage_type: iter(tasks))
+    monkeypatch.setattr(ingest, '_create_storage_unit',
+                        lambda task, warp_threads: StorageUnit([], storage_type, {}, str(task[0])))
+
+
+def test_failed_index_batch_is_not_retried(monkeypatch, tmpdir):
+    storage_type = _StorageType(str(tmpdir))
+    tasks = [((0, i), storage_type, [_Dataset(datetime.datetime(2001, 1, i + 1))]) for i in range(3)]
+    _fake_store(monkeypatch, tasks, storage_type)
+
+    index = type('Index', (), {'storage': _StorageIndex(fail=True)})
+    with pytest.raises(IOError):
+        ingest.store_datasets([], index=index, index_batch_size=2)
+
+    # The first batch failed: it isn't indexed again on the way out
+    assert index.storage.batches == [2]
+
+
+def test_resumed_written_units_are_indexed_in_batches(monkeypatch, tmpdir):
+    storage_type = _StorageType(str(tmpdir))
+    tasks = [((0, i), storage_type, [_Dataset(datetime.datetime(2001, 1, i + 1))]) for i in range(5)]
+    _fake_store(monkeypatch, tasks, storage_type)
+
+    task_ledger = TaskLedger(str(tmpdir.join('ledger.db')))
+    for task in tasks:
+        task_ledger.mark_written(ingest._task_key(task), StorageUnit([], storage_type, {}, str(task[0])))
+
+    index = type('Index', (), {'storage': _StorageIndex()})
+    ingest.store_datasets([], index=index, ledger=task_ledger, index_batch_size=2)
+
+    assert index.storage.batches == [2, 2, 1]
+
+
+def test_temporary_files_of_dead_writers_are_removed(tmpdir):
+    storage_type = StorageType({
+        'name': 'ls5_nbar',
+        'location': Path(str(tmpdir)).as_uri(),
+        'match': {'metadata': {}},
+        'file_path_template': 'ls5_nbar/{tile_index[0]}_{tile_index[1]}_{start_time}.nc',
+    })
+    task = ((1, 2), storage_type, [_Dataset(datetime.datetime(2001, 1, 1))])
+    output_dir = tmpdir.mkdir('ls5_nbar')
+
+    finished = subprocess.Popen([sys.executable, '-c', 'pass'])
+    finished.wait()
+    host = socket.gethostname()
+    dead_writer = output_dir.join('1_2_a.nc%s.%s.%s' % (TEMPORARY_SUFFIX, host, finished.pid))
+    live_writer = output_dir.join('1_2_b.nc%s.%s.%s' % (TEMPORARY_SUFFIX, host, os.getpid()))
+    complete = output_dir.join('1_2_c.nc')
+    for path in (dead_writer, live_writer, complete):
+        path.write('')
+
+    assert list(ingest._remove_temporary_files(iter([task]))) == [task]
+
+    assert not dead_writer.check()
+    assert live_writer.check()
+    assert complete.check()
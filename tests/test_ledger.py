@@ -0,0 +1,41 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import uuid
+
+from datacube import ledger
+from datacube.ledger import TaskLedger
+from datacube.model import StorageUnit
+
+
+class _StorageType(object):
+    name = 'ls5_nbar'
+
+
+def test_ledger_records_task_state(tmpdir):
+    path = str(tmpdir.join('ledger.db'))
+    storage_type = _StorageType()
+    key = ledger.task_key(storage_type, (-35, 148), datetime.datetime(1990, 3, 2, 23, 11, 16))
+
+    task_ledger = TaskLedger(path)
+    assert task_ledger.state(key) is None
+    task_ledger.mark_pending(key)
+    assert task_ledger.state(key) == ledger.PENDING
+
+    descriptor = {'tile_index': (-35, 148), 'extents': {'time_min': datetime.datetime(1990, 3, 2)}}
+    dataset_ids = [uuid.uuid4()]
+    task_ledger.mark_written(key, StorageUnit(dataset_ids, storage_type, descriptor, 'ls5/-35_148.nc'))
+    task_ledger.close()
+
+    # Progress survives the process
+    task_ledger = TaskLedger(path)
+    assert task_ledger.state(key) == ledger.WRITTEN
+    storage_unit = task_ledger.storage_unit(key, storage_type)
+    assert storage_unit.dataset_ids == dataset_ids
+    assert storage_unit.descriptor == descriptor
+    assert storage_unit.path == 'ls5/-35_148.nc'
+    assert storage_unit.storage_type is storage_type
+
+    task_ledger.mark_indexed([key])
+    assert task_ledger.state(key) == ledger.INDEXED
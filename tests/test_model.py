@@ -1,10 +1,15 @@
 # coding=utf-8
 import os
+import threading
 from textwrap import dedent
 
 import pytest
 
-from datacube.model import _uri_to_local_path, Dataset, DatasetMatcher, StorageType
+import numpy
+from affine import Affine
+
+from datacube.model import _uri_to_local_path, Dataset, DatasetMatcher, StorageType, GeoPolygon, GeoBox, \
+    StorageUnit, SpatialReferenceCache, SPATIAL_REFERENCES
 
 
 def test_uri_to_local_path():
@@ -118,3 +123,59 @@ SAMPLE_STORAGE_TYPE = {
 
 def test_storage_type_model():
     st = StorageType(SAMPLE_STORAGE_TYPE)
+
+
+def test_geo_polygons_share_spatial_references():
+    polygon = GeoPolygon([(0, 0), (0, 1), (1, 1), (1, 0)], 'EPSG:3577')
+    other = GeoPolygon([(1, 1), (1, 2), (2, 2), (2, 1)], 'EPSG:3577')
+    assert polygon.crs is other.crs
+    assert polygon.crs is SPATIAL_REFERENCES.spatial_reference('EPSG:3577')
+    assert polygon.to_crs('EPSG:3577') is polygon
+
+
+def test_spatial_reference_cache_transformations_per_thread():
+    cache = SpatialReferenceCache()
+    transformation = cache.transformation('EPSG:3577', 'EPSG:4326')
+    assert cache.transformation('EPSG:3577', 'EPSG:4326') is transformation
+
+    others = []
+    thread = threading.Thread(target=lambda: others.append(cache.transformation('EPSG:3577', 'EPSG:4326')))
+    thread.start()
+    thread.join()
+    assert others[0] is not transformation
+
+    stats = cache.stats
+    assert stats['spatial_references'] == 2
+    assert stats['transformations'] == 2
+    # Each new transformation looks up both spatial references
+    assert stats['misses'] == 4
+    assert stats['hits'] == 3
+
+    cache.clear()
+    assert cache.stats['spatial_references'] == 0
+
+
+def test_storage_unit_coordinates_cached():
+    descriptor = {'coordinates': {'time': {'dtype': 'float64', 'begin': 1.0, 'end': 2.0, 'length': 2,
+                                           'values': [1.0, 2.0]}}}
+    su = StorageUnit([], None, descriptor, 'test.nc')
+    assert su.coordinates['time'].length == 2
+    assert su.coordinates is su.coordinates
+    assert su.coordinate_values is su.coordinate_values
+    assert not su.coordinate_values['time'].flags.writeable
+
+    su.descriptor = {'coordinates': {'time': {'dtype': 'float64', 'begin': 1.0, 'end': 1.0, 'length': 1}}}
+    assert su.coordinates['time'].length == 1
+    assert su.coordinate_values == {}
+
+
+def test_geobox_coordinate_labels_cached():
+    geobox = GeoBox(4, 2, Affine(25.0, 0.0, 100.0, 0.0, -25.0, 200.0), 'EPSG:3577')
+    labels = geobox.coordinate_labels
+    assert labels is geobox.coordinate_labels
+    assert numpy.array_equal(labels['x'], [112.5, 137.5, 162.5, 187.5])
+    assert numpy.array_equal(labels['y'], [187.5, 162.5])
+    assert not labels['x'].flags.writeable
+    assert geobox.coordinates is geobox.coordinates
+    assert geobox.coordinates['x'].length == 4
+    assert not hasattr(geobox, '__dict__')